@@ -0,0 +1,296 @@
+"""Bulk reads from ArcGIS FeatureServer layers.
+
+The helpers in everylot.py fetch one record (or one id) at a time, which is
+right for picking a parcel but hopeless for caching, scanning or exporting a
+whole layer. iter_features splits a layer's ObjectId range into windows,
+fetches them concurrently, and streams the features back in order.
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import transport
+from pbf import decode_feature_collection
+
+logger = logging.getLogger("everylot.arcgis")
+
+# Concurrent window requests per reader. ArcGIS Online is happy with a handful;
+# more mostly buys throttling.
+MAX_WORKERS = 4
+
+# Used when the layer doesn't report a maxRecordCount.
+DEFAULT_WINDOW_SIZE = 1000
+
+# Attempts per window before the whole read fails.
+WINDOW_ATTEMPTS = 3
+
+
+def layer_url(query_url):
+    """The layer resource URL for a .../FeatureServer/N/query endpoint."""
+    return query_url[: -len("/query")] if query_url.endswith("/query") else query_url
+
+
+def get_layer_info(query_url):
+    """Fetch the layer's metadata (objectIdField, maxRecordCount, formats...)."""
+    response = transport.get(layer_url(query_url), params={"f": "json"}, timeout=30)
+    response.raise_for_status()
+    info = response.json()
+    if "error" in info:
+        raise requests.exceptions.RequestException(f"Layer info error: {info['error']}")
+    return info
+
+
+def supports_pbf(info):
+    formats = info.get("supportedQueryFormats", "")
+    return "pbf" in [f.strip().lower() for f in formats.split(",")]
+
+
+def get_object_id_range(query_url, object_id_field, where="1=1"):
+    """Return (min, max) ObjectId matching where, or None if nothing matches."""
+    statistics = [
+        {"statisticType": kind, "onStatisticField": object_id_field, "outStatisticFieldName": kind}
+        for kind in ("min", "max")
+    ]
+    params = {"where": where, "outStatistics": json.dumps(statistics), "f": "json"}
+    response = transport.get(query_url, params=params, timeout=30)
+    response.raise_for_status()
+    features = response.json().get("features", [])
+    if not features:
+        return None
+    attributes = features[0]["attributes"]
+    if attributes.get("min") is None:
+        return None
+    return int(attributes["min"]), int(attributes["max"])
+
+
+def object_id_windows(low, high, size):
+    """Split the inclusive ObjectId range [low, high] into half-open windows."""
+    return [(start, min(start + size, high + 1)) for start in range(low, high + 1, size)]
+
+
+def window_where(where, object_id_field, window):
+    start, end = window
+    return f"({where}) AND {object_id_field} >= {start} AND {object_id_field} < {end}"
+
+
+def get_object_ids(query_url, where="1=1", extra_params=None):
+    """Return the sorted ObjectIds matching where (one request; id-only
+    queries aren't capped by maxRecordCount). extra_params (e.g. a spatial
+    filter) are added to the query."""
+    params = {**(extra_params or {}), "where": where, "returnIdsOnly": "true", "f": "json"}
+    response = transport.get(query_url, params=params, timeout=60)
+    response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        raise requests.exceptions.RequestException(f"Query error: {data['error']}")
+    return sorted(data.get("objectIds") or [])
+
+
+class BulkReader:
+    """Reads one layer in chunks (ObjectId windows or id lists), preferring f=pbf.
+
+    If the server rejects pbf or sends something that won't decode, the chunk
+    is refetched as geojson and the rest of the read stays on geojson.
+    """
+
+    def __init__(self, query_url, object_id_field, out_fields="*", return_geometry=True,
+                 extra_params=None, prefer_pbf=True):
+        self.query_url = query_url
+        self.object_id_field = object_id_field
+        self.out_fields = out_fields
+        self.return_geometry = return_geometry
+        self.extra_params = extra_params or {}
+        self.use_pbf = prefer_pbf
+
+    def _params(self, selection, offset, fmt):
+        params = {
+            "outFields": self.out_fields,
+            "returnGeometry": "true" if self.return_geometry else "false",
+            "outSR": 4326,
+            "orderByFields": f"{self.object_id_field} ASC",
+            "f": fmt,
+        }
+        params.update(selection)
+        if offset:
+            params["resultOffset"] = offset
+        params.update(self.extra_params)
+        return params
+
+    def _fetch_page(self, selection, offset):
+        if self.use_pbf:
+            try:
+                response = transport.get(
+                    self.query_url, params=self._params(selection, offset, "pbf"), timeout=60
+                )
+                response.raise_for_status()
+                # An error reply is JSON even for f=pbf; a leading "{" can't
+                # start a valid message, so it fails to decode as a ValueError.
+                return decode_feature_collection(response.content)
+            except requests.exceptions.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if status is None or status == 429 or status >= 500:
+                    raise
+                logger.warning(f"pbf query rejected ({e}); falling back to geojson")
+                self.use_pbf = False
+            except ValueError as e:
+                logger.warning(f"pbf response didn't decode ({e}); falling back to geojson")
+                self.use_pbf = False
+
+        response = transport.get(
+            self.query_url, params=self._params(selection, offset, "geojson"), timeout=60
+        )
+        response.raise_for_status()
+        data = response.json()
+        if "error" in data:
+            raise requests.exceptions.RequestException(f"Query error: {data['error']}")
+        exceeded = data.get("exceededTransferLimit") or data.get("properties", {}).get(
+            "exceededTransferLimit", False
+        )
+        return data.get("features", []), bool(exceeded)
+
+    def fetch(self, selection):
+        """Fetch every feature matching selection (query params such as where
+        or objectIds), paging if the server stops short, with a few retries on
+        network errors."""
+        for attempt in range(1, WINDOW_ATTEMPTS + 1):
+            try:
+                features = []
+                while True:
+                    page, exceeded = self._fetch_page(selection, len(features))
+                    features.extend(page)
+                    if not exceeded or not page:
+                        return features
+            except requests.exceptions.RequestException as e:
+                if attempt == WINDOW_ATTEMPTS:
+                    raise
+                logger.warning(f"Chunk attempt {attempt}/{WINDOW_ATTEMPTS} failed: {e}")
+                time.sleep(2 ** attempt)
+
+    def stream(self, selections, max_workers=MAX_WORKERS):
+        """Fetch selections on up to max_workers threads, yielding features in
+        selection order with at most two chunks per worker in flight."""
+        selections = iter(selections)
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            pending = deque()
+            for selection in selections:
+                pending.append(pool.submit(self.fetch, selection))
+                if len(pending) >= max_workers * 2:
+                    break
+            while pending:
+                features = pending.popleft().result()
+                selection = next(selections, None)
+                if selection is not None:
+                    pending.append(pool.submit(self.fetch, selection))
+                yield from features
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _reader(query_url, info, out_fields, return_geometry, extra_params, prefer_pbf):
+    return BulkReader(
+        query_url,
+        info.get("objectIdField", "OBJECTID"),
+        out_fields=out_fields,
+        return_geometry=return_geometry,
+        extra_params=extra_params,
+        prefer_pbf=prefer_pbf and supports_pbf(info),
+    )
+
+
+def iter_features(query_url, where="1=1", out_fields="*", return_geometry=True,
+                  window_size=None, max_workers=MAX_WORKERS, prefer_pbf=True, extra_params=None):
+    """Stream every feature of a FeatureServer layer matching where.
+
+    The ObjectId range is split into windows of window_size (default: the
+    layer's maxRecordCount) fetched by up to max_workers threads. Features come
+    back as GeoJSON-style dicts in ObjectId order, with at most a couple of
+    windows per worker held in memory, however large the layer.
+    """
+    info = get_layer_info(query_url)
+    reader = _reader(query_url, info, out_fields, return_geometry, extra_params, prefer_pbf)
+    window_size = window_size or info.get("maxRecordCount") or DEFAULT_WINDOW_SIZE
+
+    object_id_range = get_object_id_range(query_url, reader.object_id_field, where)
+    if object_id_range is None:
+        return
+    selections = (
+        {"where": window_where(where, reader.object_id_field, window)}
+        for window in object_id_windows(*object_id_range, window_size)
+    )
+    yield from reader.stream(selections, max_workers)
+
+
+def iter_features_by_id(query_url, object_ids, out_fields="*", return_geometry=True,
+                        chunk_size=None, max_workers=MAX_WORKERS, prefer_pbf=True, extra_params=None):
+    """Stream the features with the given ObjectIds, like iter_features.
+
+    For sparse selections (e.g. recently edited parcels) this costs one request
+    per chunk_size ids, rather than one per window across the whole range.
+    """
+    info = get_layer_info(query_url)
+    reader = _reader(query_url, info, out_fields, return_geometry, extra_params, prefer_pbf)
+    # Long objectIds lists make long URLs; stay well under typical limits.
+    chunk_size = chunk_size or min(info.get("maxRecordCount") or DEFAULT_WINDOW_SIZE, 500)
+
+    object_ids = sorted(object_ids)
+    selections = (
+        {"where": "1=1", "objectIds": ",".join(str(i) for i in object_ids[start:start + chunk_size])}
+        for start in range(0, len(object_ids), chunk_size)
+    )
+    yield from reader.stream(selections, max_workers)
+
+
+def main():
+    # Layer names resolve to the services everylot.py uses.
+    import everylot
+
+    layers = {
+        "parcels": everylot.FEATURE_SERVICE_URL,
+        "centerlines": everylot.CENTERLINE_URL,
+        "buildings": everylot.BUILDINGS_URL,
+    }
+
+    parser = argparse.ArgumentParser(
+        description="Stream a FeatureServer layer to newline-delimited GeoJSON"
+    )
+    parser.add_argument("layer", help=f"one of {', '.join(layers)}, or a .../query URL")
+    parser.add_argument("--where", default="1=1", help="SQL filter for the layer")
+    parser.add_argument("--out-fields", default="*", help="comma-separated fields to include")
+    parser.add_argument("--no-geometry", action="store_true", help="skip feature geometry")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="concurrent requests")
+    parser.add_argument("--geojson", action="store_true", help="don't try f=pbf")
+    parser.add_argument("--output", default="-", help="output file (default stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        count = 0
+        for feature in iter_features(
+            layers.get(args.layer, args.layer),
+            where=args.where,
+            out_fields=args.out_fields,
+            return_geometry=not args.no_geometry,
+            max_workers=args.workers,
+            prefer_pbf=not args.geojson,
+        ):
+            out.write(json.dumps(feature) + "\n")
+            count += 1
+        logger.info(f"Wrote {count} features")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Offline benchmarks for the posting pipeline.
+
+Runs everylot.run repeatedly against the local stand-ins (see standins.py)
+with a chosen latency profile, and reports attempts per second, time per stage
+(from metrics.py), skip reasons, and requests per successful post:
+
+    python benchmark.py --runs 20 --profile lan
+
+`--compare-stage-order` runs the same benchmark once per everylot.STAGE_ORDER
+and reports the requests per post each one needs.
+
+`--startup` instead times `import everylot` in fresh interpreters, and checks
+that none of the heavy dependencies everylot imports lazily got loaded.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import everylot
+import metrics
+from standins import LATENCY_PROFILES, offline
+
+
+# Imported only by the stages that need them (see the top of everylot.py).
+HEAVY_MODULES = ("shapely", "numpy", "playwright", "atproto", "httpx", "asyncio")
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import everylot
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_startup(repeats=5):
+    """Time `import everylot` in repeats fresh interpreters."""
+    timings = []
+    loaded = set()
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SCRIPT],
+            capture_output=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return {
+        "repeats": repeats,
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "heavy_modules_loaded": sorted(loaded),
+    }
+
+
+def run_benchmark(runs=10, seed=0, parcels=400, coverage=0.5, profile="lan", stage_order=None):
+    """Run the offline pipeline runs times in a row (sharing run state, like
+    consecutive scheduled runs) and return the report dict.
+
+    stage_order overrides everylot.STAGE_ORDER for the benchmark.
+    """
+    metrics.reset()
+    previous_order = everylot.STAGE_ORDER
+    everylot.STAGE_ORDER = stage_order or previous_order
+    try:
+        with offline(seed, parcels, coverage, profile) as env, tempfile.TemporaryDirectory() as state:
+            attempts = posts = 0
+            start = time.perf_counter()
+            for _ in range(runs):
+                result = everylot.run(state_path=state, capture=env.capture)
+                attempts += result["attempts"]
+                posts += int(result["posted"])
+            elapsed = time.perf_counter() - start
+            bluesky_requests = env.atproto.requests
+        stage_order = everylot.STAGE_ORDER
+    finally:
+        everylot.STAGE_ORDER = previous_order
+
+    summary = metrics.summary()
+    requests = summary["counters"].get("http_requests", 0) + bluesky_requests
+    return {
+        "profile": profile,
+        "stage_order": stage_order,
+        "runs": runs,
+        "posts": posts,
+        "attempts": attempts,
+        # Attempts plus candidates prepared ahead that weren't needed.
+        "candidates": summary["counters"].get("candidates", 0),
+        "elapsed_seconds": elapsed,
+        "attempts_per_second": attempts / elapsed if elapsed else None,
+        "requests": requests,
+        "bluesky_requests": bluesky_requests,
+        "requests_per_post": requests / posts if posts else None,
+        "requests_per_attempt": requests / attempts if attempts else None,
+        "attempts_per_post": attempts / posts if posts else None,
+        "stages": summary["stages"],
+        "skips": summary["skips"],
+    }
+
+
+def compare_stage_orders(runs=10, seed=0, parcels=400, coverage=0.5, profile="lan"):
+    """Benchmark each stage order on the same city; returns {order: report}."""
+    return {
+        order: run_benchmark(runs, seed, parcels, coverage, profile, stage_order=order)
+        for order in ("anchor-first", "probe-first")
+    }
+
+
+def format_comparison(reports):
+    lines = [format_report(report) for report in reports.values()]
+    before, after = reports["anchor-first"], reports["probe-first"]
+    for key, label in (("requests_per_post", "post"), ("requests_per_attempt", "attempt")):
+        if before[key] and after[key]:
+            saving = 1 - after[key] / before[key]
+            change = f"{saving:.0%} fewer" if saving >= 0 else f"{-saving:.0%} more"
+            lines.append(
+                f"requests per {label}: anchor-first {before[key]:.1f}, "
+                f"probe-first {after[key]:.1f} ({change})"
+            )
+    return "\n\n".join(lines)
+
+
+def format_report(report):
+    def number(value, fmt):
+        return "n/a" if value is None else format(value, fmt)
+
+    lines = [
+        f"profile {report['profile']} ({report['stage_order']}): {report['runs']} runs, {report['posts']} posts, "
+        f"{report['attempts']} attempts in {report['elapsed_seconds']:.2f}s",
+        f"  attempts/sec        {number(report['attempts_per_second'], '.2f')}",
+        f"  attempts per post   {number(report['attempts_per_post'], '.2f')}",
+        f"  candidates prepared {report['candidates']}",
+        f"  requests per post   {number(report['requests_per_post'], '.1f')}",
+        f"  requests per attempt {number(report['requests_per_attempt'], '.1f')}",
+        f"  bluesky requests    {report['bluesky_requests']}",
+        "  stage               count    seconds       mean",
+    ]
+    for name, stage in report["stages"].items():
+        lines.append(
+            f"  {name:<18} {stage['count']:>6} {stage['seconds']:>10.3f} {stage['mean_seconds']:>10.4f}"
+        )
+    if report["skips"]:
+        lines.append("  skips: " + ", ".join(f"{k} {v}" for k, v in report["skips"].items()))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the posting pipeline offline")
+    parser.add_argument("--runs", type=int, default=10, help="consecutive runs to make")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the city and sampling")
+    parser.add_argument("--parcels", type=int, default=400, help="parcels in the synthetic city")
+    parser.add_argument("--coverage", type=float, default=0.5, help="share of streets with imagery")
+    parser.add_argument(
+        "--profile", default="lan", choices=sorted(LATENCY_PROFILES), help="injected latency"
+    )
+    parser.add_argument(
+        "--compare-stage-order",
+        action="store_true",
+        help="benchmark both stage orders and compare requests per post",
+    )
+    parser.add_argument(
+        "--startup", action="store_true", help="time importing everylot instead of running it"
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        help="with --startup, exit non-zero if the median import takes longer (seconds)",
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    if args.startup:
+        report = measure_startup(repeats=args.runs)
+        print(
+            json.dumps(report, indent=2)
+            if args.json
+            else f"import everylot: median {report['median_seconds'] * 1000:.0f} ms, "
+            f"min {report['min_seconds'] * 1000:.0f} ms over {report['repeats']} runs; "
+            f"heavy modules loaded: {', '.join(report['heavy_modules_loaded']) or 'none'}"
+        )
+        over_budget = args.startup_budget and report["median_seconds"] > args.startup_budget
+        sys.exit(1 if report["heavy_modules_loaded"] or over_budget else 0)
+
+    if args.compare_stage_order:
+        reports = compare_stage_orders(
+            args.runs, args.seed, args.parcels, args.coverage, args.profile
+        )
+        print(json.dumps(reports, indent=2) if args.json else format_comparison(reports))
+        return
+
+    report = run_benchmark(args.runs, args.seed, args.parcels, args.coverage, args.profile)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@ from atproto import Client
 from atproto_client.exceptions import InvokeTimeoutError, NetworkError
 from typing import List, Dict
 
+import metrics
+
 logger = logging.getLogger("everylot.bluesky")
 
 # The atproto/Bluesky API occasionally times out (e.g. while uploading an image
@@ -20,6 +22,9 @@ RETRYABLE_ERRORS = (
 )
 MAX_POST_ATTEMPTS = 4
 
+# Images per post allowed by app.bsky.embed.images.
+MAX_IMAGES = 4
+
 def parse_urls(text: str) -> List[Dict]:
     spans = []
     # partial/naive URL regex based on: https://stackoverflow.com/a/3809435
@@ -68,6 +73,7 @@ def post_to_bluesky(username, password, text, image_paths=None, image_alt_texts=
             if attempt == MAX_POST_ATTEMPTS:
                 break
             wait = 2 ** attempt
+            metrics.count("bluesky_retries")
             logger.warning(
                 f"Bluesky post attempt {attempt}/{MAX_POST_ATTEMPTS} failed "
                 f"({type(e).__name__}); retrying in {wait}s..."
@@ -79,7 +85,7 @@ def post_to_bluesky(username, password, text, image_paths=None, image_alt_texts=
 
 def _post_to_bluesky(username, password, text, image_paths=None, image_alt_texts=None, reply_to=None):
     """
-    Post to Bluesky with text and up to two images.
+    Post to Bluesky with text and up to four images.
 
     Parameters:
     - username: Bluesky handle (e.g., 'username.bsky.social')
@@ -102,11 +108,16 @@ def _post_to_bluesky(username, password, text, image_paths=None, image_alt_texts
     if not text and not image_paths:
         raise ValueError("Either text or at least one image is required for a post")
 
+    if image_paths and len(image_paths) > MAX_IMAGES:
+        raise ValueError(f"A post can carry at most {MAX_IMAGES} images")
+
     image_alt_texts = image_alt_texts or []
 
-    # Initialize the client and login
-    client = Client()
-    client.login(username, password)
+    # Initialize the client and login. BLUESKY_BASE_URL can point the client
+    # at another PDS (e.g. the local stand-in used by offline runs).
+    client = Client(base_url=os.environ.get("BLUESKY_BASE_URL"))
+    with metrics.timer("bluesky_login"):
+        client.login(username, password)
 
     # Prepare images if provided
     image_uploads = []
@@ -118,7 +129,8 @@ def _post_to_bluesky(username, password, text, image_paths=None, image_alt_texts
             # Upload the image to Bluesky
             with open(image_path, "rb") as f:
                 image_data = f.read()
-                upload = client.com.atproto.repo.upload_blob(image_data)
+                with metrics.timer("bluesky_upload"):
+                    upload = client.com.atproto.repo.upload_blob(image_data)
                 image_uploads.append(
                     {
                         "image": upload.blob,
@@ -159,12 +171,13 @@ def _post_to_bluesky(username, password, text, image_paths=None, image_alt_texts
         }
         
     # Create the post
-    response = client.com.atproto.repo.create_record(
-        {
-            "repo": client.me.did,
-            "collection": "app.bsky.feed.post",
-            "record": record,
-        }
-    )
+    with metrics.timer("bluesky_post"):
+        response = client.com.atproto.repo.create_record(
+            {
+                "repo": client.me.did,
+                "collection": "app.bsky.feed.post",
+                "record": record,
+            }
+        )
 
     return response
\ No newline at end of file
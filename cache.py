@@ -0,0 +1,264 @@
+"""Lookup cache shared by every process on the machine.
+
+Parallel export workers and scanners look up the same neighborhoods: the same
+streets' centerlines, the same buildings, overlapping Mapillary boxes. With
+CachingTransport installed over the usual transport (see transport.py), the
+geocoder, building, centerline and Mapillary responses go through a
+SharedCache, a SQLite database in WAL mode. Readers don't block the writer, so
+any number of processes (and threads) can share one file, and each response
+is written in a single transaction.
+
+Entries expire after their service's TTL (imagery sooner than the city's base
+layers). The database is kept under max_bytes by dropping the least recently
+used entries; a hit counts as a use, though it's only written back once the
+entry's last use is TOUCH_AFTER old, so hits don't queue up behind each
+other's writes. Only successful answers are cached, never errors or
+throttling, and neither the cache key nor the stored body holds access tokens
+(see transport.request_key and transport.redact_body).
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+import transport
+
+logger = logging.getLogger("everylot.cache")
+
+DAY = 24 * 60 * 60
+
+# Seconds a response stays fresh, by service. The BaseUnit layers change
+# rarely; new Mapillary imagery shows up daily.
+DEFAULT_TTLS = {
+    "geocoder": 30 * DAY,
+    "buildings": 30 * DAY,
+    "centerlines": 30 * DAY,
+    "mapillary": 1 * DAY,
+}
+
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# Eviction runs every this many stores (per process), rather than on each one.
+EVICT_EVERY = 100
+
+# A hit records its use only when the entry's last recorded use is at least
+# this old (seconds). Eviction only needs a rough recency order, and a write on
+# every hit would take SQLite's single write lock for each read.
+TOUCH_AFTER = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    service TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at);
+"""
+
+
+def service_of(url):
+    """The DEFAULT_TTLS service a URL's responses are cached under, or None if
+    they aren't cached (parcels, posts and anything else)."""
+    import everylot
+
+    if url.startswith(everylot.GEOCODER_URL):
+        return "geocoder"
+    if url.startswith(everylot.BUILDINGS_URL):
+        return "buildings"
+    if url.startswith(everylot.CENTERLINE_URL):
+        return "centerlines"
+    if url.startswith(everylot.MAPILLARY_IMAGES_URL):
+        return "mapillary"
+    return None
+
+
+def cache_key(url, params=None):
+    return hashlib.sha256(transport.request_key(url, params).encode("utf-8")).hexdigest()
+
+
+class SharedCache:
+    """Responses by cache_key in a SQLite database any number of processes
+    can share. Each thread gets its own connection."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, ttls=None, touch_after=TOUCH_AFTER):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_after = touch_after
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._stores = 0
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Wait out other processes' writes rather than failing on a lock.
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def fetch(self, key, service):
+        """(status, headers, body) cached under key, or None if there's none
+        fresh by service's TTL."""
+        now = time.time()
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT status, headers, body, used_at FROM responses WHERE key = ? AND stored_at >= ?",
+            (key, now - self.ttls[service]),
+        ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, used_at = row
+        if used_at <= now - self.touch_after:
+            with connection:
+                connection.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+        return status, json.loads(headers), body
+
+    def store(self, key, service, status, headers, body):
+        """Cache a response under key, replacing any older one."""
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, service, status, headers, body, size, stored_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, service, status, json.dumps(headers), body, len(body), now, now),
+            )
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used until the
+        cached bodies fit max_bytes. Returns how many entries were dropped."""
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            dropped = 0
+            for service, ttl in self.ttls.items():
+                dropped += connection.execute(
+                    "DELETE FROM responses WHERE service = ? AND stored_at < ?",
+                    (service, now - ttl),
+                ).rowcount
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                stale = []
+                for key, size in connection.execute("SELECT key, size FROM responses ORDER BY used_at"):
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= size
+                connection.executemany("DELETE FROM responses WHERE key = ?", stale)
+                dropped += len(stale)
+        return dropped
+
+    def stats(self):
+        """Entries and cached bytes per service."""
+        rows = self.connection().execute(
+            "SELECT service, COUNT(*), SUM(size) FROM responses GROUP BY service ORDER BY service"
+        )
+        return {service: {"entries": entries, "bytes": size} for service, entries, size in rows}
+
+
+def _cacheable(response):
+    """Whether a response is a real answer: a 200 that isn't an ArcGIS or
+    Graph API error payload."""
+    if response.status_code != 200:
+        return False
+    try:
+        data = response.json()
+    except ValueError:
+        return False
+    return not (isinstance(data, dict) and "error" in data)
+
+
+class CachingTransport:
+    """Answer the services in DEFAULT_TTLS from a SharedCache, passing misses
+    (and everything else) to another transport."""
+
+    def __init__(self, inner, cache):
+        self.inner = inner
+        self.cache = cache
+
+    def _cached(self, url, params):
+        service = service_of(url)
+        if service is None:
+            return None, None, None
+        key = cache_key(url, params)
+        hit = self.cache.fetch(key, service)
+        if hit is None:
+            metrics.count("lookup_cache_misses")
+            return service, key, None
+        metrics.count("lookup_cache_hits")
+        status, headers, body = hit
+        return service, key, transport.make_response(url, status, body, headers)
+
+    def _store(self, service, key, response):
+        if key is not None and _cacheable(response):
+            headers = {
+                h: response.headers[h] for h in transport.RECORDED_HEADERS if h in response.headers
+            }
+            self.cache.store(
+                key, service, response.status_code, headers, transport.redact_body(response.content)
+            )
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        service, key, response = self._cached(url, params)
+        if response is None:
+            response = self.inner.get(url, params=params, timeout=timeout, **kwargs)
+            self._store(service, key, response)
+        return response
+
+    async def aget(self, url, params=None, timeout=30, **kwargs):
+        service, key, response = self._cached(url, params)
+        if response is None:
+            if hasattr(self.inner, "aget"):
+                response = await self.inner.aget(url, params=params, timeout=timeout, **kwargs)
+            else:
+                import asyncio
+
+                response = await asyncio.to_thread(
+                    self.inner.get, url, params=params, timeout=timeout, **kwargs
+                )
+            self._store(service, key, response)
+        return response
+
+    async def aclose(self):
+        if hasattr(self.inner, "aclose"):
+            await self.inner.aclose()
+
+
+def install(path, max_bytes=DEFAULT_MAX_BYTES):
+    """Put a CachingTransport over the installed transport, caching in the
+    SharedCache at path (created if missing). Returns the cache."""
+    cache = SharedCache(path, max_bytes)
+    transport.set_transport(CachingTransport(transport.current(), cache))
+    logger.info(f"Caching lookups in {path}")
+    return cache
@@ -1,18 +1,28 @@
-import asyncio
+import argparse
+import collections
+import contextlib
 import datetime
+import json
 import logging
 import os
 import random
 import requests
-import sys
 import time
 from pathlib import Path
 
-from shapely.geometry import shape, Point
-
 from bearings import compute_viewer_center
-from bluesky import post_to_bluesky
-from screenshot import capture_screenshots
+from ledger import Ledger
+import metrics
+import profiling
+from ratelimit import Throttled
+from sampling import COVERAGE_FLOOR, CoverageModel, CoverageSampler, PermutationSampler, SamplerExhausted
+from screenshot_cache import DEFAULT_MAX_BYTES, ScreenshotCache, cached
+import transport
+
+# shapely, playwright (screenshot.py), atproto (bluesky.py) and even asyncio
+# are slow to import, so they're imported in the functions that use them: a run
+# that never reaches a stage doesn't pay for its dependencies.
+# tests/test_startup.py keeps it that way.
 
 logger = logging.getLogger("everylot")
 
@@ -20,6 +30,46 @@ logger = logging.getLogger("everylot")
 PROJECT_PATH = str(Path(__file__).parent.absolute())
 FEATURE_SERVICE_URL = "https://services2.arcgis.com/qvkbeam7Wirps6zC/arcgis/rest/services/parcel_file_current/FeatureServer/0/query"
 
+# Run-to-run state (e.g. the ledger of posted/unusable parcels) lives here. The
+# Actions workflow caches this directory between scheduled runs.
+STATE_PATH = os.environ.get("EVERYLOT_STATE_DIR", f"{PROJECT_PATH}/state")
+LEDGER_FILE = "ledger.json"
+SAMPLER_FILE = "sampler.json"
+COVERAGE_FILE = "coverage.json"
+
+# JSON summary of each run's stage timings, request counts and skip reasons.
+RUN_SUMMARY_PATH = os.environ.get("EVERYLOT_RUN_SUMMARY", f"{STATE_PATH}/run_summary.json")
+
+# A SharedCache database (see cache.py) for the geocoder, building, centerline
+# and Mapillary lookups, shared by every process pointed at it. Unset, nothing
+# is cached.
+LOOKUP_CACHE_PATH = os.environ.get("EVERYLOT_CACHE")
+
+# Each run's manifest (see manifest.py), with the run's recorded responses
+# beside it; `python everylot.py --replay` reruns one. Kept out of the state
+# directory, which the Actions workflow caches between runs.
+MANIFEST_PATH = os.environ.get("EVERYLOT_MANIFEST", f"{PROJECT_PATH}/runs/manifest.json")
+
+# Where --profile writes its per-attempt profiles (see profiling.py).
+PROFILE_PATH = os.environ.get("EVERYLOT_PROFILE_DIR", f"{PROJECT_PATH}/profiles")
+
+# How parcel offsets are drawn: "permutation" tries every parcel once before
+# any repeats; "coverage" favors stretches of the parcel list that have yielded
+# before/after pairs before, giving every stretch at least the floor weight.
+SAMPLER = os.environ.get("EVERYLOT_SAMPLER", "permutation")
+COVERAGE_FLOOR = float(os.environ.get("EVERYLOT_COVERAGE_FLOOR", COVERAGE_FLOOR))
+
+# Order of the per-parcel lookups. "probe-first" makes one Mapillary request
+# around the parcel centroid and checks the raw capture dates for a possible
+# pair before spending geocoder/building/centerline requests on the parcel;
+# "anchor-first" resolves the anchors first and searches around the frontage
+# (the old order, kept for comparison: `python benchmark.py --compare-stage-order`).
+# The probe pays off when most parcels fail, as they do live. Over seeds 0-4
+# of the stand-in city it saves 3-49% of requests per post at 30% coverage,
+# and roughly breaks even (12% more to 9% fewer) at 50%, where nearly every
+# parcel posts.
+STAGE_ORDER = os.environ.get("EVERYLOT_STAGE_ORDER", "probe-first")
+
 # Detroit BaseUnit services used to find a better vantage point for a parcel:
 # geocode the address -> street_id + building_id, then pull the matching street
 # centerline segment and building footprint. See plan: aim the camera at the
@@ -33,21 +83,117 @@ BUILDINGS_URL = "https://services2.arcgis.com/qvkbeam7Wirps6zC/ArcGIS/rest/servi
 # the parcel centroid rather than trusting a weak match).
 GEOCODE_MIN_SCORE = 80
 
+# The parcel fields a post uses; the parcel fetch asks for just these, plus the
+# parcel's centroid rather than its polygon.
+PARCEL_FIELDS = ("ObjectId", "address", "parcel_id", "year_built", "zoning_district", "tax_status")
+
+MAPILLARY_IMAGES_URL = "https://graph.mapillary.com/images"
+
+# Mapillary images are searched for in a box around the selection anchor: a
+# tight box first, widened while it holds fewer than MAPILLARY_MIN_SEQUENCES
+# sequences (a pair needs two to survive the distance filters in build_post)
+# or no sequences far enough apart for a pair (see has_possible_pair). Half-widths in degrees, roughly 20m, 55m and 110m.
+MAPILLARY_SEARCH_RADII = (0.0002, 0.0005, 0.001)
+MAPILLARY_MIN_SEQUENCES = 3
+
+# How far (per axis, in degrees: roughly 40m east-west, 55m north-south) the
+# street frontage anchor can sit from the parcel centroid: a building's
+# setback and depth plus half the street.
+MAPILLARY_ANCHOR_MARGIN = 0.0005
+
+# Half-width of the probe around the parcel centroid (see STAGE_ORDER). It
+# covers the widest search box around any anchor within MAPILLARY_ANCHOR_MARGIN,
+# so the probe only rejects parcels the anchor search would reject too.
+MAPILLARY_PROBE_RADIUS = MAPILLARY_SEARCH_RADII[-1] + MAPILLARY_ANCHOR_MARGIN
+
+# Images per request, and the most pages followed for one box (a dense
+# downtown block can hold more than a page).
+MAPILLARY_PAGE_SIZE = 1000
+MAPILLARY_MAX_PAGES = 5
+
+# Image fields, by the stage that reads them. Ranking and pairing need each
+# image's sequence, date and position; aiming needs its compass angle. The
+# anchor search feeds both, so it asks for both lists and nothing else.
+MAPILLARY_RANKING_FIELDS = ("id", "sequence", "captured_at", "computed_geometry", "geometry")
+MAPILLARY_AIMING_FIELDS = ("computed_compass_angle",)
+MAPILLARY_SEARCH_FIELDS = ",".join(MAPILLARY_RANKING_FIELDS + MAPILLARY_AIMING_FIELDS)
+
+# The probe only checks capture dates per sequence (see has_possible_pair), so
+# it skips the geometry and angles that make up most of a search response.
+MAPILLARY_PROBE_FIELDS = "sequence,captured_at"
+
+# The before and after images must be at least this far apart (milliseconds).
+PAIR_MIN_GAP_MS = 3 * 365 * 24 * 60 * 60 * 1000
+
+# Besides the pair, the ranking keeps a series of the nearest image per era
+# from the same images: up to MAX_SERIES_IMAGES (Bluesky's limit per post),
+# each at least SERIES_MIN_GAP_MS from the others. How it's posted is up to
+# POST_LAYOUT: "pair" posts just the before/after pair, "carousel" posts the
+# whole series in one post, and "follow-up" posts the pair, then the rest of
+# the series in a reply.
+MAX_SERIES_IMAGES = 4
+SERIES_MIN_GAP_MS = 2 * 365 * 24 * 60 * 60 * 1000
+POST_LAYOUTS = ("pair", "carousel", "follow-up")
+POST_LAYOUT = os.environ.get("EVERYLOT_POST_LAYOUT", "pair")
+
+# Bluesky's limit on a post's text, in graphemes. Counting code points instead
+# errs on the safe side (a grapheme is at least one code point).
+MAX_POST_TEXT = 300
+
 # How many random parcels to try before giving up for this run. Most random
 # parcels won't have a Mapillary before/after pair, so we keep sampling until
 # one does (or we run out of attempts).
 MAX_PARCEL_ATTEMPTS = 15
 
+# How many parcels the ledger already lists (posted or unusable) a candidate
+# passes over, drawing another offset for each, before it gives up as an
+# in_ledger skip. Passing one over costs its parcel fetch but not an attempt.
+MAX_LEDGER_REDRAWS = 20
+
 # Hard ceiling on the headless-browser screenshot step so a hung Mapillary
 # viewer can't stall the whole run (the missing-file check then skips the parcel).
 SCREENSHOT_TIMEOUT = 120
 
+# Rendered screenshots are cached in this folder of the state directory (see
+# screenshot_cache.py), so a run that lands on a pair rendered before, such as
+# a retry after a failed post, doesn't start the browser.
+SCREENSHOT_CACHE_DIR = "screenshots"
+SCREENSHOT_CACHE_MAX_BYTES = int(
+    os.environ.get("EVERYLOT_SCREENSHOT_CACHE_BYTES", DEFAULT_MAX_BYTES)
+)
+
+# Candidates prepared ahead (sampled, anchored, ranked and aimed) while the
+# current one's screenshots are captured, so a failed capture falls through to
+# an already-vetted candidate. 0 prepares them one at a time.
+PREFETCH_CANDIDATES = int(os.environ.get("EVERYLOT_PREFETCH", 2))
+
+# How screenshots are rendered when build_post isn't given a capture function:
+# "browser" drives mapillary-js in headless Chromium (screenshot.py);
+# "panorama" reprojects the image's equirectangular thumbnail locally
+# (panorama.py), with no browser.
+CAPTURE_BACKENDS = ("browser", "panorama")
+CAPTURE_BACKEND = os.environ.get("EVERYLOT_CAPTURE", "browser")
+
 
 class SkipParcel(Exception):
     """Raised when a randomly chosen parcel can't yield a valid before/after pair.
 
     This is an expected, non-fatal outcome: the caller should simply try another
-    random parcel rather than failing the run.
+    random parcel rather than failing the run. category is a short, stable
+    reason (e.g. "no_imagery") that the run summary tallies skips by.
+    """
+
+    def __init__(self, message, category="other"):
+        super().__init__(message)
+        self.category = category
+
+
+class UnusableParcel(SkipParcel):
+    """A SkipParcel caused by the parcel's own data (no imagery, no before/after
+    pair, an already-posted image pair) rather than a transient failure.
+
+    prepare_post records these in the ledger so later runs skip the parcel
+    without spending any further requests on it.
     """
 
 
@@ -60,10 +206,34 @@ def parcel_attr(props, key, default="Unknown"):
     return value
 
 
+def _blocking(lookup, *args):
+    """Call one of the async lookups below with blocking requests and return
+    its result.
+
+    Each lookup is written once, as a coroutine that makes its requests through
+    a fetch function (transport.aget by default). Given one that blocks, the
+    coroutine never suspends, so it runs to completion in a single step with no
+    event loop; that's how the sync versions (used by export threads and
+    scripts) share the run's code.
+    """
+    coroutine = lookup(*args, fetch=_blocking_fetch)
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    coroutine.close()
+    raise RuntimeError(f"{lookup.__name__} awaited something other than its requests")
+
+
+async def _blocking_fetch(url, params=None, timeout=30, **kwargs):
+    return transport.get(url, params=params, timeout=timeout, **kwargs)
+
+
 def get_parcel_count():
     """Return the total number of parcels in the feature service."""
     params = {"where": "1=1", "returnCountOnly": "true", "f": "json"}
-    response = requests.get(FEATURE_SERVICE_URL, params=params, timeout=30)
+    with metrics.timer("parcel_count"):
+        response = transport.get(FEATURE_SERVICE_URL, params=params, timeout=30)
     response.raise_for_status()
     return response.json()["count"]
 
@@ -86,31 +256,100 @@ def get_parcel_count_with_retry(attempts=3):
     raise last_error
 
 
-def get_random_parcel(parcel_count):
+def get_random_parcel(parcel_count, sampler=None):
     """Fetch a parcel at a random offset within the feature service.
 
     Selecting by offset (rather than guessing a possibly-nonexistent ObjectId)
     guarantees a real parcel, so every attempt is spent on the part that matters:
     whether the parcel has a usable before/after image pair. ArcGIS requires an
     orderByFields for stable paging when resultOffset is used.
+
+    The offset comes from sampler.next_offset() when a sampler is given (e.g. a
+    PermutationSampler, to avoid repeats), otherwise uniformly at random.
     """
-    offset = random.randint(0, parcel_count - 1)
+    return _blocking(get_random_parcel_async, parcel_count, sampler)
+
+
+async def get_random_parcel_async(parcel_count, sampler=None, fetch=None):
+    """get_random_parcel, awaiting the request on the run's event loop."""
+    return await get_parcel_async(_parcel_offset(parcel_count, sampler), fetch)
 
+
+def get_parcel(offset):
+    """Fetch the parcel at offset (in ObjectId order); raises SkipParcel if
+    there's none.
+
+    The feature has PARCEL_FIELDS as its properties and a "centroid" ([x, y],
+    computed by the server) instead of a geometry. If the layer won't return
+    centroids, its geometry is fetched instead.
+    """
+    return _blocking(get_parcel_async, offset)
+
+
+async def get_parcel_async(offset, fetch=None):
+    """get_parcel, awaiting the request on the run's event loop."""
+    fetch = fetch or transport.aget
+    with metrics.timer("parcel_fetch"):
+        response = await fetch(FEATURE_SERVICE_URL, params=_parcel_params(offset), timeout=30)
+        parcel = _parcel_with_centroid(response, offset)
+        if parcel is None:
+            response = await fetch(
+                FEATURE_SERVICE_URL, params=_parcel_params(offset, centroid=False), timeout=30
+            )
+            parcel = _parcel_result(response, offset)
+    return parcel
+
+
+def _parcel_offset(parcel_count, sampler):
+    if sampler is not None:
+        return sampler.next_offset()
+    return random.randint(0, parcel_count - 1)
+
+
+def _parcel_params(offset, centroid=True):
     params = {
-        "outFields": "*",
+        "outFields": ",".join(PARCEL_FIELDS),
         "where": "1=1",
         "orderByFields": "ObjectId ASC",
         "resultOffset": offset,
         "resultRecordCount": 1,
-        "f": "geojson",
     }
-
-    response = requests.get(FEATURE_SERVICE_URL, params=params, timeout=30)
+    if centroid:
+        # returnCentroid only works with Esri JSON (not geojson or pbf), which
+        # comes back in the layer's own spatial reference unless told otherwise.
+        params.update(returnGeometry="false", returnCentroid="true", outSR=4326, f="json")
+    else:
+        params["f"] = "geojson"
+    return params
+
+
+def _parcel_with_centroid(response, offset):
+    """The parcel in a centroid query's Esri JSON response, as a GeoJSON-style
+    feature with a "centroid"; None if the layer didn't return one."""
     response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        logger.warning(f"Parcel centroid query failed, fetching geometry instead: {data['error']}")
+        return None
+    features = data.get("features", [])
+    if not features:
+        raise SkipParcel(f"no parcel at offset {offset}", "no_parcel")
+    centroid = features[0].get("centroid")
+    if not centroid:
+        return None
+    return {
+        "type": "Feature",
+        "properties": features[0].get("attributes", {}),
+        "geometry": None,
+        "centroid": [centroid["x"], centroid["y"]],
+    }
 
+
+def _parcel_result(response, offset):
+    response.raise_for_status()
     features = response.json().get("features", [])
     if not features:
-        raise SkipParcel(f"no parcel at offset {offset}")
+        raise SkipParcel(f"no parcel at offset {offset}", "no_parcel")
     return features[0]
 
 
@@ -120,17 +359,33 @@ def geocode_parcel(address):
     Returns a dict {street_id, building_id, location, score} for the top
     candidate, or None if there is no candidate clearing GEOCODE_MIN_SCORE or on
     any network/parse error. Callers fall back to the parcel centroid on None.
+    Being rate limited isn't such an error: Throttled propagates, since the
+    fallback would quietly make a worse post.
     """
-    params = {"SingleLine": address, "outFields": "*", "f": "json"}
+    return _blocking(geocode_parcel_async, address)
 
+
+async def geocode_parcel_async(address, fetch=None):
+    """geocode_parcel, awaiting the request on the run's event loop."""
+    fetch = fetch or transport.aget
     try:
-        response = requests.get(GEOCODER_URL, params=params, timeout=30)
-        response.raise_for_status()
-        candidates = response.json().get("candidates", [])
+        with metrics.timer("geocode"):
+            response = await fetch(GEOCODER_URL, params=_geocode_params(address), timeout=30)
+        return _geocode_result(response, address)
+    except Throttled:
+        raise
     except (requests.exceptions.RequestException, ValueError) as e:
         logger.warning(f"Geocoder error for {address!r}: {e}")
         return None
 
+
+def _geocode_params(address):
+    return {"SingleLine": address, "outFields": "*", "f": "json"}
+
+
+def _geocode_result(response, address):
+    response.raise_for_status()
+    candidates = response.json().get("candidates", [])
     if not candidates:
         logger.info(f"No geocoder candidates for {address!r}")
         return None
@@ -152,46 +407,85 @@ def geocode_parcel(address):
 
 
 def get_building_centroid(building_id):
-    """Return the WGS84 centroid (shapely Point) of a building polygon, or None."""
-    params = {
-        "where": f"building_id={building_id}",
-        "outFields": "building_id",
-        "f": "geojson",
-    }
+    """Return the WGS84 centroid (shapely Point) of a building polygon, or None
+    (on errors too, except Throttled, as in geocode_parcel)."""
+    return _blocking(get_building_centroid_async, building_id)
 
+
+async def get_building_centroid_async(building_id, fetch=None):
+    """get_building_centroid, awaiting the request on the run's event loop."""
+    fetch = fetch or transport.aget
     try:
-        response = requests.get(BUILDINGS_URL, params=params, timeout=30)
-        response.raise_for_status()
-        features = response.json().get("features", [])
+        with metrics.timer("building"):
+            response = await fetch(BUILDINGS_URL, params=_building_params(building_id), timeout=30)
+        features = _features(response)
+    except Throttled:
+        raise
     except (requests.exceptions.RequestException, ValueError) as e:
         logger.warning(f"Building lookup error for building_id={building_id}: {e}")
         return None
+    return _building_centroid(features)
+
 
+def _building_params(building_id):
+    return {
+        "where": f"building_id={building_id}",
+        "outFields": "building_id",
+        "f": "geojson",
+    }
+
+
+def _building_centroid(features):
     if not features:
         return None
+
+    from shapely.geometry import shape
+
     return shape(features[0]["geometry"]).centroid
 
 
+def _features(response):
+    """The features of a GeoJSON query response."""
+    response.raise_for_status()
+    return response.json().get("features", [])
+
+
 def get_street_segment(street_id, near_point):
     """Return the centerline segment (shapely LineString) for street_id nearest
     to near_point, or None if nothing is returned / on error.
 
     A street_id can span several block segments, so we pick the one closest to
-    near_point (the building or parcel centroid).
+    near_point (the building or parcel centroid). Throttled propagates, as in
+    geocode_parcel.
     """
-    params = {
-        "where": f"street_id={street_id}",
-        "outFields": "full_street_name",
-        "f": "geojson",
-    }
+    return _blocking(get_street_segment_async, street_id, near_point)
+
 
+async def get_street_segment_async(street_id, near_point, fetch=None):
+    """get_street_segment, awaiting the request on the run's event loop."""
+    fetch = fetch or transport.aget
     try:
-        response = requests.get(CENTERLINE_URL, params=params, timeout=30)
-        response.raise_for_status()
-        features = response.json().get("features", [])
+        with metrics.timer("centerline"):
+            response = await fetch(CENTERLINE_URL, params=_centerline_params(street_id), timeout=30)
+        features = _features(response)
+    except Throttled:
+        raise
     except (requests.exceptions.RequestException, ValueError) as e:
         logger.warning(f"Centerline lookup error for street_id={street_id}: {e}")
         return None
+    return _nearest_segment(features, near_point)
+
+
+def _centerline_params(street_id):
+    return {
+        "where": f"street_id={street_id}",
+        "outFields": "full_street_name",
+        "f": "geojson",
+    }
+
+
+def _nearest_segment(features, near_point):
+    from shapely.geometry import shape
 
     # Collect individual LineStrings; flatten MultiLineStrings defensively.
     segments = []
@@ -212,57 +506,176 @@ def frontage_point(segment, near_point):
     return segment.interpolate(segment.project(near_point))
 
 
-def get_mapillary_images(lon: float, lat: float, max_results: int = 1000):
+def get_mapillary_images(
+    lon: float,
+    lat: float,
+    radius: float = MAPILLARY_SEARCH_RADII[1],
+    max_results: int = MAPILLARY_PAGE_SIZE * MAPILLARY_MAX_PAGES,
+    fields: str = MAPILLARY_SEARCH_FIELDS,
+):
     """
     Query Mapillary API for images near a given point.
 
     Args:
         lon: Longitude
         lat: Latitude
+        radius: Half-width of the search box, in degrees
         max_results: Maximum number of images to return
+        fields: Comma-separated image fields to return
 
     Returns:
-        List of Mapillary images near the parcel centroid
+        List of Mapillary images in the box, following the API's paging
+        cursor when the box holds more than one page
+
+    Raises:
+        requests.exceptions.RequestException: a page couldn't be fetched;
+            Throttled if the API kept rate limiting the search (see
+            ratelimit.py). Either way the box isn't known to be empty, so
+            the caller treats it as transient rather than as no imagery.
     """
+    return _blocking(get_mapillary_images_async, lon, lat, radius, max_results, fields)
+
+
+async def get_mapillary_images_async(
+    lon: float,
+    lat: float,
+    radius: float = MAPILLARY_SEARCH_RADII[1],
+    max_results: int = MAPILLARY_PAGE_SIZE * MAPILLARY_MAX_PAGES,
+    fields: str = MAPILLARY_SEARCH_FIELDS,
+    fetch=None,
+):
+    """get_mapillary_images, awaiting each page on the run's event loop."""
+    fetch = fetch or transport.aget
+    images = []
+    url, params = MAPILLARY_IMAGES_URL, _mapillary_params(lon, lat, radius, max_results, fields)
+    token = params["access_token"]
+    # A failed page isn't caught here: the images found so far would read as
+    # the whole box, and a box that couldn't be searched as one with no
+    # imagery, which gets the parcel written off in the ledger.
+    for _ in range(MAPILLARY_MAX_PAGES):
+        with metrics.timer("mapillary"):
+            response = await fetch(url, params=params, timeout=30)
+        url = _mapillary_page(response, images, max_results)
+        if url is None:
+            break
+        params = {"access_token": token}
+    return _mapillary_result(images, lon, lat, radius, max_results)
+
 
+def _mapillary_params(lon, lat, radius, max_results, fields):
     # Mapillary API requires an access token
     access_token = os.environ.get("MAPILLARY_ACCESS_TOKEN", None)
     if not access_token:
         raise Exception("Error: MAPILLARY_ACCESS_TOKEN environment variable not set")
 
-    # Mapillary API endpoint for image search
-    url = "https://graph.mapillary.com/images"
-
-    # a very small distance in degrees to search around
-    degree_distance = 0.0005
-
     # Parameters for the Mapillary Image API request
-    params = {
+    return {
         "access_token": access_token,
-        "fields": "id,captured_at,computed_geometry,geometry,computed_compass_angle,computed_rotation,sequence",
+        "fields": fields,
         "is_pano": "true",
-        "limit": max_results,
+        "limit": min(max_results, MAPILLARY_PAGE_SIZE),
 
-        # bbox = centroid +- degree_distance
-        "bbox": f"{lon-degree_distance},{lat-degree_distance},{lon+degree_distance},{lat+degree_distance}",
+        # bbox = point +- radius
+        "bbox": f"{lon-radius},{lat-radius},{lon+radius},{lat+radius}",
     }
 
-    try:
-        response = requests.get(url, params=params, timeout=30)
-        response.raise_for_status()
-        data = response.json()
 
-        if "data" in data and len(data["data"]) > 0:
-            logger.info(f"Found {len(data['data'])} Mapillary images within {degree_distance}deg of parcel centroid")
-            return data["data"]
-        else:
-            logger.info(
-                f"No Mapillary images found within {degree_distance}deg of parcel centroid"
-            )
-            return []
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"Error querying Mapillary API: {e}")
-        return []
+def _mapillary_page(response, images, max_results):
+    """Add a page of results to images; returns the next page's URL (minus
+    the access token, which has to be passed again), or None when this was
+    the last page needed."""
+    response.raise_for_status()
+    data = response.json()
+    images.extend(data.get("data", []))
+
+    # The next page's URL carries the whole query. Its token is dropped: a
+    # cached or recorded page has had it stripped already (see
+    # transport.redact_body), so the caller always passes its own.
+    next_url = (data.get("paging") or {}).get("next")
+    if not next_url or len(images) >= max_results:
+        return None
+    return transport.redact_url(next_url)
+
+
+def _mapillary_result(images, lon, lat, radius, max_results):
+    images = images[:max_results]
+    if images:
+        logger.info(f"Found {len(images)} Mapillary images within {radius}deg of ({lon}, {lat})")
+    else:
+        logger.info(f"No Mapillary images found within {radius}deg of ({lon}, {lat})")
+    return images
+
+
+def search_mapillary_images(lon: float, lat: float):
+    """Mapillary images around a point, widening the search box through
+    MAPILLARY_SEARCH_RADII until it holds MAPILLARY_MIN_SEQUENCES sequences
+    and a possible pair (see has_possible_pair). Recent sequences crowding a
+    tight box don't stop the search short of older ones a little farther out.
+
+    Returns the images from the last box searched (each box contains the
+    previous ones), which may be none.
+
+    An empty box is widened like a sparse one: a tight box around a centroid
+    anchor (a deep lot, or an address that didn't geocode) can miss imagery
+    on the street that a wider one finds, and the parcel would be written
+    off for good. The cost is a request per box for a parcel with no imagery
+    at all, which is what the probe (see STAGE_ORDER) saves.
+    """
+    return _blocking(search_mapillary_images_async, lon, lat)
+
+
+async def search_mapillary_images_async(lon: float, lat: float, fetch=None):
+    """search_mapillary_images, awaiting requests on the run's event loop."""
+    images = []
+    for radius in MAPILLARY_SEARCH_RADII:
+        images = await get_mapillary_images_async(lon, lat, radius, fetch=fetch)
+        if _enough_sequences(images) and has_possible_pair(images):
+            break
+    return images
+
+
+def _enough_sequences(images):
+    return len({i["sequence"] for i in images}) >= MAPILLARY_MIN_SEQUENCES
+
+
+def has_possible_pair(images):
+    """Whether two different sequences among images were captured at least
+    PAIR_MIN_GAP_MS apart: a necessary (not sufficient) condition for a pair,
+    checked on raw capture dates before any ranking or lookups."""
+    spans = {}
+    for i in images:
+        earliest, latest = spans.get(i["sequence"], (i["captured_at"], i["captured_at"]))
+        spans[i["sequence"]] = (min(earliest, i["captured_at"]), max(latest, i["captured_at"]))
+    return any(
+        latest - other_earliest >= PAIR_MIN_GAP_MS
+        for sequence, (_, latest) in spans.items()
+        for other, (other_earliest, _) in spans.items()
+        if other != sequence
+    )
+
+
+def probe_mapillary(centroid):
+    """One cheap search around the parcel centroid to rule out parcels with
+    no imagery or no possible pair before any other lookups.
+
+    Its box holds every box the anchor search can query (see
+    MAPILLARY_PROBE_RADIUS), and has_possible_pair only gains from more
+    images, so a parcel it rejects has no pair to find. It asks only for
+    MAPILLARY_PROBE_FIELDS, so its images can't be ranked; the anchor search
+    queries its own boxes. Raises UnusableParcel.
+    """
+    _blocking(probe_mapillary_async, centroid)
+
+
+async def probe_mapillary_async(centroid, fetch=None):
+    """probe_mapillary, awaiting the search on the run's event loop."""
+    images = await get_mapillary_images_async(
+        centroid.x, centroid.y, MAPILLARY_PROBE_RADIUS, fields=MAPILLARY_PROBE_FIELDS, fetch=fetch
+    )
+    if not images:
+        raise UnusableParcel("no Mapillary images near parcel", "no_imagery")
+    if not has_possible_pair(images):
+        raise UnusableParcel("no sequences near parcel 3+ years apart", "no_pair")
 
 
 def get_closest_images(images, anchor):
@@ -278,14 +691,18 @@ def get_closest_images(images, anchor):
     - Dictionary with the closest image for each sequence
     - Distance to the overall closest image
     """
+    from geometry import point_distances
+
     # Create a dictionary to store the closest image for each sequence
     sequences = {}
     closest_image_distance = None
 
+    # Distances from the anchor to every image at once
+    distances = point_distances((anchor.x, anchor.y), [image_coordinates(i) for i in images])
+
     # Loop through the images and find the closest image for each sequence
-    for i in images:
-        # Compute distance from the anchor; assign to image & update closest image if needed
-        distance = anchor.distance(shape(i.get("computed_geometry", i.get("geometry", {}))))
+    for i, distance in zip(images, distances.tolist()):
+        # Assign the distance to the image & update closest image if needed
         i["distance"] = distance
         if closest_image_distance is None or distance < closest_image_distance:
             closest_image_distance = distance
@@ -303,21 +720,94 @@ def image_coordinates(image):
     return geometry["coordinates"]
 
 
-def prepare_post(parcel_count):
-    """Pick a random parcel and assemble the before/after post data.
+async def prepare_candidate(draw, ledger=None, drawing=None):
+    """Draw a parcel and run the selection pipeline on it (see select_pair),
+    without capturing anything.
+
+    draw() returns the next offset to try and its record (a run manifest
+    entry); the parcel's ObjectId is written to record["object_id"] as soon
+    as it's known. When a ledger is given, a parcel it lists is passed over
+    for another draw, up to MAX_LEDGER_REDRAWS times, without further
+    requests, and parcels found to be unusable are added to it. drawing, an
+    asyncio.Lock, is held while drawing and fetching, so candidates prepared
+    side by side draw in the order they were started.
 
     Raises SkipParcel if the parcel can't produce a valid before/after pair.
-    Returns a dict with message_text, reply_text, image_paths and image_alt_texts.
+    Returns the select_pair dict.
     """
-    # Get a random parcel and log information about it
-    parcel = get_random_parcel(parcel_count)
-    props = parcel["properties"]
+    async with drawing or contextlib.nullcontext():
+        for redraw in range(MAX_LEDGER_REDRAWS + 1):
+            offset, record = draw()
+            # Get the parcel and log information about it
+            parcel = await get_parcel_async(offset)
+            props = parcel["properties"]
+
+            # The ObjectId is the selection key and is used to name the
+            # screenshot files; without it we can't proceed, so skip rather
+            # than build bad paths.
+            object_id = props.get("ObjectId")
+            if object_id is None:
+                raise SkipParcel("parcel has no ObjectId", "no_object_id")
+            record["object_id"] = object_id
+
+            if ledger is None or not ledger.should_skip(object_id):
+                break
+            if redraw == MAX_LEDGER_REDRAWS:
+                raise SkipParcel(f"parcel {object_id} already posted or known unusable", "in_ledger")
+            logger.info(f"Passing over parcel {object_id}: already posted or known unusable")
+            metrics.count("ledger_redraws")
+            record["outcome"] = "in_ledger"
+
+    try:
+        return await select_pair_async(parcel, ledger)
+    except UnusableParcel:
+        if ledger is not None:
+            ledger.mark_unusable(object_id)
+        raise
+
+
+def select_pair(parcel, ledger=None):
+    """Run the selection pipeline for one parcel feature: find its anchors and
+    the before/after image pair, and aim the viewer at the building.
+
+    Makes network requests but renders and posts nothing, so it also serves
+    batch runs (see export.py). Raises SkipParcel if the parcel can't produce a
+    valid before/after pair (UnusableParcel when that's down to the parcel's
+    data). Returns a dict with object_id, properties, display_address, the
+    centroid, aim_target and selection_anchor as (lon, lat), and "after" and
+    "before" images, each with image_id, sequence, captured_at, distance,
+    coordinates and center (the viewer center aiming it at the target), and
+    "series", the same for the nearest image per era (oldest first, including
+    the pair; see MAX_SERIES_IMAGES).
+    """
+    return _blocking(select_pair_async, parcel, ledger)
+
+
+async def select_pair_async(parcel, ledger=None, fetch=None):
+    """select_pair, awaiting its requests on the run's event loop."""
+    props, address, centroid = _parcel_basics(parcel)
+
+    # Most parcels fail for lack of imagery or of a 3-year gap, which a single
+    # Mapillary request around the centroid can show; only parcels that pass
+    # go on to the geocoder, building and centerline lookups.
+    if STAGE_ORDER == "probe-first":
+        await probe_mapillary_async(centroid, fetch)
+
+    aim_target, selection_anchor = await find_anchors_async(address, centroid, fetch)
+
+    # Search around the selection anchor (the street frontage when found), so a
+    # deep lot whose centroid is far back from the street still finds the
+    # images in front of it; the box widens only if too few sequences turn up.
+    images = await search_mapillary_images_async(selection_anchor.x, selection_anchor.y, fetch)
+    return _choose_pair(props, centroid, aim_target, selection_anchor, images, ledger)
 
-    # The ObjectId is the selection key and is used to name the screenshot
-    # files; without it we can't proceed, so skip rather than build bad paths.
-    object_id = props.get("ObjectId")
-    if object_id is None:
-        raise SkipParcel("parcel has no ObjectId")
+
+def _parcel_basics(parcel):
+    """(properties, address, centroid) of a parcel feature."""
+    from shapely.geometry import Point, shape
+
+    props = parcel["properties"]
+    object_id = props["ObjectId"]
 
     # Address can be missing/blank on some parcels; keep the raw value for
     # geocoding (only worth attempting when present) and a display version for
@@ -328,31 +818,39 @@ def prepare_post(parcel_count):
     logger.info(f"Parcel ID: {object_id}")
     logger.info(f"Address: {display_address}")
 
-    # build up the reply text
-    reply_text = []
-    parcel_id = props.get("parcel_id")
-    if parcel_id:
-        reply_text.append(
-            f"Parcel info: https://baseunits.detroitmi.gov/map?id={parcel_id}&layer=parcel"
-        )
-
     # Compute the parcel's centroid. This is the universal fallback anchor for
-    # both jobs below if the geocode/lookups don't pan out.
-    shapely_geometry = shape(parcel["geometry"])
-    centroid = shapely_geometry.centroid
-
-    # Resolve two purpose-built anchors from a single geocode of the address:
-    #   aim_target       - where the camera points (the building, ideally)
-    #   selection_anchor - what image proximity is ranked against (the street
-    #                      frontage, so front-of-house images beat alley ones)
-    # Each step degrades gracefully to the centroid so we always still post.
+    # both jobs in find_anchors if the geocode/lookups don't pan out. Batch runs (and
+    # queries with returnCentroid) supply it precomputed as [x, y].
+    if parcel.get("centroid"):
+        centroid = Point(parcel["centroid"])
+    else:
+        centroid = shape(parcel["geometry"]).centroid
+
+    return props, address, centroid
+
+
+def find_anchors(address, centroid):
+    """Resolve two purpose-built anchors from a single geocode of the address:
+
+      aim_target       - where the camera points (the building, ideally)
+      selection_anchor - what image proximity is ranked against (the street
+                         frontage, so front-of-house images beat alley ones)
+
+    Each step degrades gracefully to the centroid so we always still post.
+    Returns (aim_target, selection_anchor) as shapely Points.
+    """
+    return _blocking(find_anchors_async, address, centroid)
+
+
+async def find_anchors_async(address, centroid, fetch=None):
+    """find_anchors, awaiting its lookups on the run's event loop."""
     aim_target = centroid
     selection_anchor = centroid
 
-    geo = geocode_parcel(address) if address else None
+    geo = await geocode_parcel_async(address, fetch) if address else None
     if geo:
         if geo["building_id"] is not None:
-            building_centroid = get_building_centroid(geo["building_id"])
+            building_centroid = await get_building_centroid_async(geo["building_id"], fetch)
             if building_centroid is not None:
                 aim_target = building_centroid
 
@@ -360,20 +858,29 @@ def prepare_post(parcel_count):
         # segment to get the on-street point in front of the property.
         project_from = aim_target
         if geo["street_id"] is not None:
-            segment = get_street_segment(geo["street_id"], project_from)
+            segment = await get_street_segment_async(geo["street_id"], project_from, fetch)
             if segment is not None:
                 selection_anchor = frontage_point(segment, project_from)
 
+    return _log_anchors(aim_target, selection_anchor)
+
+
+def _log_anchors(aim_target, selection_anchor):
     logger.info(f"Aim target: {aim_target.x}, {aim_target.y}")
     logger.info(f"Selection anchor: {selection_anchor.x}, {selection_anchor.y}")
+    return aim_target, selection_anchor
+
+
+def _choose_pair(props, centroid, aim_target, selection_anchor, images, ledger):
+    """The rest of select_pair, once the images are in: rank them against the
+    selection anchor, pick the pair and aim it. Makes no requests."""
+    from geometry import point_distances
+
+    object_id = props["ObjectId"]
+    display_address = props.get("address") or "Unknown address"
 
-    # The Mapillary bbox stays centered on the parcel centroid: it is a coarse
-    # retrieval net (~55m), and the frontage re-anchoring happens during ranking
-    # below. (A deep lot whose frontage is >~55m from the centroid is the rare
-    # case where expanding/recentering this bbox could help.)
-    images = get_mapillary_images(centroid.x, centroid.y)
     if not images:
-        raise SkipParcel("no Mapillary images near parcel")
+        raise UnusableParcel("no Mapillary images near parcel", "no_imagery")
 
     # sort images by capture date
     images = sorted(images, key=lambda x: -1 * x["captured_at"])
@@ -387,7 +894,7 @@ def prepare_post(parcel_count):
 
     logger.info(f"Number of sequences: {len(sequences)}")
     if not sequences:
-        raise SkipParcel("no usable image sequences near parcel")
+        raise UnusableParcel("no usable image sequences near parcel", "no_sequences")
 
     # sort sequences by distance
     max_dist_filtered = dict(
@@ -395,13 +902,13 @@ def prepare_post(parcel_count):
     )
 
     # filter down to 2x closest image distance
-    max_dist_filtered = {
+    nearby = {
         k: v for k, v in max_dist_filtered.items() if v["distance"] < (closest_image_distance * 2)
     }
 
     # filter down to the closest 66% of sequences, but always keep at least one
-    keep = max(1, int(len(max_dist_filtered) / 1.5))
-    max_dist_filtered = dict(list(max_dist_filtered.items())[:keep])
+    keep = max(1, int(len(nearby) / 1.5))
+    max_dist_filtered = dict(list(nearby.items())[:keep])
 
     # re-sort by captured date
     max_dist_filtered = dict(
@@ -411,28 +918,27 @@ def prepare_post(parcel_count):
     sequence_keys = list(max_dist_filtered.keys())
     logger.info(sequence_keys)
     if not sequence_keys:
-        raise SkipParcel("no candidate sequences after filtering")
+        raise UnusableParcel("no candidate sequences after filtering", "no_sequences")
     first_key = sequence_keys[0]
 
     # find the closest key to the first key using the distance between their coordinates
     closest_key = None
     closest_distance = None
 
-    first_key_shape = shape(max_dist_filtered[first_key].get("computed_geometry", max_dist_filtered[first_key].get("geometry", {})))
-
-    for s, i in max_dist_filtered.items():
+    distances = point_distances(
+        image_coordinates(max_dist_filtered[first_key]),
+        [image_coordinates(i) for i in max_dist_filtered.values()],
+    )
 
-        image_geometry = shape(i.get("computed_geometry", i.get("geometry", {})))
+    for (s, i), distance in zip(max_dist_filtered.items(), distances.tolist()):
 
         if s == first_key:
             continue
 
         # it should be at least 3 years apart
-        if abs(i["captured_at"] - max_dist_filtered[first_key]["captured_at"]) < (3 * 365 * 24 * 60 * 60 * 1000):
+        if abs(i["captured_at"] - max_dist_filtered[first_key]["captured_at"]) < PAIR_MIN_GAP_MS:
             continue
 
-        distance = image_geometry.distance(first_key_shape)
-
         if closest_distance is None or distance < closest_distance:
             logger.info(f"New closest distance: {distance} on image {i['id']}")
             closest_distance = distance
@@ -443,175 +949,688 @@ def prepare_post(parcel_count):
     # No image at least 3 years apart from the first; this parcel can't make a
     # before/after comparison, so move on to another parcel.
     if closest_key is None:
-        raise SkipParcel("no before/after pair at least 3 years apart")
+        raise UnusableParcel("no before/after pair at least 3 years apart", "no_pair")
+
+    # Neighboring parcels often rank the same two images best; don't post a
+    # pair that has already gone out for another parcel.
+    first_image_id = max_dist_filtered[first_key]["id"]
+    closest_image_id = max_dist_filtered[closest_key]["id"]
+    if ledger is not None and ledger.has_pair(first_image_id, closest_image_id):
+        raise UnusableParcel("image pair already posted", "pair_posted")
+
+    logger.info(f"Mapillary link: https://www.mapillary.com/app/?pKey={closest_image_id}")
+
+    # Compute the center coordinates for the Mapillary viewer, aiming each
+    # panorama at the building (falls back to the parcel centroid). An image
+    # without a compass angle can't be aimed, so the parcel is skipped.
+    pair = {
+        "after": _aimed_image(first_key, max_dist_filtered[first_key], aim_target),
+        "before": _aimed_image(closest_key, max_dist_filtered[closest_key], aim_target),
+    }
 
-    logger.info(f"Mapillary link: https://www.mapillary.com/app/?pKey={max_dist_filtered[closest_key]['id']}")
+    # The rest of the series comes from the same images, so it costs no
+    # requests; an extra image that can't be aimed is just left out.
+    series = []
+    for key in era_series(nearby, (first_key, closest_key)):
+        if key == first_key:
+            series.append(pair["after"])
+        elif key == closest_key:
+            series.append(pair["before"])
+        else:
+            try:
+                series.append(_aimed_image(key, nearby[key], aim_target))
+            except UnusableParcel as e:
+                logger.info(f"Leaving image out of the series: {e}")
 
-    # Collect the two comparison shots to capture together in one browser below.
-    shots = []
+    return {
+        "object_id": object_id,
+        "properties": props,
+        "display_address": display_address,
+        "centroid": (centroid.x, centroid.y),
+        "aim_target": (aim_target.x, aim_target.y),
+        "selection_anchor": (selection_anchor.x, selection_anchor.y),
+        **pair,
+        "series": series,
+    }
 
-    for s, i in max_dist_filtered.items():
 
-        coordinates = image_coordinates(i)
+def _aimed_image(key, i, aim_target):
+    """The selection entry for image i of sequence key, with the viewer center
+    aiming it at aim_target. Raises UnusableParcel if it can't be aimed."""
+    coordinates = image_coordinates(i)
 
-        logger.info(f"Sequence: {s}")
-        logger.info(f"Image ID: {i['id']}")
-        logger.info(f"Captured at: {datetime.datetime.fromtimestamp(i['captured_at'] / 1000).strftime('%Y-%m-%d %H:%M:%S')}")
-        logger.info(f"Distance: {i['distance']}")
-        logger.info(f"Computed geometry: {coordinates}")
+    logger.info(f"Sequence: {key}")
+    logger.info(f"Image ID: {i['id']}")
+    logger.info(f"Captured at: {datetime.datetime.fromtimestamp(i['captured_at'] / 1000).strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info(f"Distance: {i['distance']}")
+    logger.info(f"Computed geometry: {coordinates}")
 
-        # Compute the center coordinates for the Mapillary viewer, aiming the
-        # panorama at the building (falls back to the parcel centroid). An image
-        # without a compass angle can't be aimed: skip the whole parcel if it's
-        # one of the two comparison images, otherwise just ignore that image.
-        try:
-            computed_center = compute_viewer_center(
-                i, coordinates, [aim_target.x, aim_target.y]
-            )
-        except ValueError as e:
-            if s in (first_key, closest_key):
-                raise SkipParcel(f"image {i['id']} has no compass angle: {e}")
-            continue
+    try:
+        computed_center = compute_viewer_center(
+            i, coordinates, [aim_target.x, aim_target.y]
+        )
+    except ValueError as e:
+        raise UnusableParcel(f"image {i['id']} has no compass angle: {e}", "no_compass")
+
+    logger.info(f"Mapillary link: {viewer_link(i['id'], computed_center)}")
+    return {
+        "image_id": i["id"],
+        "sequence": key,
+        "captured_at": i["captured_at"],
+        "distance": i["distance"],
+        "coordinates": coordinates,
+        "center": computed_center,
+    }
 
-        logger.info(f"Mapillary link: https://www.mapillary.com/app/?pKey={i['id']}&focus=photo&x={str(computed_center[0])}&y={str(computed_center[1])}")
 
-        # skip screenshotting except for comparison photos
-        if s not in [first_key, closest_key]:
+def era_series(sequences, pair_keys, size=MAX_SERIES_IMAGES, min_gap=SERIES_MIN_GAP_MS):
+    """Keys of up to size sequences spanning distinct eras, oldest first.
+
+    sequences maps sequence keys to their best image, nearest first (as
+    ranked by get_closest_images). The series starts from pair_keys and adds
+    the nearest sequence captured at least min_gap from every one chosen, until
+    it's full or none is left.
+    """
+    chosen = list(pair_keys)
+    for key, image in sequences.items():
+        if len(chosen) >= size:
+            break
+        if key in chosen:
             continue
+        if all(abs(image["captured_at"] - sequences[c]["captured_at"]) >= min_gap for c in chosen):
+            chosen.append(key)
+    return sorted(chosen, key=lambda key: sequences[key]["captured_at"])
+
+
+def viewer_link(image_id, center):
+    """Mapillary web viewer link for an image, aimed at center."""
+    return f"https://www.mapillary.com/app/?pKey={image_id}&focus=photo&x={str(center[0])}&y={str(center[1])}"
+
+
+def capture_backend(name):
+    """(capture function, screenshot cache renderer) for a CAPTURE_BACKENDS name."""
+    if name == "browser":
+        from screenshot import capture_screenshots
+
+        return capture_screenshots, None
+    if name == "panorama":
+        from panorama import RENDERER, capture_panoramas
+
+        return capture_panoramas, RENDERER
+    raise ValueError(f"Unknown capture backend {name!r}; expected one of {', '.join(CAPTURE_BACKENDS)}")
 
-        # queue this image for the shared-browser screenshot pass below
-        shots.append(
-            (
-                i["id"],
-                computed_center[0],
-                computed_center[1],
-                f"{PROJECT_PATH}/{object_id}_{i['captured_at']}.png",
-            )
-        )
 
-        # create image date & add mapillary link to the reply
-        formatted_date = datetime.datetime.fromtimestamp(
-            i["captured_at"] / 1000
-        ).strftime("%Y-%m-%d")
-        mapillary_link = f"{formatted_date}: https://www.mapillary.com/app/?pKey={i['id']}&focus=photo&x={str(computed_center[0])}&y={str(computed_center[1])}"
-        reply_text.append(mapillary_link)
+async def build_post(selection, capture=None, cache=None, layout=None):
+    """Capture the screenshots for a parcel's selection (see select_pair) and
+    assemble its before/after post data.
 
-    # Capture both comparison screenshots in a single browser session. Failures
+    capture is the coroutine function that renders the screenshots (same
+    signature as screenshot.capture_screenshots; by default the one for
+    CAPTURE_BACKEND); it runs on the same event loop as the requests. With a
+    ScreenshotCache, shots already in it aren't captured again. layout is one
+    of POST_LAYOUTS (POST_LAYOUT by default).
+
+    Raises SkipParcel if the before/after screenshots aren't produced (a
+    missing extra series image is just left out). Returns a dict with
+    object_id, image_ids (the before/after pair), message_text, reply_text,
+    image_paths, image_alt_texts and follow_up (None, or the text, image_paths
+    and image_alt_texts of a reply with the rest of the series).
+    """
+    layout = layout or POST_LAYOUT
+    if layout not in POST_LAYOUTS:
+        raise ValueError(f"Unknown post layout {layout!r}; expected one of {', '.join(POST_LAYOUTS)}")
+    renderer = None
+    if capture is None:
+        capture, renderer = capture_backend(CAPTURE_BACKEND)
+    if cache is not None:
+        capture = cached(capture, cache, renderer)
+    import asyncio
+
+    props = selection["properties"]
+    object_id = selection["object_id"]
+    display_address = selection["display_address"]
+    after, before = selection["after"], selection["before"]
+
+    # Series images besides the pair, oldest first; the "pair" layout posts
+    # none of them.
+    pair_ids = {after["image_id"], before["image_id"]}
+    extras = []
+    if layout != "pair":
+        extras = [i for i in selection.get("series", ()) if i["image_id"] not in pair_ids]
+
+    def image_path(image):
+        return f"{PROJECT_PATH}/{object_id}_{image['captured_at']}.png"
+
+    def capture_date(image, format):
+        return datetime.datetime.fromtimestamp(image["captured_at"] / 1000).strftime(format)
+
+    def alt_text(image):
+        return f"Street view imagery of {display_address} captured on {capture_date(image, '%b %d %Y')}"
+
+    # build up the reply text
+    reply_text = []
+    parcel_id = props.get("parcel_id")
+    if parcel_id:
+        reply_text.append(
+            f"Parcel info: https://baseunits.detroitmi.gov/map?id={parcel_id}&layer=parcel"
+        )
+
+    # Collect every shot (newest first) to capture together in one browser
+    # below. The reply links just the pair: a viewer link per series image
+    # would run past MAX_POST_TEXT, and the reply is sent after the parcel is
+    # marked posted, so it can't be allowed to fail.
+    shots = []
+    for image in sorted((after, before, *extras), key=lambda i: -i["captured_at"]):
+        shots.append((image["image_id"], image["center"][0], image["center"][1], image_path(image)))
+        if image in (after, before):
+            reply_text.append(f"{capture_date(image, '%Y-%m-%d')}: {viewer_link(image['image_id'], image['center'])}")
+    while len("\n".join(reply_text)) > MAX_POST_TEXT:
+        logger.warning(f"Leaving {reply_text.pop()!r} out of the reply: too long")
+
+    # Capture all the screenshots in a single browser session. Failures
     # (timeouts, render errors) are tolerated here; the missing-file check below
     # turns a missing screenshot into a SkipParcel so we try another parcel.
     try:
-        asyncio.run(
-            asyncio.wait_for(capture_screenshots(shots), timeout=SCREENSHOT_TIMEOUT)
-        )
+        with metrics.timer("screenshots"):
+            await asyncio.wait_for(capture(shots), timeout=SCREENSHOT_TIMEOUT)
     except Exception as e:
         logger.warning(f"Screenshot capture failed: {e}")
 
     # Format attributes for main message text
-    after_capture_date = datetime.datetime.fromtimestamp(
-        max_dist_filtered[first_key]["captured_at"] / 1000
-    ).strftime("%b %d %Y")
-    before_capture_date = datetime.datetime.fromtimestamp(
-        max_dist_filtered[closest_key]["captured_at"] / 1000
-    ).strftime("%b %d %Y")
+    after_capture_date = capture_date(after, "%b %d %Y")
+    before_capture_date = capture_date(before, "%b %d %Y")
     year_built = parcel_attr(props, "year_built")
     zoning_district = parcel_attr(props, "zoning_district")
     tax_status = parcel_attr(props, "tax_status")
 
+    # Screenshot capture can fail (e.g. a Mapillary/network hiccup or timeout),
+    # leaving us without the images we need. Treat that as a skip so we try
+    # another parcel rather than failing on a missing file at post time. The
+    # extra series images are a bonus: a missing one is just left out.
+    missing = [image_path(i) for i in (before, after) if not os.path.exists(image_path(i))]
+    if missing:
+        # The series images that did render would otherwise be left behind.
+        _remove_images({"image_paths": [image_path(i) for i in (before, after, *extras)]})
+        raise SkipParcel(f"screenshot(s) not produced: {missing}", "screenshot_failed")
+    for image in extras:
+        if not os.path.exists(image_path(image)):
+            logger.warning(f"Leaving image {image['image_id']} out: screenshot not produced")
+    extras = [i for i in extras if os.path.exists(image_path(i))]
+
+    # The main post carries the pair, or for "carousel" the whole series in
+    # time order.
+    if layout == "carousel" and extras:
+        posted = sorted((before, after, *extras), key=lambda i: i["captured_at"])
+        dates = [capture_date(i, "%b %d %Y") for i in posted]
+        image_dates = f"Image dates, oldest first: {', '.join(dates[:-1])} and {dates[-1]}"
+    else:
+        posted = [before, after]
+        image_dates = f"Image dates: {before_capture_date} on left; {after_capture_date} on right"
+
     # Create the main message text
     message_text = f"""{display_address}
 Parcel ID: {parcel_attr(props, "parcel_id")}
 Year built: {year_built}
 Zoned {zoning_district}
 Tax status: {tax_status}
-Image dates: {before_capture_date} on left; {after_capture_date} on right"""
+{image_dates}"""
     logger.info(message_text)
 
     logger.info("\n".join(reply_text))
 
-    # Create image paths & alt text
-    image_paths = [
-        f"{PROJECT_PATH}/{object_id}_{max_dist_filtered[closest_key]['captured_at']}.png",
-        f"{PROJECT_PATH}/{object_id}_{max_dist_filtered[first_key]['captured_at']}.png",
-    ]
-
-    # Screenshot capture can fail (e.g. a Mapillary/network hiccup or timeout),
-    # leaving us without the images we need. Treat that as a skip so we try
-    # another parcel rather than failing on a missing file at post time.
-    missing = [p for p in image_paths if not os.path.exists(p)]
-    if missing:
-        raise SkipParcel(f"screenshot(s) not produced: {missing}")
-
-    image_alt_texts = [
-        f"Street view imagery of {display_address} captured on {before_capture_date}",
-        f"Street view imagery of {display_address} captured on {after_capture_date}",
-    ]
+    follow_up = None
+    if layout == "follow-up" and extras:
+        dates = [capture_date(i, "%b %d %Y") for i in extras]
+        follow_up = {
+            "text": f"{display_address} in other years: {', '.join(dates)}",
+            "image_paths": [image_path(i) for i in extras],
+            "image_alt_texts": [alt_text(i) for i in extras],
+        }
 
     return {
+        "object_id": object_id,
+        "image_ids": [before["image_id"], after["image_id"]],
         "message_text": message_text,
         "reply_text": reply_text,
-        "image_paths": image_paths,
-        "image_alt_texts": image_alt_texts,
+        "image_paths": [image_path(i) for i in posted],
+        "image_alt_texts": [alt_text(i) for i in posted],
+        "follow_up": follow_up,
     }
 
 
-if __name__ == "__main__":
+def load_state(state_path, parcel_count, seed=None):
+    """Load the run-to-run state (see STATE_PATH): (ledger, coverage, sampler).
 
-    logging.basicConfig(
-        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
-    )
+    seed seeds the coverage sampler's draws (the permutation sampler's come
+    from its saved state).
+    """
+    ledger = Ledger.load(f"{state_path}/{LEDGER_FILE}")
+    coverage = CoverageModel.load(f"{state_path}/{COVERAGE_FILE}", parcel_count)
+    if SAMPLER == "coverage":
+        sampler = CoverageSampler(coverage, floor=COVERAGE_FLOOR, rng=random.Random(seed))
+    elif SAMPLER == "permutation":
+        sampler = PermutationSampler.load(f"{state_path}/{SAMPLER_FILE}", parcel_count)
+    else:
+        raise ValueError(f"Unknown EVERYLOT_SAMPLER {SAMPLER!r}")
+    return ledger, coverage, sampler
+
+
+def save_state(state_path, ledger, coverage, sampler):
+    """Persist the run-to-run state loaded by load_state."""
+    ledger.save(f"{state_path}/{LEDGER_FILE}")
+    coverage.save(f"{state_path}/{COVERAGE_FILE}")
+    if isinstance(sampler, PermutationSampler):
+        sampler.save(f"{state_path}/{SAMPLER_FILE}")
+
+
+def log_attempts_per_success(attempts, found, coverage, sampler):
+    """Log the attempts-per-success metric for this run and across runs."""
+    logger.info(f"Attempts this run: {attempts} ({'1 success' if found else 'no success'})")
+    observed = coverage.observed_attempts_per_success()
+    if observed is not None:
+        logger.info(f"Attempts per success, all recorded runs: {observed:.1f}")
+    if isinstance(sampler, CoverageSampler):
+        logger.info(
+            f"Expected attempts per success with current weights: "
+            f"{sampler.expected_attempts_per_success():.1f}"
+        )
+
+
+def run(state_path=STATE_PATH, capture=None, seed=None, manifest=None, **options):
+    """One scheduled run: find a postable parcel, then post it and its reply.
+
+    capture is passed through to build_post. seed seeds the run's random
+    draws; without one, a seed is drawn (from the random module's current
+    state) so it can still be recorded. A RunManifest (see manifest.py) given
+    as manifest is filled in with the seed and what the run tried. options go
+    to run_async. Returns a dict with the number of attempts made, whether
+    anything was posted, and the posted ObjectId.
+
+    The whole run executes in one event loop (see run_async), shared by the
+    requests and the browser that renders the screenshots.
+    """
+    import asyncio
+
+    if seed is None:
+        seed = random.getrandbits(32)
+    random.seed(seed)
+    logger.info(f"Run seed: {seed}")
+    if manifest is not None:
+        manifest.seed = seed
+
+    async def run_and_close():
+        try:
+            return await run_async(state_path, capture, seed, manifest, **options)
+        finally:
+            await transport.aclose()
+
+    return asyncio.run(run_and_close())
+
+
+async def run_async(state_path=STATE_PATH, capture=None, seed=None, manifest=None,
+                    sampler=None, post=True):
+    """run, as a coroutine on the caller's event loop.
 
+    sampler replaces the one in the saved state (see replay), and with post
+    false the selected parcel is built but not posted.
+    """
     # The parcel count doesn't change within a run, so fetch it once and reuse
-    # it across attempts.
+    # it across attempts. Nothing else is on the loop yet, so the blocking
+    # fetch (and its retry backoff) holds nothing up.
     parcel_count = get_parcel_count_with_retry()
 
+    # Parcels posted or found unusable on earlier runs are skipped on sight.
+    # Every attempt's outcome feeds the coverage model, whichever sampler is
+    # drawing offsets, so the weights are ready when "coverage" is switched on.
+    ledger, coverage, saved_sampler = load_state(state_path, parcel_count, seed)
+    sampler = sampler or saved_sampler
+    if manifest is not None:
+        manifest.start(parcel_count, ledger)
+    screenshot_cache = ScreenshotCache(
+        f"{state_path}/{SCREENSHOT_CACHE_DIR}", SCREENSHOT_CACHE_MAX_BYTES
+    )
+
+    # Candidates are prepared as tasks on the loop. While one candidate's
+    # screenshots are captured, up to PREFETCH_CANDIDATES more are prepared
+    # alongside, so a failed capture falls through to one already vetted.
+    # Every candidate started counts against MAX_PARCEL_ATTEMPTS; the parcels
+    # it passes over because the ledger lists them don't. Candidates draw
+    # their offsets one at a time, in the order they were started, so a run's
+    # draws don't depend on timing and stay repeatable.
+    import asyncio
+
+    candidates = collections.deque()
+    started = 0
+    drawing = asyncio.Lock()
+
+    def start_candidate():
+        nonlocal started
+        started += 1
+        metrics.count("candidates")
+        # The offset and manifest entry of the candidate's latest draw.
+        drawn = {"offset": None, "record": {}}
+
+        def draw():
+            drawn["offset"] = sampler.next_offset()
+            drawn["record"] = manifest.candidate(drawn["offset"]) if manifest is not None else {}
+            return drawn["offset"], drawn["record"]
+
+        task = asyncio.create_task(prepare_candidate(draw, ledger, drawing))
+        candidates.append((drawn, task))
+
     post_data = None
-    for attempt in range(1, MAX_PARCEL_ATTEMPTS + 1):
+    attempt = 0
+    while attempt < MAX_PARCEL_ATTEMPTS:
+        attempt += 1
         logger.info(f"\n=== Attempt {attempt}/{MAX_PARCEL_ATTEMPTS} ===")
+        metrics.count("attempts")
         try:
-            post_data = prepare_post(parcel_count)
+            # A profiled run prepares candidates one at a time (see __main__),
+            # so the candidate started here does all its work in this section.
+            with profiling.section(f"attempt-{attempt:02d}"):
+                if not candidates:
+                    start_candidate()
+                drawn, candidate = candidates.popleft()
+                selection = await candidate
+                drawn["record"]["images"] = [image["image_id"] for image in selection["series"]]
+                while len(candidates) < PREFETCH_CANDIDATES and started < MAX_PARCEL_ATTEMPTS:
+                    start_candidate()
+                post_data = await build_post(selection, capture, screenshot_cache)
+            coverage.record(drawn["offset"], success=True)
+            drawn["record"]["outcome"] = "selected"
+            break
+        except (SkipParcel, requests.exceptions.RequestException) as e:
+            _record_failure(e, drawn["offset"], drawn["record"], coverage)
+        except SamplerExhausted as e:
+            # Only a replay's FixedSampler runs out, once the replay has
+            # diverged from the recorded run; it ends here like a run that
+            # found nothing (see replay).
+            logger.warning(f"{e}; ending the run")
             break
-        except SkipParcel as e:
-            logger.info(f"Skipping parcel: {e}")
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Network error while preparing parcel: {e}")
 
     if post_data is None:
         # Couldn't find a postable parcel this run. This is an expected outcome
-        # (most parcels have no before/after pair), not a failure, so exit 0 so
-        # the scheduled run isn't marked as errored.
+        # (most parcels have no before/after pair), not a failure, so the run
+        # still ends normally and the scheduled job isn't marked as errored.
         logger.info(
             f"\nNo postable parcel found after {MAX_PARCEL_ATTEMPTS} attempts; "
             "nothing to post this run."
         )
-        sys.exit(0)
+        await _finish_candidates(candidates, coverage, sampler)
+        log_attempts_per_success(attempt, False, coverage, sampler)
+        save_state(state_path, ledger, coverage, sampler)
+        return {"attempts": attempt, "posted": False, "object_id": None}
+
+    if not post:
+        logger.info(f"Not posting parcel {post_data['object_id']}")
+        _remove_images(post_data)
+        await _finish_candidates(candidates, coverage, sampler)
+        log_attempts_per_success(attempt, True, coverage, sampler)
+        save_state(state_path, ledger, coverage, sampler)
+        return {"attempts": attempt, "posted": False, "object_id": post_data["object_id"]}
+
+    from bluesky import post_to_bluesky
 
     try:
-        # Post to Bluesky
-        response = post_to_bluesky(
-            username=os.environ.get("BLUESKY_USERNAME"),
-            password=os.environ.get("BLUESKY_PASSWORD"),
-            text=post_data["message_text"],
-            image_paths=post_data["image_paths"],
-            image_alt_texts=post_data["image_alt_texts"],
-        )
+        with profiling.section("post"):
+            # Post to Bluesky
+            response = post_to_bluesky(
+                username=os.environ.get("BLUESKY_USERNAME"),
+                password=os.environ.get("BLUESKY_PASSWORD"),
+                text=post_data["message_text"],
+                image_paths=post_data["image_paths"],
+                image_alt_texts=post_data["image_alt_texts"],
+            )
 
-        logger.info("Initial post to Bluesky successful...")
+            logger.info("Initial post to Bluesky successful...")
+
+            # Record the post as soon as it's live, so a failed reply can't cause
+            # the same parcel or image pair to go out again on a later run.
+            ledger.mark_posted(post_data["object_id"])
+            ledger.add_pair(*post_data["image_ids"])
+
+            # Post a reply using the information in `response`
+            reply_to = {
+                "uri": response["uri"],
+                "cid": response["cid"],
+            }
+            post_to_bluesky(
+                username=os.environ.get("BLUESKY_USERNAME"),
+                password=os.environ.get("BLUESKY_PASSWORD"),
+                text="\n".join(post_data["reply_text"]),
+                reply_to=reply_to,
+            )
 
-        # Post a reply using the information in `response`
-        reply_to = {
-            "uri": response["uri"],
-            "cid": response["cid"],
-        }
-        post_to_bluesky(
-            username=os.environ.get("BLUESKY_USERNAME"),
-            password=os.environ.get("BLUESKY_PASSWORD"),
-            text="\n".join(post_data["reply_text"]),
-            reply_to=reply_to,
-        )
+            logger.info("Reply post to Bluesky successful...")
+
+            # The rest of the series, for the "follow-up" layout.
+            follow_up = post_data.get("follow_up")
+            if follow_up:
+                post_to_bluesky(
+                    username=os.environ.get("BLUESKY_USERNAME"),
+                    password=os.environ.get("BLUESKY_PASSWORD"),
+                    text=follow_up["text"],
+                    image_paths=follow_up["image_paths"],
+                    image_alt_texts=follow_up["image_alt_texts"],
+                    reply_to=reply_to,
+                )
+                logger.info("Follow-up post to Bluesky successful...")
+            metrics.count("posts")
+    finally:
+        # The candidates prepared ahead finish only now, so the post doesn't
+        # wait on them.
+        await _finish_candidates(candidates, coverage, sampler)
+        log_attempts_per_success(attempt, True, coverage, sampler)
+        save_state(state_path, ledger, coverage, sampler)
+
+        _remove_images(post_data)
+
+    return {"attempts": attempt, "posted": True, "object_id": post_data["object_id"]}
+
+
+def _record_failure(error, offset, record, coverage):
+    """Record how a candidate failed: in the run summary's skips and its
+    manifest entry, and in the coverage model when it was down to the parcel
+    (UnusableParcel) rather than a transient error."""
+    if isinstance(error, SkipParcel):
+        category = error.category
+        if isinstance(error, UnusableParcel):
+            coverage.record(offset, success=False)
+        logger.info(f"Skipping parcel: {error}")
+    elif isinstance(error, Throttled):
+        category = "throttled"
+        logger.warning(f"Rate limited while preparing parcel: {error}")
+    else:
+        category = "network"
+        logger.warning(f"Network error while preparing parcel: {error}")
+    metrics.skip(category)
+    record["outcome"] = category
+
+
+async def _finish_candidates(candidates, coverage, sampler):
+    """Wait for the candidates prepared ahead but never attempted, and record
+    how each ended.
+
+    They're left to finish rather than cancelled mid-request: the parcels they
+    found unusable still go in the ledger and the coverage model, and a
+    recorded run replays request for request. Viable ones go back to a
+    PermutationSampler, so they aren't passed over until its next pass.
+    """
+    import asyncio
+
+    results = await asyncio.gather(*(task for _, task in candidates), return_exceptions=True)
+    for (drawn, _), result in zip(candidates, results):
+        offset, record = drawn["offset"], drawn["record"]
+        if isinstance(result, (SkipParcel, requests.exceptions.RequestException)):
+            _record_failure(result, offset, record, coverage)
+        elif isinstance(result, SamplerExhausted):
+            # Nothing was drawn, so there's nothing to record.
+            continue
+        elif isinstance(result, BaseException):
+            logger.error(f"Candidate at offset {offset} failed: {result!r}")
+            record["outcome"] = "error"
+        else:
+            record["outcome"] = "unused"
+            record["images"] = [image["image_id"] for image in result["series"]]
+            if isinstance(sampler, PermutationSampler):
+                sampler.requeue(offset)
+    candidates.clear()
+
+
+# Settings a manifest records and a replay restores: the manifest key and the
+# module setting it stands for.
+RUN_SETTINGS = {
+    "sampler": "SAMPLER",
+    "stage_order": "STAGE_ORDER",
+    "prefetch_candidates": "PREFETCH_CANDIDATES",
+    "max_parcel_attempts": "MAX_PARCEL_ATTEMPTS",
+    "post_layout": "POST_LAYOUT",
+    "capture_backend": "CAPTURE_BACKEND",
+}
+
+
+def run_settings():
+    """This run's settings, as a manifest records them."""
+    return {key: globals()[name] for key, name in RUN_SETTINGS.items()}
+
+
+@contextlib.contextmanager
+def _run_settings(settings):
+    """Apply recorded settings (see run_settings) for the duration of the block."""
+    names = {RUN_SETTINGS[key]: value for key, value in settings.items() if key in RUN_SETTINGS}
+    saved = {name: globals()[name] for name in names}
+    globals().update(names)
+    try:
+        yield
+    finally:
+        globals().update(saved)
+
+
+def replay(manifest_path, capture=None):
+    """Rerun the run a manifest describes (see manifest.py), for performance
+    debugging.
+
+    The replay tries the same parcels in the same order, starting from the
+    recorded ledger and settings. Requests are answered from the recorded
+    responses. It runs in a scratch state directory and posts nothing. The
+    browser isn't recorded, so its screenshots are rendered live; the panorama
+    backend's downloads are replayed like any other request. capture is as for
+    run.
+
+    The replay keeps the recorded PREFETCH_CANDIDATES, even under --profile,
+    so that it prepares the same candidates side by side; each attempt's
+    profile then also holds the work of the candidates prepared alongside it.
+
+    Returns run's dict plus "matches" (whether every candidate ended as
+    recorded, and the replay drew no more offsets than the recorded run) and
+    "misses" (requests the recording had no response for).
+    """
+    import tempfile
+
+    from manifest import RunManifest, responses_path
+    from sampling import FixedSampler
+
+    recorded = RunManifest.load(manifest_path)
+    replay_transport = transport.ReplayTransport(responses_path(manifest_path))
+    replayed = RunManifest(settings=recorded.settings)
+    sampler = FixedSampler(recorded.offsets())
+    with tempfile.TemporaryDirectory() as state_path, _run_settings(recorded.settings):
+        ledger = Ledger.from_dict(recorded.ledger) if recorded.ledger else Ledger()
+        ledger.save(f"{state_path}/{LEDGER_FILE}")
+        with transport.using(replay_transport):
+            result = run(
+                state_path,
+                capture,
+                recorded.seed,
+                replayed,
+                sampler=sampler,
+                post=False,
+            )
+
+    def outcomes(manifest):
+        return [(c["offset"], c["object_id"], c["outcome"], c["images"]) for c in manifest.candidates]
+
+    matches = outcomes(replayed) == outcomes(recorded) and not sampler.exhausted
+    if not matches:
+        logger.warning("The replay's candidates ended differently from the recorded run's")
+    if replay_transport.misses:
+        logger.warning(f"{len(replay_transport.misses)} requests had no recorded response")
+    return {**result, "matches": matches, "misses": len(replay_transport.misses)}
+
+
+def _remove_images(post_data):
+    """Clean up a post's screenshots, the follow-up's too."""
+    follow_up_paths = (post_data.get("follow_up") or {}).get("image_paths", [])
+    for image_path in post_data["image_paths"] + follow_up_paths:
+        if os.path.exists(image_path):
+            os.remove(image_path)
+
+
+if __name__ == "__main__":
 
-        logger.info("Reply post to Bluesky successful...")
+    parser = argparse.ArgumentParser(description="Post a random Detroit parcel to Bluesky")
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="auto",
+        choices=profiling.BACKENDS,
+        help="profile each attempt and the posts into --profile-dir "
+        "(pyinstrument if installed, else cProfile)",
+    )
+    parser.add_argument("--profile-dir", default=PROFILE_PATH, help="where profiles are written")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=os.environ.get("EVERYLOT_SEED"),
+        help="seed for the run's random draws (default: drawn and recorded in the manifest)",
+    )
+    parser.add_argument("--manifest", default=MANIFEST_PATH, help="where the run manifest is written")
+    parser.add_argument(
+        "--replay",
+        metavar="MANIFEST",
+        help="rerun a recorded run against its recorded responses, without posting",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    if args.profile:
+        profiling.enable(args.profile_dir, args.profile)
+        # Candidates prepared ahead would run inside other attempts' sections;
+        # one at a time, each attempt's profile holds only its own work. A
+        # replay restores the recorded setting instead (see replay).
+        PREFETCH_CANDIDATES = 0
+
+    if args.replay:
+        result = replay(args.replay)
+        logger.info(f"Replay: {json.dumps(result)}")
+        logger.info(f"Replay summary: {json.dumps(metrics.summary())}")
+        raise SystemExit(0 if result["matches"] else 1)
+
+    if LOOKUP_CACHE_PATH:
+        import cache
+
+        cache.install(LOOKUP_CACHE_PATH)
+
+    # Record every response (cache hits included) next to the manifest, so
+    # the run can be replayed.
+    from manifest import RunManifest, responses_path
+
+    run_manifest = RunManifest(settings=run_settings())
+    recorder = transport.RecordingTransport(transport.current(), responses_path(args.manifest))
+    transport.set_transport(recorder)
+
+    # Write the run summary however the run ends, so scheduled runs leave a
+    # record of stage timings and skip reasons to compare across runs.
+    result = None
+    try:
+        result = run(seed=args.seed, manifest=run_manifest)
     finally:
-        # Clean up images
-        for image_path in post_data["image_paths"]:
-            if os.path.exists(image_path):
-                os.remove(image_path)
+        summary = metrics.write_summary(
+            RUN_SUMMARY_PATH, outcome=result, rate_limits=transport.rate_limit_stats()
+        )
+        logger.info(f"Run summary: {json.dumps(summary)}")
+        recorder.save()
+        run_manifest.save(args.manifest, outcome=result, summary=summary)
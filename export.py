@@ -0,0 +1,413 @@
+"""Batch export of before/after image pairs for many parcels.
+
+Runs the bot's selection pipeline (everylot.select_pair: anchors, image pair,
+viewer centers; no screenshots, nothing posted) over a set of parcels and
+streams one row per parcel to CSV, or to GeoParquet when pyarrow is installed:
+
+    python export.py pairs.csv --object-ids 1234,5678
+    python export.py pairs.csv --polygon corktown.geojson
+    python export.py pairs.parquet --city --mirror parcels.sqlite
+
+Parcels that can't make a pair get a row too, with the skip reason as their
+status. Rows are written in chunks; after each chunk the ObjectIds written are
+saved to a checkpoint next to the output, and rerunning the same command picks
+up where it left off. Parcels that hit a network error aren't written, so a
+rerun retries them.
+"""
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+import struct
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import arcgis
+import everylot
+from geometry import with_centroids
+from ledger import bit_is_set, pack_bits, save_json, set_bit, unpack_bits
+
+logger = logging.getLogger("everylot.export")
+
+CHECKPOINT_VERSION = 1
+
+# Parcels per chunk written (and checkpointed).
+DEFAULT_CHUNK_SIZE = 200
+
+# Parcels run through select_pair at once; the work is almost all waiting on
+# the geocoder and Mapillary.
+DEFAULT_WORKERS = 8
+
+FIELDS = [
+    "object_id", "parcel_id", "address", "status",
+    "centroid_lon", "centroid_lat", "aim_lon", "aim_lat", "anchor_lon", "anchor_lat",
+    "after_image_id", "after_captured_at", "after_date", "after_distance",
+    "after_center_x", "after_center_y",
+    "before_image_id", "before_captured_at", "before_date", "before_distance",
+    "before_center_x", "before_center_y",
+    "series_image_ids",
+]
+
+
+def export_row(parcel):
+    """Run select_pair on one parcel and flatten the result into a row.
+
+    Returns None when a network error means the parcel should be retried.
+    """
+    props = parcel["properties"]
+    row = dict.fromkeys(FIELDS)
+    row.update(
+        object_id=props.get("ObjectId"),
+        parcel_id=props.get("parcel_id"),
+        address=props.get("address") or "",
+    )
+    if parcel.get("centroid"):
+        row["centroid_lon"], row["centroid_lat"] = parcel["centroid"]
+    if not parcel.get("geometry") and not parcel.get("centroid"):
+        row["status"] = "no_geometry"
+        return row
+
+    try:
+        selection = everylot.select_pair(parcel)
+    except everylot.SkipParcel as e:
+        row["status"] = e.category
+        return row
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Network error on parcel {row['object_id']}, will retry: {e}")
+        return None
+
+    row["status"] = "ok"
+    for name, key in (("centroid", "centroid"), ("aim", "aim_target"), ("anchor", "selection_anchor")):
+        row[f"{name}_lon"], row[f"{name}_lat"] = selection[key]
+    for role in ("after", "before"):
+        image = selection[role]
+        row[f"{role}_image_id"] = image["image_id"]
+        row[f"{role}_captured_at"] = image["captured_at"]
+        row[f"{role}_date"] = datetime.datetime.fromtimestamp(
+            image["captured_at"] / 1000, datetime.timezone.utc
+        ).strftime("%Y-%m-%d")
+        row[f"{role}_distance"] = image["distance"]
+        row[f"{role}_center_x"], row[f"{role}_center_y"] = image["center"]
+    # The nearest image per era, oldest first (see everylot.era_series).
+    row["series_image_ids"] = " ".join(image["image_id"] for image in selection["series"])
+    return row
+
+
+def export_rows(parcels, workers=DEFAULT_WORKERS):
+    """export_row over parcels on a thread pool, yielding (parcel, row) in
+    input order with a bounded number of parcels in flight."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for parcel in parcels:
+            pending.append((parcel, executor.submit(export_row, parcel)))
+            if len(pending) >= workers * 4:
+                parcel, future = pending.popleft()
+                yield parcel, future.result()
+        while pending:
+            parcel, future = pending.popleft()
+            yield parcel, future.result()
+
+
+class Checkpoint:
+    """ObjectIds already exported, as a bitset like the ledger's."""
+
+    def __init__(self, path, done=None):
+        self.path = path
+        self.done = bytearray(done or b"")
+        self.count = 0
+
+    @classmethod
+    def load(cls, path):
+        """Load the checkpoint at path, or start a new one if there's none.
+
+        Unlike the ledger, a corrupt checkpoint is an error: starting over
+        would write every row a second time.
+        """
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version in {path}: {data.get('version')}")
+        checkpoint = cls(path, unpack_bits(data["done"]))
+        checkpoint.count = data["count"]
+        return checkpoint
+
+    def __contains__(self, object_id):
+        return bit_is_set(self.done, object_id)
+
+    def add(self, object_id):
+        if object_id not in self:
+            set_bit(self.done, object_id)
+            self.count += 1
+
+    def save(self):
+        """Write the checkpoint atomically, like Ledger.save."""
+        save_json(
+            {"version": CHECKPOINT_VERSION, "count": self.count, "done": pack_bits(self.done)},
+            self.path,
+        )
+
+
+class CsvWriter:
+    """Appends chunks of rows to one CSV file, writing the header once."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, rows):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+
+
+def _wkb_point(x, y):
+    """Little-endian WKB for a 2D point."""
+    return struct.pack("<BIdd", 1, 1, x, y)
+
+
+class GeoParquetWriter:
+    """Writes each chunk as a part file of a GeoParquet dataset directory.
+
+    The geometry column is the parcel centroid. Each part is a complete file,
+    so an interrupted export leaves a readable dataset. Needs pyarrow, which
+    is optional and not in requirements.txt.
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError(
+                "GeoParquet output needs pyarrow (pip install pyarrow); or export to .csv"
+            )
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # An explicit schema, so parts agree even when a chunk has no pairs
+        # (all-null columns would otherwise come out as the null type).
+        integers = {"object_id", "after_captured_at", "before_captured_at"}
+        strings = {"parcel_id", "address", "status", "after_image_id", "after_date",
+                   "before_image_id", "before_date", "series_image_ids"}
+        schema = pa.schema(
+            [
+                (name, pa.int64() if name in integers else pa.string() if name in strings else pa.float64())
+                for name in FIELDS
+            ]
+            + [("geometry", pa.binary())]
+        )
+        columns = {name: [row[name] for row in rows] for name in FIELDS}
+        columns["geometry"] = [
+            _wkb_point(row["centroid_lon"], row["centroid_lat"])
+            if row["centroid_lon"] is not None else None
+            for row in rows
+        ]
+        table = pa.table(columns, schema=schema)
+        geo = {
+            "version": "1.0.0",
+            "primary_column": "geometry",
+            "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Point"]}},
+        }
+        table = table.replace_schema_metadata({"geo": json.dumps(geo)})
+        part = len([name for name in os.listdir(self.path) if name.endswith(".parquet")])
+        pq.write_table(table, os.path.join(self.path, f"part-{part:05d}.parquet"))
+
+
+def open_writer(path):
+    if path.endswith(".parquet"):
+        return GeoParquetWriter(path)
+    if path.endswith(".csv"):
+        return CsvWriter(path)
+    raise ValueError(f"Don't know how to write {path}; use a .csv or .parquet path")
+
+
+def export(parcels, output, checkpoint_path=None, workers=DEFAULT_WORKERS,
+           chunk_size=DEFAULT_CHUNK_SIZE, processes=1):
+    """Export a row per parcel to output, skipping parcels the checkpoint
+    already has. Returns a Counter of row statuses written this run.
+
+    Parcel centroids are computed in vectorized batches up front (across
+    processes worker processes when processes > 1), so the select_pair threads
+    only wait on the network.
+    """
+    writer = open_writer(output)
+    checkpoint = Checkpoint.load(checkpoint_path or f"{output}.checkpoint.json")
+    if checkpoint.count:
+        logger.info(f"Resuming: {checkpoint.count} parcels already exported")
+
+    todo = (
+        parcel for parcel in parcels
+        if parcel["properties"].get("ObjectId") is not None
+        and parcel["properties"]["ObjectId"] not in checkpoint
+    )
+    statuses = Counter()
+    chunk = []
+
+    def flush():
+        # Rows first, then the checkpoint: a crash in between repeats at most
+        # this chunk's rows on the next run, and never loses any.
+        writer.write(chunk)
+        for row in chunk:
+            checkpoint.add(row["object_id"])
+        checkpoint.save()
+        logger.info(f"Exported {checkpoint.count} parcels ({dict(statuses)})")
+        chunk.clear()
+
+    for parcel, row in export_rows(with_centroids(todo, processes), workers):
+        if row is None:
+            statuses["retry"] += 1
+            continue
+        statuses[row["status"]] += 1
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return statuses
+
+
+def load_polygon(path):
+    """A shapely geometry from a GeoJSON file (geometry, Feature or
+    FeatureCollection, in WGS84)."""
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
+
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        return unary_union([shape(feature["geometry"]) for feature in data["features"]])
+    if data.get("type") == "Feature":
+        return shape(data["geometry"])
+    return shape(data)
+
+
+# Only the fields a row (and select_pair) uses; the mirror's stored centroids
+# likewise spare reading the polygons back.
+OUT_FIELDS = ",".join(everylot.PARCEL_FIELDS)
+
+
+def parcels_by_id(object_ids, mirror=None):
+    if mirror is not None:
+        features = (mirror.get(object_id, geometry=False) for object_id in sorted(object_ids))
+        return (feature for feature in features if feature)
+    return arcgis.iter_features_by_id(
+        everylot.FEATURE_SERVICE_URL, object_ids, out_fields=OUT_FIELDS
+    )
+
+
+def parcels_in_polygon(polygon, mirror=None):
+    """Parcels whose centroid falls in polygon.
+
+    The layer is queried by the polygon's bounding box (a full neighborhood
+    outline can be too long for a GET), then filtered here.
+    """
+    from shapely.geometry import Point, shape
+    from shapely.prepared import prep
+
+    if mirror is not None:
+        candidates = mirror.features(geometry=False)
+    else:
+        envelope = {
+            "geometry": ",".join(str(v) for v in polygon.bounds),
+            "geometryType": "esriGeometryEnvelope",
+            "inSR": 4326,
+            "spatialRel": "esriSpatialRelIntersects",
+        }
+        object_ids = arcgis.get_object_ids(everylot.FEATURE_SERVICE_URL, extra_params=envelope)
+        candidates = arcgis.iter_features_by_id(
+            everylot.FEATURE_SERVICE_URL, object_ids, out_fields=OUT_FIELDS
+        )
+
+    area = prep(polygon)
+    for feature in candidates:
+        if feature.get("centroid"):
+            centroid = Point(feature["centroid"])
+        elif feature.get("geometry"):
+            centroid = shape(feature["geometry"]).centroid
+        else:
+            continue
+        if area.covers(centroid):
+            yield feature
+
+
+def city_parcels(mirror=None):
+    if mirror is not None:
+        return mirror.features(geometry=False)
+    return arcgis.iter_features(everylot.FEATURE_SERVICE_URL, out_fields=OUT_FIELDS)
+
+
+def read_object_ids(text):
+    return [int(value) for value in text.replace(",", " ").split()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export before/after image pairs for many parcels")
+    parser.add_argument("output", help="a .csv file, or a .parquet directory (needs pyarrow)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--object-ids", help="comma-separated ObjectIds")
+    source.add_argument("--object-ids-file", help="file of ObjectIds, one per line")
+    source.add_argument("--polygon", help="GeoJSON file of the area (e.g. a neighborhood)")
+    source.add_argument("--city", action="store_true", help="every parcel in the city")
+    parser.add_argument("--mirror", help="read parcels from a mirror.py database instead of the layer")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="parcels in flight")
+    parser.add_argument(
+        "--processes", type=int, default=1, help="worker processes for parcel geometry"
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per write")
+    parser.add_argument("--checkpoint", help="checkpoint path (default: OUTPUT.checkpoint.json)")
+    parser.add_argument(
+        "--cache",
+        default=everylot.LOOKUP_CACHE_PATH,
+        help="lookup cache database to share with other exports (default: EVERYLOT_CACHE)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    # select_pair logs every step of every parcel; keep the export's own progress readable.
+    logging.getLogger("everylot").setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    if args.cache:
+        import cache
+
+        cache.install(args.cache)
+
+    mirror = None
+    if args.mirror:
+        from mirror import ParcelMirror
+
+        mirror = ParcelMirror(args.mirror)
+
+    try:
+        if args.object_ids or args.object_ids_file:
+            text = args.object_ids or open(args.object_ids_file).read()
+            parcels = parcels_by_id(read_object_ids(text), mirror)
+        elif args.polygon:
+            parcels = parcels_in_polygon(load_polygon(args.polygon), mirror)
+        else:
+            parcels = city_parcels(mirror)
+
+        statuses = export(
+            parcels, args.output, args.checkpoint, args.workers, args.chunk_size, args.processes
+        )
+        logger.info(f"Done: {dict(statuses)}")
+    finally:
+        if mirror is not None:
+            mirror.close()
+
+
+if __name__ == "__main__":
+    main()
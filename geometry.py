@@ -0,0 +1,168 @@
+"""Vectorized geometry for the selection pipeline and batch runs.
+
+The per-parcel geometry is cheap once, but a batch run repeats it for every
+candidate: a shape() and centroid per parcel polygon, and a distance per
+Mapillary image. Here that work runs on arrays instead. Parcel polygons are
+packed into flat coordinate and offset arrays and turned into centroids with a
+few shapely 2 array calls. Image distances are a single numpy expression.
+
+Large batches can be split across a process pool. Workers receive the packed
+numpy arrays and return an array of centroids, so the pool pickles flat
+buffers rather than GeoJSON dicts.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+# Polygons per chunk handed to a worker process.
+POOL_CHUNK_SIZE = 5000
+
+
+def pack_polygons(geometries):
+    """Flatten GeoJSON Polygon/MultiPolygon geometries into arrays.
+
+    Returns (coords, ring_offsets, polygon_offsets, feature_offsets, packed):
+    coords is an (n, 2) float array; ring i is coords[ring_offsets[i]:
+    ring_offsets[i + 1]], and likewise polygons index rings and features index
+    polygons. packed lists the positions in geometries that were packed; a
+    missing or non-polygon geometry, or one with no usable ring, is left out.
+    """
+    coords = []
+    ring_offsets = [0]
+    polygon_offsets = [0]
+    feature_offsets = [0]
+    packed = []
+    for position, geometry in enumerate(geometries):
+        if not geometry:
+            continue
+        if geometry.get("type") == "Polygon":
+            polygons = [geometry["coordinates"]]
+        elif geometry.get("type") == "MultiPolygon":
+            polygons = geometry["coordinates"]
+        else:
+            continue
+
+        feature_polygons = 0
+        for rings in polygons:
+            # A shell needs at least four positions (closed triangle); holes
+            # that short are dropped along with it.
+            rings = [ring for ring in rings if len(ring) >= 4]
+            if not rings:
+                continue
+            for ring in rings:
+                coords.extend(ring if len(ring[0]) == 2 else (point[:2] for point in ring))
+                ring_offsets.append(len(coords))
+            polygon_offsets.append(len(ring_offsets) - 1)
+            feature_polygons += 1
+        if feature_polygons:
+            feature_offsets.append(len(polygon_offsets) - 1)
+            packed.append(position)
+
+    return (
+        np.asarray(coords, dtype=float).reshape(-1, 2),
+        np.asarray(ring_offsets, dtype=np.int64),
+        np.asarray(polygon_offsets, dtype=np.int64),
+        np.asarray(feature_offsets, dtype=np.int64),
+        packed,
+    )
+
+
+def packed_centroids(coords, ring_offsets, polygon_offsets, feature_offsets):
+    """Centroids, as an (n, 2) array, of features packed by pack_polygons."""
+    import shapely
+
+    if len(feature_offsets) < 2:
+        return np.empty((0, 2))
+    # Built straight from the arrays: no per-ring or per-polygon objects.
+    features = shapely.from_ragged_array(
+        shapely.GeometryType.MULTIPOLYGON, coords, (ring_offsets, polygon_offsets, feature_offsets)
+    )
+    return shapely.get_coordinates(shapely.centroid(features))
+
+
+def centroids(geometries, executor=None):
+    """Centroids of GeoJSON polygon geometries, as [x, y] lists aligned with
+    geometries (None where a geometry isn't a usable polygon).
+
+    With a ProcessPoolExecutor, the batch is split into chunks of
+    POOL_CHUNK_SIZE computed in its worker processes; otherwise it's computed
+    here.
+    """
+    geometries = list(geometries)
+    chunks = [
+        range(start, min(start + POOL_CHUNK_SIZE, len(geometries)))
+        for start in range(0, len(geometries), POOL_CHUNK_SIZE)
+    ]
+    packs = [pack_polygons([geometries[i] for i in chunk]) for chunk in chunks]
+    if executor is not None and len(chunks) > 1:
+        results = [executor.submit(packed_centroids, *pack[:4]) for pack in packs]
+        results = [future.result() for future in results]
+    else:
+        results = [packed_centroids(*pack[:4]) for pack in packs]
+
+    output = [None] * len(geometries)
+    for chunk, pack, points in zip(chunks, packs, results):
+        for position, point in zip(pack[4], points.tolist()):
+            output[chunk[position]] = point
+    return output
+
+
+def with_centroids(features, processes=1):
+    """Yield features with "centroid" ([x, y]) filled in where it's missing,
+    computing centroids a chunk of POOL_CHUNK_SIZE at a time (across
+    processes worker processes when processes > 1). Features whose geometry
+    isn't a polygon pass through without one.
+
+    Features come out in input order, each chunk as soon as its centroids are
+    in: the first chunk doesn't wait for the others, and no more than
+    processes chunks are in the pool at once.
+    """
+    executor = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+    pending = deque()
+    try:
+        chunk = []
+        for feature in features:
+            chunk.append(feature)
+            if len(chunk) >= POOL_CHUNK_SIZE:
+                # With the pool full, wait for the oldest chunk to free a worker.
+                if len(pending) >= max(processes, 1):
+                    yield from _fill_centroids(*pending.popleft())
+                pending.append(_submit_centroids(chunk, executor))
+                chunk = []
+            while pending and pending[0][2].done():
+                yield from _fill_centroids(*pending.popleft())
+        if chunk:
+            pending.append(_submit_centroids(chunk, executor))
+        while pending:
+            yield from _fill_centroids(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _submit_centroids(chunk, executor):
+    """Start computing the missing centroids of a chunk of features: in the
+    executor if there is one, otherwise right away. Returns (chunk, the
+    features missing one, a future of their centroids)."""
+    missing = [feature for feature in chunk if not feature.get("centroid")]
+    pack = pack_polygons([feature.get("geometry") for feature in missing])
+    if executor is not None:
+        future = executor.submit(packed_centroids, *pack[:4])
+    else:
+        future = Future()
+        future.set_result(packed_centroids(*pack[:4]))
+    return chunk, [missing[position] for position in pack[4]], future
+
+
+def _fill_centroids(chunk, packed, future):
+    for feature, point in zip(packed, future.result().tolist()):
+        feature["centroid"] = point
+    return chunk
+
+
+def point_distances(origin, coordinates):
+    """Planar distances from origin (x, y) to each [x, y] in coordinates, in
+    the coordinates' units (degrees here, as shapely's distance gives)."""
+    points = np.asarray([point[:2] for point in coordinates], dtype=float).reshape(-1, 2)
+    return np.hypot(points[:, 0] - origin[0], points[:, 1] - origin[1])
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+logger = logging.getLogger("everylot.ledger")
+
+LEDGER_VERSION = 1
+
+
+# Bitsets indexed by ObjectId, as bytearrays, and their compact JSON form
+# (see Ledger; export.Checkpoint uses them too).
+
+def bit_is_set(bits, index):
+    byte = index >> 3
+    return byte < len(bits) and bool(bits[byte] & (1 << (index & 7)))
+
+
+def set_bit(bits, index):
+    byte = index >> 3
+    if byte >= len(bits):
+        bits.extend(b"\x00" * (byte + 1 - len(bits)))
+    bits[byte] |= 1 << (index & 7)
+
+
+def pack_bits(bits):
+    return base64.b64encode(zlib.compress(bytes(bits), 9)).decode("ascii")
+
+
+def unpack_bits(text):
+    return bytearray(zlib.decompress(base64.b64decode(text))) if text else bytearray()
+
+
+def save_json(data, path):
+    """Write data to path as JSON atomically, so an interrupted run can't
+    leave a truncated file behind. Used for all the run-to-run state."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def pair_key(image_id_a, image_id_b):
+    """Return a 64-bit key for an image pair, independent of the pair's order.
+
+    Neighboring parcels often rank the same two images best, so pairs are keyed
+    by image ids rather than by parcel.
+    """
+    low, high = sorted((str(image_id_a), str(image_id_b)))
+    digest = hashlib.blake2b(f"{low}:{high}".encode("ascii"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class Ledger:
+    """Parcels and image pairs that later runs should not spend attempts on.
+
+    Posted and known-unusable parcels are bitsets indexed by ObjectId (one bit
+    per parcel, ~50KB each for the whole city before compression); posted image
+    pairs are a set of 64-bit hashes. Every lookup is O(1).
+    """
+
+    def __init__(self, posted=None, unusable=None, pairs=None):
+        self.posted = bytearray(posted or b"")
+        self.unusable = bytearray(unusable or b"")
+        self.pairs = set(pairs or ())
+
+    def is_posted(self, object_id):
+        return bit_is_set(self.posted, object_id)
+
+    def is_unusable(self, object_id):
+        return bit_is_set(self.unusable, object_id)
+
+    def should_skip(self, object_id):
+        """True if the parcel was already posted or is known to be unusable."""
+        return self.is_posted(object_id) or self.is_unusable(object_id)
+
+    def mark_posted(self, object_id):
+        set_bit(self.posted, object_id)
+
+    def mark_unusable(self, object_id):
+        set_bit(self.unusable, object_id)
+
+    def has_pair(self, image_id_a, image_id_b):
+        return pair_key(image_id_a, image_id_b) in self.pairs
+
+    def add_pair(self, image_id_a, image_id_b):
+        self.pairs.add(pair_key(image_id_a, image_id_b))
+
+    def to_dict(self):
+        return {
+            "version": LEDGER_VERSION,
+            "posted": pack_bits(self.posted),
+            "unusable": pack_bits(self.unusable),
+            "pairs": sorted(self.pairs),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != LEDGER_VERSION:
+            raise ValueError(f"unsupported ledger version {data.get('version')!r}")
+        return cls(
+            posted=unpack_bits(data.get("posted")),
+            unusable=unpack_bits(data.get("unusable")),
+            pairs=data.get("pairs", []),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a ledger from path, starting empty if it's missing or unreadable.
+
+        A lost ledger only costs some repeat attempts, so a corrupt file is
+        logged and replaced rather than failing the run.
+        """
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path) as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Ignoring unreadable ledger {path}: {e}")
+            return cls()
+
+    def save(self, path):
+        """Write the ledger atomically so an interrupted run can't truncate it."""
+        save_json(self.to_dict(), path)
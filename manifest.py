@@ -0,0 +1,90 @@
+"""Run manifests: what a posting run did, and enough to run it again.
+
+A manifest records the run's seed and settings, the ledger as the run found
+it, and every candidate parcel it tried, in order: the offset drawn, the
+ObjectId, the outcome (the skip category, "selected" for the one that went on
+to be posted, or "unused" for one prepared ahead but not needed) and the
+images chosen. The run summary (stage timings, request and cache counts,
+skips) is stored with it. Every response the run got is recorded next to it
+(see responses_path and transport.RecordingTransport).
+
+everylot.replay reruns a manifest: the same offsets (through a FixedSampler),
+the same ledger and settings, and the recorded responses instead of the
+network, so a slow or failed run can be profiled after the fact.
+"""
+import datetime
+import json
+import logging
+import os
+
+from ledger import save_json
+
+logger = logging.getLogger("everylot.manifest")
+
+MANIFEST_VERSION = 1
+
+
+def responses_path(path):
+    """Where the responses of the run whose manifest is at path are recorded."""
+    root, _ = os.path.splitext(path)
+    return f"{root}.responses.json"
+
+
+class RunManifest:
+    """The record of one run, filled in as it goes (see everylot.run_async)."""
+
+    def __init__(self, seed=None, settings=None, parcel_count=None, ledger=None,
+                 candidates=None, started_at=None):
+        self.seed = seed
+        self.settings = dict(settings or {})
+        self.parcel_count = parcel_count
+        self.ledger = ledger
+        self.candidates = list(candidates or [])
+        self.started_at = started_at or datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def start(self, parcel_count, ledger):
+        """Note the parcel count and the ledger as the run loaded them."""
+        self.parcel_count = parcel_count
+        self.ledger = ledger.to_dict()
+
+    def candidate(self, offset):
+        """Add a candidate drawn at offset; returns its entry for the run to
+        fill in (object_id, outcome, images)."""
+        entry = {"offset": offset, "object_id": None, "outcome": None, "images": []}
+        self.candidates.append(entry)
+        return entry
+
+    def offsets(self):
+        return [entry["offset"] for entry in self.candidates]
+
+    def to_dict(self, outcome=None, summary=None):
+        return {
+            "version": MANIFEST_VERSION,
+            "started_at": self.started_at,
+            "seed": self.seed,
+            "settings": self.settings,
+            "parcel_count": self.parcel_count,
+            "ledger": self.ledger,
+            "candidates": self.candidates,
+            "outcome": outcome,
+            "summary": summary,
+        }
+
+    def save(self, path, outcome=None, summary=None):
+        save_json(self.to_dict(outcome, summary), path)
+        logger.info(f"Run manifest written to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{path} is a version {data.get('version')} manifest; expected {MANIFEST_VERSION}")
+        return cls(
+            seed=data["seed"],
+            settings=data["settings"],
+            parcel_count=data["parcel_count"],
+            ledger=data["ledger"],
+            candidates=data["candidates"],
+            started_at=data["started_at"],
+        )
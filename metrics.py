@@ -0,0 +1,101 @@
+"""Lightweight per-run metrics: stage timers, counters and skip reasons.
+
+Modules time their network calls with `with metrics.timer("geocode"):` and
+bump counters with metrics.count(...); the run loop tallies SkipParcel
+categories with metrics.skip(...). summary() gathers it all into the JSON run
+summary written at the end of a run, so latency regressions can be tracked
+across scheduled runs.
+"""
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+
+class Metrics:
+    """Thread-safe store of stage timings, counters and skip tallies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.datetime.now(datetime.timezone.utc)
+            self._start = time.perf_counter()
+            self.stages = {}
+            self.counters = Counter()
+            self.skips = Counter()
+
+    def add_timing(self, stage, seconds, error=False):
+        with self._lock:
+            totals = self.stages.setdefault(
+                stage, {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            totals["count"] += 1
+            totals["errors"] += int(error)
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Time the block as one call of stage; exceptions count as errors."""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.add_timing(stage, time.perf_counter() - start, error)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def skip(self, category):
+        with self._lock:
+            self.skips[category] += 1
+
+    def summary(self, **extra):
+        """The run summary as a JSON-ready dict; extra keys are merged in."""
+        with self._lock:
+            summary = {
+                "started_at": self.started_at.isoformat(),
+                "duration_seconds": round(time.perf_counter() - self._start, 3),
+                "stages": {
+                    name: {
+                        **totals,
+                        "seconds": round(totals["seconds"], 4),
+                        "max_seconds": round(totals["max_seconds"], 4),
+                        "mean_seconds": round(totals["seconds"] / totals["count"], 4),
+                    }
+                    for name, totals in sorted(self.stages.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "skips": dict(sorted(self.skips.items())),
+            }
+        summary.update(extra)
+        return summary
+
+    def write_summary(self, path, **extra):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        summary = self.summary(**extra)
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+# The process-wide metrics every module records into.
+_metrics = Metrics()
+
+timer = _metrics.timer
+count = _metrics.count
+skip = _metrics.skip
+summary = _metrics.summary
+write_summary = _metrics.write_summary
+reset = _metrics.reset
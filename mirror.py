@@ -0,0 +1,327 @@
+"""Local SQLite mirror of the parcel layer, kept current incrementally.
+
+A full download is hundreds of requests; after that, sync() only fetches what
+changed. With editor tracking on the layer, that's the features edited since
+the last sync (found by an id-only query on the edit date). Without it, each
+parcel's attributes are hashed and only rows whose hash changed get their
+geometry refetched. Either way, ObjectIds gone from the layer are deleted.
+
+Each row also stores its parcel's centroid, computed when the row is written
+(rows from before the column existed get theirs on the next sync). Readers
+that only need the centroid, as the selection pipeline does, can skip loading
+and parsing the polygon: see features(geometry=False).
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from arcgis import get_layer_info, get_object_ids, iter_features, iter_features_by_id
+
+logger = logging.getLogger("everylot.mirror")
+
+# Rows per transaction while applying a sync.
+UPSERT_BATCH_SIZE = 1000
+
+# Columns added since the first schema, with their types, for migrating older
+# mirrors in place.
+ADDED_COLUMNS = {"centroid_x": "REAL", "centroid_y": "REAL"}
+
+# What a feature is read from: with the geometry, or (compact) with it only
+# for rows that have no centroid.
+FEATURE_COLUMNS = "properties, geometry, centroid_x, centroid_y"
+COMPACT_FEATURE_COLUMNS = (
+    "properties, CASE WHEN centroid_x IS NULL THEN geometry END, centroid_x, centroid_y"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parcels (
+    object_id INTEGER PRIMARY KEY,
+    properties TEXT NOT NULL,
+    geometry TEXT,
+    edited_at INTEGER,
+    hash TEXT NOT NULL,
+    centroid_x REAL,
+    centroid_y REAL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def attributes_hash(properties, ignore=()):
+    """Stable hash of a feature's attributes, for change detection."""
+    relevant = {k: v for k, v in properties.items() if k not in ignore}
+    encoded = json.dumps(relevant, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def edit_date_where(edit_field, since_ms):
+    """Where clause for features edited at or after since_ms (epoch millis, UTC).
+
+    Inclusive, so edits landing in the same millisecond as the last sync aren't
+    missed; re-applying them is harmless.
+    """
+    since = datetime.datetime.fromtimestamp(since_ms / 1000, datetime.timezone.utc)
+    return f"{edit_field} >= TIMESTAMP '{since.strftime('%Y-%m-%d %H:%M:%S')}'"
+
+
+class ParcelMirror:
+    """The parcel table plus the watermark needed for the next sync."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(parcels)")}
+        with self.connection:
+            for column, kind in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE parcels ADD COLUMN {column} {kind}")
+
+    def close(self):
+        self.connection.close()
+
+    def get_state(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM sync_state WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, key, value):
+        self.connection.execute(
+            "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM parcels").fetchone()[0]
+
+    def object_ids(self):
+        return {row[0] for row in self.connection.execute("SELECT object_id FROM parcels")}
+
+    def hashes(self):
+        return dict(self.connection.execute("SELECT object_id, hash FROM parcels"))
+
+    def get(self, object_id, geometry=True):
+        """Return the parcel as a GeoJSON-style feature, or None (see features
+        for geometry)."""
+        row = self.connection.execute(
+            f"SELECT {_columns(geometry)} FROM parcels WHERE object_id = ?", (object_id,)
+        ).fetchone()
+        return self._feature(row) if row else None
+
+    def feature_at(self, offset, geometry=True):
+        """The parcel at offset in ObjectId order, matching the feature
+        service's resultOffset paging (and so the samplers' offsets)."""
+        row = self.connection.execute(
+            f"SELECT {_columns(geometry)} FROM parcels ORDER BY object_id LIMIT 1 OFFSET ?",
+            (offset,),
+        ).fetchone()
+        return self._feature(row) if row else None
+
+    def features(self, geometry=True):
+        """Every parcel as a GeoJSON-style feature, in ObjectId order, with its
+        "centroid" ([x, y]) when known.
+
+        With geometry=False, the polygon is left out (None) wherever there's a
+        centroid to use instead.
+        """
+        for row in self.connection.execute(
+            f"SELECT {_columns(geometry)} FROM parcels ORDER BY object_id"
+        ):
+            yield self._feature(row)
+
+    @staticmethod
+    def _feature(row):
+        properties, geometry, centroid_x, centroid_y = row
+        feature = {
+            "type": "Feature",
+            "properties": json.loads(properties),
+            "geometry": json.loads(geometry) if geometry else None,
+        }
+        if centroid_x is not None:
+            feature["centroid"] = [centroid_x, centroid_y]
+        return feature
+
+    def upsert(self, features, object_id_field, edit_field=None):
+        """Insert or replace features in batches; returns (count, newest edit)."""
+        count = 0
+        newest_edit = None
+        batch = []
+        for feature in features:
+            edited_at = feature["properties"].get(edit_field) if edit_field else None
+            if edited_at is not None and (newest_edit is None or edited_at > newest_edit):
+                newest_edit = edited_at
+            batch.append(feature)
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                count += self._write(self._rows(batch, object_id_field, edit_field))
+                batch = []
+        count += self._write(self._rows(batch, object_id_field, edit_field))
+        return count, newest_edit
+
+    @staticmethod
+    def _rows(features, object_id_field, edit_field):
+        from geometry import centroids
+
+        ignore = (edit_field,) if edit_field else ()
+        # Centroids for the whole batch at once, where the feature lacks one.
+        computed = centroids(None if f.get("centroid") else f.get("geometry") for f in features)
+        rows = []
+        for feature, centroid in zip(features, computed):
+            properties = feature["properties"]
+            centroid = feature.get("centroid") or centroid or (None, None)
+            rows.append(
+                (
+                    properties[object_id_field],
+                    json.dumps(properties),
+                    json.dumps(feature["geometry"]) if feature.get("geometry") else None,
+                    properties.get(edit_field) if edit_field else None,
+                    attributes_hash(properties, ignore),
+                    *centroid,
+                )
+            )
+        return rows
+
+    def _write(self, rows):
+        if not rows:
+            return 0
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO parcels "
+                "(object_id, properties, geometry, edited_at, hash, centroid_x, centroid_y) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(object_id) DO UPDATE SET "
+                "properties = excluded.properties, geometry = excluded.geometry, "
+                "edited_at = excluded.edited_at, hash = excluded.hash, "
+                "centroid_x = excluded.centroid_x, centroid_y = excluded.centroid_y",
+                rows,
+            )
+        return len(rows)
+
+    def backfill_centroids(self):
+        """Compute the centroid of rows stored without one; returns how many
+        were filled in."""
+        from geometry import centroids
+
+        filled = 0
+        last_id = float("-inf")
+        while True:
+            rows = self.connection.execute(
+                "SELECT object_id, geometry FROM parcels "
+                "WHERE centroid_x IS NULL AND geometry IS NOT NULL AND object_id > ? "
+                "ORDER BY object_id LIMIT ?",
+                (last_id, UPSERT_BATCH_SIZE),
+            ).fetchall()
+            if not rows:
+                return filled
+            points = centroids(json.loads(geometry) for _, geometry in rows)
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE parcels SET centroid_x = ?, centroid_y = ? WHERE object_id = ?",
+                    [(*point, object_id) for (object_id, _), point in zip(rows, points) if point],
+                )
+            filled += sum(1 for point in points if point)
+            last_id = rows[-1][0]
+
+    def delete_missing(self, live_ids):
+        """Delete rows whose ObjectId is no longer in the layer."""
+        stale = self.object_ids() - set(live_ids)
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM parcels WHERE object_id = ?", [(i,) for i in stale]
+            )
+        return len(stale)
+
+    def sync(self, query_url, full=False):
+        """Bring the mirror up to date with the layer at query_url.
+
+        Runs a full download on first use (or when full=True), otherwise an
+        incremental sync. Returns a dict describing what was done.
+        """
+        info = get_layer_info(query_url)
+        object_id_field = info.get("objectIdField", "OBJECTID")
+        edit_field = (info.get("editFieldsInfo") or {}).get("editDateField")
+        watermark = self.get_state("edit_watermark")
+
+        if full or self.get_state("synced_at") is None:
+            mode = "full"
+            upserted, newest_edit = self.upsert(
+                iter_features(query_url), object_id_field, edit_field
+            )
+            live_ids = get_object_ids(query_url)
+        elif edit_field and watermark is not None:
+            mode = "edit-date"
+            changed = get_object_ids(query_url, edit_date_where(edit_field, watermark))
+            upserted, newest_edit = self.upsert(
+                iter_features_by_id(query_url, changed), object_id_field, edit_field
+            )
+            live_ids = get_object_ids(query_url)
+        else:
+            mode = "hash"
+            # Attributes only (no geometry) to find changed rows, then full
+            # features for just those. A geometry-only edit isn't detected here;
+            # run a periodic full sync if that matters.
+            known = self.hashes()
+            ignore = (edit_field,) if edit_field else ()
+            changed = []
+            live_ids = []
+            for feature in iter_features(query_url, return_geometry=False):
+                properties = feature["properties"]
+                object_id = properties[object_id_field]
+                live_ids.append(object_id)
+                if known.get(object_id) != attributes_hash(properties, ignore):
+                    changed.append(object_id)
+            upserted, newest_edit = self.upsert(
+                iter_features_by_id(query_url, changed), object_id_field, edit_field
+            )
+
+        deleted = self.delete_missing(live_ids)
+        backfilled = self.backfill_centroids()
+        if backfilled:
+            logger.info(f"Computed centroids for {backfilled} parcels mirrored without one")
+        with self.connection:
+            if newest_edit is not None:
+                self.set_state("edit_watermark", max(newest_edit, watermark or 0))
+            self.set_state(
+                "synced_at", datetime.datetime.now(datetime.timezone.utc).isoformat()
+            )
+
+        summary = {"mode": mode, "upserted": upserted, "deleted": deleted, "total": self.count()}
+        logger.info(
+            f"Mirror sync ({mode}): {upserted} upserted, {deleted} deleted, "
+            f"{summary['total']} parcels"
+        )
+        return summary
+
+
+def _columns(geometry):
+    return FEATURE_COLUMNS if geometry else COMPACT_FEATURE_COLUMNS
+
+
+def main():
+    from everylot import FEATURE_SERVICE_URL, PROJECT_PATH
+
+    parser = argparse.ArgumentParser(description="Sync a local SQLite mirror of the parcel layer")
+    parser.add_argument("--db", default=f"{PROJECT_PATH}/parcels.sqlite", help="mirror database path")
+    parser.add_argument("--full", action="store_true", help="re-download everything")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    mirror = ParcelMirror(args.db)
+    try:
+        mirror.sync(FEATURE_SERVICE_URL, full=args.full)
+    finally:
+        mirror.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Browser-free screenshots: a perspective view cut out of the panorama itself.
+
+capture_panoramas() has the same signature as screenshot.capture_screenshots,
+but instead of driving mapillary-js in headless Chromium it asks the Graph API
+for the image's equirectangular thumbnail (thumb_2048_url), downloads it, and
+reprojects the part around the viewer center (see everylot.compute_viewer_center)
+into a VIEWPORT-sized pinhole view with numpy. Both shots of a post are
+downloaded concurrently, and the reprojection runs off the event loop.
+
+The field of view approximates the viewer's at ZOOM, so the framing is close
+to the browser's, though not pixel-identical (the thumbnail is lower
+resolution than the viewer's full-zoom tiles). Decoding the thumbnail (JPEG)
+and writing the PNG need Pillow, which only this backend uses.
+"""
+import logging
+import math
+import os
+
+import numpy as np
+
+import metrics
+import transport
+from screenshot import VIEWPORT, ZOOM
+
+logger = logging.getLogger("everylot.panorama")
+
+MAPILLARY_GRAPH_URL = "https://graph.mapillary.com"
+THUMBNAIL_FIELD = "thumb_2048_url"
+
+# Horizontal field of view (degrees) of the viewer at zoom 0; each zoom level
+# halves the extent of the image plane.
+BASE_FOV = 90.0
+
+# What screenshot_cache.shot_key records as the renderer, so these shots and
+# the browser's are cached apart. Bump it when the rendering changes.
+RENDERER = "panorama-1"
+
+
+def field_of_view(zoom=ZOOM):
+    """Horizontal field of view, in degrees, at the viewer zoom level."""
+    half = math.tan(math.radians(BASE_FOV) / 2) / 2 ** zoom
+    return math.degrees(2 * math.atan(half))
+
+
+def view_coordinates(center_x, center_y, width, height, fov):
+    """Where each pixel of a width x height perspective view looks in the panorama.
+
+    center_x and center_y are the viewer center (0-1 across and down the
+    equirectangular image) and fov the horizontal field of view in degrees.
+    Returns (u, v), two (height, width) arrays of panorama coordinates in the
+    same units; u wraps around at the seam.
+    """
+    half_width = math.tan(math.radians(fov) / 2)
+    half_height = half_width * height / width
+    # Image plane at z = 1, x to the right and y up, through pixel centers.
+    x = ((np.arange(width) + 0.5) / width * 2 - 1) * half_width
+    y = (1 - (np.arange(height) + 0.5) / height * 2) * half_height
+
+    # Tilt the view up or down to the center's latitude (rotation about x).
+    pitch = (0.5 - center_y) * math.pi
+    cos_pitch, sin_pitch = math.cos(pitch), math.sin(pitch)
+    x = np.broadcast_to(x[np.newaxis, :], (height, width))
+    ray_y = np.broadcast_to((y * cos_pitch + sin_pitch)[:, np.newaxis], (height, width))
+    ray_z = np.broadcast_to((cos_pitch - y * sin_pitch)[:, np.newaxis], (height, width))
+
+    longitude = np.arctan2(x, ray_z)
+    latitude = np.arctan2(ray_y, np.hypot(x, ray_z))
+    u = (center_x + longitude / (2 * math.pi)) % 1.0
+    v = 0.5 - latitude / math.pi
+    return u, v
+
+
+def sample(pano, u, v):
+    """Bilinearly sample an (h, w) or (h, w, channels) uint8 image at panorama
+    coordinates u, v (see view_coordinates), wrapping horizontally."""
+    height, width = pano.shape[:2]
+    px = u * width - 0.5
+    py = np.clip(v * height - 0.5, 0, height - 1)
+    x0 = np.floor(px).astype(np.int64)
+    y0 = np.floor(py).astype(np.int64)
+    fx = (px - x0).astype(np.float32)
+    fy = (py - y0).astype(np.float32)
+    if pano.ndim == 3:
+        fx, fy = fx[..., np.newaxis], fy[..., np.newaxis]
+    x0 %= width
+    x1 = (x0 + 1) % width
+    y1 = np.minimum(y0 + 1, height - 1)
+
+    top = pano[y0, x0] * (1 - fx) + pano[y0, x1] * fx
+    bottom = pano[y1, x0] * (1 - fx) + pano[y1, x1] * fx
+    return np.clip(np.rint(top * (1 - fy) + bottom * fy), 0, 255).astype(np.uint8)
+
+
+def render_view(pano, center_x, center_y, width=None, height=None, zoom=ZOOM):
+    """The perspective view of the equirectangular image pano (a uint8 array)
+    centered on (center_x, center_y), VIEWPORT-sized by default."""
+    width = width or VIEWPORT["width"]
+    height = height or VIEWPORT["height"]
+    u, v = view_coordinates(center_x, center_y, width, height, field_of_view(zoom))
+    return sample(pano, u, v)
+
+
+def _pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError(
+            "The panorama capture backend needs Pillow (pip install pillow)"
+        ) from None
+    return Image
+
+
+def render_file(content, center_x, center_y, output_path):
+    """Decode the panorama image bytes content and write the view centered on
+    (center_x, center_y) to output_path as a PNG."""
+    import io
+
+    Image = _pillow()
+    with Image.open(io.BytesIO(content)) as image:
+        pano = np.asarray(image.convert("RGB"))
+    Image.fromarray(render_view(pano, center_x, center_y)).save(output_path, "PNG")
+
+
+async def fetch_panorama(image_key):
+    """Download the equirectangular thumbnail of Mapillary image image_key."""
+    params = {
+        "access_token": os.environ.get("MAPILLARY_ACCESS_TOKEN"),
+        "fields": THUMBNAIL_FIELD,
+    }
+    with metrics.timer("panorama_fetch"):
+        response = await transport.aget(f"{MAPILLARY_GRAPH_URL}/{image_key}", params=params, timeout=30)
+        response.raise_for_status()
+        url = response.json().get(THUMBNAIL_FIELD)
+        if not url:
+            raise ValueError(f"Mapillary image {image_key} has no {THUMBNAIL_FIELD}")
+        response = await transport.aget(url, timeout=60)
+        response.raise_for_status()
+    return response.content
+
+
+async def capture_panoramas(shots):
+    """Render a list of Mapillary images without a browser.
+
+    Args:
+        shots: iterable of (image_key, center_x, center_y, output_path) tuples.
+    """
+    import asyncio
+
+    shots = list(shots)
+    # Fail before downloading anything if Pillow is missing.
+    _pillow()
+    # One failed download costs only its own shot: the rest are rendered, and
+    # build_post decides whether what's missing matters.
+    panoramas = await asyncio.gather(
+        *(fetch_panorama(shot[0]) for shot in shots), return_exceptions=True
+    )
+    for (image_key, center_x, center_y, output_path), content in zip(shots, panoramas):
+        if isinstance(content, Exception):
+            logger.warning(f"Couldn't download the panorama of {image_key}: {content}")
+            continue
+        with metrics.timer("panorama_render"):
+            await asyncio.to_thread(render_file, content, center_x, center_y, output_path)
+        logger.info(f"Panorama view of {image_key} saved to {output_path}")
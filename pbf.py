@@ -0,0 +1,239 @@
+"""Decoder for ArcGIS FeatureServer query results in f=pbf format.
+
+The Esri FeatureCollection protocol buffer is a good deal smaller than the
+equivalent GeoJSON (quantized, delta-encoded integer coordinates, attributes
+as positional values), but there's no small pure-Python package for it, so this
+reads the handful of messages a query result uses straight off the wire and
+returns GeoJSON-style feature dicts, so callers can't tell which format the
+server sent.
+"""
+import struct
+
+# esriGeometryType values in FeatureResult.geometryType.
+GEOMETRY_POINT = 0
+GEOMETRY_MULTIPOINT = 1
+GEOMETRY_POLYLINE = 2
+GEOMETRY_POLYGON = 3
+
+# Transform.quantizeOriginPostion values.
+ORIGIN_UPPER_LEFT = 0
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_BYTES = 2
+WIRE_FIXED32 = 5
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise ValueError("truncated varint")
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _fields(buf):
+    """Yield (field_number, wire_type, value) for each field in a message.
+
+    Varints come back as ints; length-delimited and fixed-width fields as bytes.
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field_number, wire_type = key >> 3, key & 7
+        if wire_type == WIRE_VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == WIRE_BYTES:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_FIXED64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == WIRE_FIXED32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+        if pos > end:
+            raise ValueError("truncated message")
+        yield field_number, wire_type, value
+
+
+def _varints(wire_type, value):
+    """Repeated varint field values, whether packed or not."""
+    if wire_type == WIRE_VARINT:
+        return [value]
+    values = []
+    pos = 0
+    while pos < len(value):
+        item, pos = _read_varint(value, pos)
+        values.append(item)
+    return values
+
+
+def _decode_value(buf):
+    for field_number, wire_type, value in _fields(buf):
+        if field_number == 1:
+            return bytes(value).decode("utf-8")
+        if field_number == 2:
+            return struct.unpack("<f", value)[0]
+        if field_number == 3:
+            return struct.unpack("<d", value)[0]
+        if field_number in (4, 8):
+            return _zigzag(value)
+        if field_number in (5, 7):
+            return value
+        if field_number == 6:
+            return value - (1 << 64) if value >= 1 << 63 else value
+        if field_number == 9:
+            return bool(value)
+    return None
+
+
+def _decode_transform(buf):
+    transform = {"origin": ORIGIN_UPPER_LEFT, "scale": (1.0, 1.0), "translate": (0.0, 0.0)}
+    for field_number, wire_type, value in _fields(buf):
+        if field_number == 1:
+            transform["origin"] = value
+        elif field_number in (2, 3):
+            pair = [0.0, 0.0]
+            for axis, _, number in _fields(value):
+                if axis in (1, 2):
+                    pair[axis - 1] = struct.unpack("<d", number)[0]
+            transform["scale" if field_number == 2 else "translate"] = tuple(pair)
+    return transform
+
+
+def _decode_geometry(buf, transform):
+    """Return (parts, points): points per part and the dequantized coordinates."""
+    lengths = []
+    coords = []
+    for field_number, wire_type, value in _fields(buf):
+        if field_number == 2:
+            lengths.extend(_varints(wire_type, value))
+        elif field_number == 3:
+            coords.extend(_zigzag(v) for v in _varints(wire_type, value))
+
+    x_scale, y_scale = transform["scale"]
+    x_translate, y_translate = transform["translate"]
+    y_sign = -1 if transform["origin"] == ORIGIN_UPPER_LEFT else 1
+
+    # Coordinates are deltas from the previous vertex, running on across parts.
+    points = []
+    x = y = 0
+    for i in range(0, len(coords) - 1, 2):
+        x += coords[i]
+        y += coords[i + 1]
+        points.append([x * x_scale + x_translate, y_translate + y_sign * y * y_scale])
+
+    if not lengths:
+        lengths = [len(points)]
+    parts = []
+    start = 0
+    for length in lengths:
+        parts.append(points[start:start + length])
+        start += length
+    return parts
+
+
+def _ring_area(ring):
+    return sum(
+        x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])
+    ) / 2
+
+
+def _to_geojson(geometry_type, parts):
+    if geometry_type == GEOMETRY_POINT:
+        return {"type": "Point", "coordinates": parts[0][0]}
+    if geometry_type == GEOMETRY_MULTIPOINT:
+        return {"type": "MultiPoint", "coordinates": [p for part in parts for p in part]}
+    if geometry_type == GEOMETRY_POLYLINE:
+        if len(parts) == 1:
+            return {"type": "LineString", "coordinates": parts[0]}
+        return {"type": "MultiLineString", "coordinates": parts}
+    if geometry_type == GEOMETRY_POLYGON:
+        # Esri outer rings run clockwise and holes counter-clockwise; each hole
+        # belongs to the outer ring before it.
+        polygons = []
+        for ring in parts:
+            if _ring_area(ring) < 0 or not polygons:
+                polygons.append([ring])
+            else:
+                polygons[-1].append(ring)
+        if len(polygons) == 1:
+            return {"type": "Polygon", "coordinates": polygons[0]}
+        return {"type": "MultiPolygon", "coordinates": polygons}
+    raise ValueError(f"unsupported geometry type {geometry_type}")
+
+
+def _decode_feature_result(buf):
+    field_names = []
+    # proto3 leaves out fields at their default, and geometryType's is 0
+    # (esriGeometryPoint), so point layers usually don't send it at all.
+    geometry_type = GEOMETRY_POINT
+    transform = _decode_transform(b"")
+    raw_features = []
+    exceeded = False
+
+    for field_number, wire_type, value in _fields(buf):
+        if field_number == 7:
+            geometry_type = value
+        elif field_number == 9:
+            exceeded = bool(value)
+        elif field_number == 12:
+            transform = _decode_transform(value)
+        elif field_number == 13:
+            name = None
+            for number, _, field_value in _fields(value):
+                if number == 1:
+                    name = bytes(field_value).decode("utf-8")
+            field_names.append(name)
+        elif field_number == 15:
+            raw_features.append(value)
+
+    features = []
+    for raw in raw_features:
+        values = []
+        feature = {"type": "Feature", "properties": {}, "geometry": None}
+        for field_number, wire_type, value in _fields(raw):
+            if field_number == 1:
+                values.append(_decode_value(value))
+            elif field_number == 2:
+                parts = _decode_geometry(value, transform)
+                if parts and parts[0]:
+                    feature["geometry"] = _to_geojson(geometry_type, parts)
+            elif field_number == 4:
+                parts = _decode_geometry(value, transform)
+                if parts and parts[0]:
+                    feature["centroid"] = parts[0][0]
+        feature["properties"] = dict(zip(field_names, values))
+        features.append(feature)
+    return features, exceeded
+
+
+def decode_feature_collection(data):
+    """Decode an f=pbf query response.
+
+    Returns (features, exceeded_transfer_limit), with features as GeoJSON-style
+    dicts (plus a "centroid" [x, y] when the query asked for returnCentroid).
+    Raises ValueError if data isn't a feature query result.
+    """
+    data = memoryview(data)
+    for field_number, wire_type, value in _fields(data):
+        if field_number == 2 and wire_type == WIRE_BYTES:
+            for result_number, result_type, result in _fields(value):
+                if result_number == 1 and result_type == WIRE_BYTES:
+                    return _decode_feature_result(result)
+    raise ValueError("response is not a FeatureCollection feature result")
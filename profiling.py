@@ -0,0 +1,138 @@
+"""Optional profiling of a posting run (`python everylot.py --profile`).
+
+When enabled, each section of the run (one per parcel attempt, plus one for
+the Bluesky posts) is profiled on its own and written to its own files under
+the run's profile directory, so a slow run can be pinned on the attempt and
+the code that made it slow: the network, shapely, the browser or atproto.
+
+Two backends:
+
+- "cprofile": the standard library's deterministic profiler. Writes a .prof
+  file (open with `python -m pstats` or snakeviz) and a .txt with the top
+  functions by cumulative time, readable straight from an Actions artifact.
+- "pyinstrument": a sampling profiler, if installed (it's optional and not in
+  requirements.txt). It runs in async mode, so time spent awaiting inside
+  capture_screenshots is charged to the awaiting coroutine rather than to the
+  event loop. Writes .html and .txt.
+
+"auto" uses pyinstrument when it's available and cProfile otherwise. Sections
+don't nest: a section opened inside another is folded into the outer profile.
+Neither backend can tell concurrent tasks apart, so a profiled run prepares
+its candidates one at a time (see everylot's __main__). A profiled replay
+keeps the recorded run's prefetching, so its attempt profiles also hold the
+work of the candidates prepared alongside.
+"""
+import contextlib
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+
+logger = logging.getLogger("everylot.profiling")
+
+BACKENDS = ("auto", "cprofile", "pyinstrument")
+
+# Lines of the text report written next to each cProfile dump.
+TEXT_REPORT_LINES = 40
+
+_directory = None
+_backend = None
+_local = threading.local()
+
+
+def pyinstrument_available():
+    try:
+        import pyinstrument  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def enable(directory, backend="auto"):
+    """Profile every subsequent section into a new timestamped folder under
+    directory; returns that folder."""
+    global _directory, _backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown profiler backend {backend!r}; expected one of {BACKENDS}")
+    if backend == "auto":
+        backend = "pyinstrument" if pyinstrument_available() else "cprofile"
+    elif backend == "pyinstrument" and not pyinstrument_available():
+        raise RuntimeError("pyinstrument isn't installed (pip install pyinstrument)")
+
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    _directory = os.path.join(directory, stamp)
+    _backend = backend
+    os.makedirs(_directory, exist_ok=True)
+    logger.info(f"Profiling with {backend} into {_directory}")
+    return _directory
+
+
+def disable():
+    global _directory, _backend
+    _directory = _backend = None
+
+
+def enabled():
+    return _directory is not None
+
+
+def _file_stem(name):
+    return os.path.join(_directory, re.sub(r"[^A-Za-z0-9_.-]+", "-", name))
+
+
+@contextlib.contextmanager
+def section(name):
+    """Profile the block as name (a no-op unless profiling is enabled)."""
+    if not enabled() or getattr(_local, "active", False):
+        yield
+        return
+
+    stem = _file_stem(name)
+    _local.active = True
+    try:
+        if _backend == "pyinstrument":
+            with _pyinstrument(stem):
+                yield
+        else:
+            with _cprofile(stem):
+                yield
+    finally:
+        _local.active = False
+
+
+@contextlib.contextmanager
+def _cprofile(stem):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(f"{stem}.prof")
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats("cumulative").print_stats(TEXT_REPORT_LINES)
+        with open(f"{stem}.txt", "w") as f:
+            f.write(report.getvalue())
+        logger.info(f"Wrote profile {stem}.prof")
+
+
+@contextlib.contextmanager
+def _pyinstrument(stem):
+    from pyinstrument import Profiler
+
+    profiler = Profiler(async_mode="enabled")
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        with open(f"{stem}.html", "w") as f:
+            f.write(profiler.output_html())
+        with open(f"{stem}.txt", "w") as f:
+            f.write(profiler.output_text(unicode=False, color=False))
+        logger.info(f"Wrote profile {stem}.html")
@@ -0,0 +1,278 @@
+"""Per-host rate limiting for the live services (Mapillary and ArcGIS).
+
+RateLimitedTransport wraps another transport (see transport.py; the live one
+is wrapped by default) and schedules every request through a HostLimiter for
+its host:
+
+- a token bucket caps the request rate, with room for a short burst;
+- a concurrency limit adapts AIMD-style: it grows by about one slot per
+  limit's worth of successful requests and halves on every throttled one;
+- a throttled response (429, or 503 with Retry-After) pauses the whole host for
+  its Retry-After (or an exponential backoff without one), then the request is
+  retried, up to MAX_RETRIES times.
+
+A request still throttled after that raises Throttled, so callers can tell
+"rate limited" from "nothing there" (Throttled is a RequestException, so code
+that only knows about network errors still treats it as one). Each limiter
+keeps its own counters (see stats()), and time spent waiting is timed as the
+"rate_limit_wait" stage in metrics.py.
+"""
+import email.utils
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import metrics
+
+logger = logging.getLogger("everylot.ratelimit")
+
+# (requests per second, burst, max concurrency) per host. The services don't
+# publish hard limits for these endpoints; these stay well inside what they've
+# tolerated and the adaptive limit backs off from there.
+HOST_LIMITS = {
+    "graph.mapillary.com": (50.0, 50, 16),
+    "services2.arcgis.com": (20.0, 20, 8),
+    "opengis.detroitmi.gov": (10.0, 10, 4),
+}
+DEFAULT_LIMITS = (10.0, 10, 4)
+
+# Concurrency a host starts at before the limit adapts.
+INITIAL_CONCURRENCY = 4
+
+THROTTLE_STATUSES = (429, 503)
+MAX_RETRIES = 3
+
+# A Retry-After longer than this isn't waited out; the request raises Throttled.
+MAX_RETRY_AFTER = 60.0
+
+
+class Throttled(requests.exceptions.RequestException):
+    """A request the service kept rate limiting; retry_after is its last
+    Retry-After in seconds (None if it gave none)."""
+
+    def __init__(self, message, host=None, retry_after=None, **kwargs):
+        super().__init__(message, **kwargs)
+        self.host = host
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(value, now=None):
+    """Parse a Retry-After header (delta-seconds or an HTTP date) into seconds,
+    or None if it's missing or unreadable."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+def is_throttled(response):
+    """Whether response is the service rate limiting us."""
+    if response.status_code == 429:
+        return True
+    return response.status_code in THROTTLE_STATUSES and "Retry-After" in response.headers
+
+
+class HostLimiter:
+    """Token bucket, adaptive concurrency limit and Retry-After pause for one
+    host. Safe to share between threads and an event loop."""
+
+    def __init__(self, host, rate, burst, max_concurrency, initial_concurrency=INITIAL_CONCURRENCY):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.limit = float(min(initial_concurrency, max_concurrency))
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._async_waiters = []
+
+    def reserve(self):
+        """Take a token; returns how long to wait before sending (for the
+        bucket to refill, or for a Retry-After pause to end)."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            delay = max(0.0, -self.tokens / self.rate, self.paused_until - now)
+            self.waited_seconds += delay
+            return delay
+
+    def _try_enter(self):
+        if self.in_flight < max(1, int(self.limit)):
+            self.in_flight += 1
+            return True
+        return False
+
+    def enter(self):
+        """Wait for a concurrency slot (blocking)."""
+        with self._lock:
+            while not self._try_enter():
+                self._slot_freed.wait()
+
+    async def aenter(self):
+        """Wait for a concurrency slot without blocking the event loop."""
+        import asyncio
+
+        while True:
+            with self._lock:
+                if self._try_enter():
+                    return
+                waiter = asyncio.get_running_loop().create_future()
+                self._async_waiters.append(waiter)
+            await waiter
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._slot_freed.notify()
+            waiters, self._async_waiters = self._async_waiters, []
+        # Waiters re-check for a slot; those that miss out queue up again.
+        for waiter in waiters:
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+    def record(self, response):
+        """Adapt the concurrency limit to a response; returns whether it was
+        throttled."""
+        throttled = is_throttled(response)
+        with self._lock:
+            self.requests += 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        if throttled:
+            metrics.count("throttled")
+        return throttled
+
+    def pause(self, seconds):
+        """Hold every request to the host for seconds, ahead of a retry."""
+        with self._lock:
+            self.retries += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "waited_seconds": round(self.waited_seconds, 3),
+            }
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class RateLimitedTransport:
+    """Schedule another transport's requests through per-host HostLimiters."""
+
+    def __init__(self, inner, limits=None, max_retries=MAX_RETRIES):
+        self.inner = inner
+        self.limits = {**HOST_LIMITS, **(limits or {})}
+        self.max_retries = max_retries
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            if host not in self.limiters:
+                self.limiters[host] = HostLimiter(host, *self.limits.get(host, DEFAULT_LIMITS))
+            return self.limiters[host]
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        limiter = self.limiter(url)
+        for attempt in range(self.max_retries + 1):
+            self._wait(limiter.reserve())
+            limiter.enter()
+            try:
+                response = self.inner.get(url, params=params, timeout=timeout, **kwargs)
+            finally:
+                limiter.leave()
+            if not self._throttled(limiter, response, attempt):
+                return response
+
+    async def aget(self, url, params=None, timeout=30, **kwargs):
+        import asyncio
+
+        limiter = self.limiter(url)
+        for attempt in range(self.max_retries + 1):
+            await self._await(limiter.reserve())
+            await limiter.aenter()
+            try:
+                if hasattr(self.inner, "aget"):
+                    response = await self.inner.aget(url, params=params, timeout=timeout, **kwargs)
+                else:
+                    response = await asyncio.to_thread(
+                        self.inner.get, url, params=params, timeout=timeout, **kwargs
+                    )
+            finally:
+                limiter.leave()
+            if not self._throttled(limiter, response, attempt):
+                return response
+
+    async def aclose(self):
+        if hasattr(self.inner, "aclose"):
+            await self.inner.aclose()
+
+    def _throttled(self, limiter, response, attempt):
+        """Whether to retry response; raises Throttled once out of retries."""
+        if not limiter.record(response):
+            return False
+        retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+        pause = retry_after if retry_after is not None else 2.0 ** attempt
+        if attempt >= self.max_retries or pause > MAX_RETRY_AFTER:
+            raise Throttled(
+                f"{limiter.host} is rate limiting requests (HTTP {response.status_code})",
+                host=limiter.host,
+                retry_after=retry_after,
+                response=response,
+            )
+        logger.warning(f"{limiter.host} throttled a request; retrying in {pause:.1f}s")
+        limiter.pause(pause)
+        return True
+
+    @staticmethod
+    def _wait(delay):
+        if delay > 0:
+            with metrics.timer("rate_limit_wait"):
+                time.sleep(delay)
+
+    @staticmethod
+    async def _await(delay):
+        if delay > 0:
+            import asyncio
+
+            with metrics.timer("rate_limit_wait"):
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        """Per-host limiter counters, for the run summary."""
+        with self._lock:
+            limiters = dict(self.limiters)
+        return {host: limiter.stats() for host, limiter in sorted(limiters.items())}
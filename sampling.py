@@ -0,0 +1,328 @@
+import hashlib
+import json
+import logging
+import random
+
+from ledger import save_json
+
+logger = logging.getLogger("everylot.sampling")
+
+# Rounds of the Feistel network behind PermutationSampler. Four rounds of a
+# keyed hash are plenty to scatter consecutive indexes across the city.
+FEISTEL_ROUNDS = 4
+
+# CoverageModel groups consecutive offsets into blocks of this many parcels.
+# Offsets follow ObjectId order, which tracks the parcel numbering and so keeps
+# each block to a compact area, without needing any geometry to sample.
+COVERAGE_BLOCK_SIZE = 512
+
+# Beta prior on a block's success rate (a 1-in-10 guess worth ten attempts), so
+# a block with a handful of unlucky attempts isn't written off immediately.
+PRIOR_SUCCESSES = 1
+PRIOR_ATTEMPTS = 10
+
+# Lowest sampling weight any block gets relative to its success estimate, so
+# areas that never worked still get retried as new imagery is captured.
+COVERAGE_FLOOR = 0.02
+
+
+class PermutationSampler:
+    """Draw parcel offsets without replacement across runs.
+
+    Walks a seeded pseudo-random permutation of [0, count): a Feistel network
+    over the smallest even-bit power of two covering count, with cycle-walking
+    to stay inside the range. Every offset comes up exactly once per pass
+    (epoch) before any repeats, and the whole state is four integers, so it
+    costs nothing per parcel to keep between runs.
+    """
+
+    def __init__(self, count, seed=None, epoch=0, index=0, limit=None, requeued=None):
+        if count <= 0:
+            raise ValueError("count must be positive")
+        self.count = count
+        # The current parcel count. It can drift from count (the size of this
+        # pass's permutation) as parcels are split or merged; offsets past it
+        # are passed over until the next pass picks up the new count.
+        self.limit = count if limit is None else limit
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.epoch = epoch
+        self.index = index
+        # Offsets handed back with requeue, drawn again before the walk goes on.
+        self.requeued = list(requeued or ())
+        self.last_offset = None
+        self._split_domain()
+
+    def _split_domain(self):
+
+        # Split the domain into two equal halves of half_bits each.
+        bits = max(2, (self.count - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+
+    def _round(self, round_number, value):
+        data = f"{self.seed}:{self.epoch}:{round_number}:{value}".encode("ascii")
+        digest = hashlib.blake2b(data, digest_size=8).digest()
+        return int.from_bytes(digest, "big") & self.half_mask
+
+    def _feistel(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(round_number, right)
+        return (left << self.half_bits) | right
+
+    def permute(self, index):
+        """Map index in [0, count) to its offset in this epoch's permutation."""
+        # The Feistel network permutes the whole power-of-two domain; walking
+        # the cycle until we land back inside [0, count) keeps it a bijection
+        # on the parcel range. The domain is under 4x count, so this is short.
+        value = self._feistel(index)
+        while value >= self.count:
+            value = self._feistel(value)
+        return value
+
+    def next_offset(self):
+        """Return the next offset, starting a freshly shuffled pass when the
+        current one has visited every parcel."""
+        while self.requeued:
+            offset = self.requeued.pop(0)
+            if offset < self.limit:
+                self.last_offset = offset
+                return offset
+        while True:
+            if self.index >= self.count:
+                logger.info(f"Visited all {self.count} parcels; starting pass {self.epoch + 1}")
+                self.epoch += 1
+                self.index = 0
+                self.count = self.limit
+                self._split_domain()
+            offset = self.permute(self.index)
+            self.index += 1
+            if offset < self.limit:
+                self.last_offset = offset
+                return offset
+
+    def requeue(self, offset):
+        """Hand back an offset drawn but never tried (a candidate prepared
+        ahead and not needed), to be drawn again next."""
+        if offset not in self.requeued:
+            self.requeued.append(offset)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "seed": self.seed,
+            "epoch": self.epoch,
+            "index": self.index,
+            "requeued": self.requeued,
+        }
+
+    @classmethod
+    def load(cls, path, count):
+        """Resume the walk saved at path, or start a new one.
+
+        count is the current parcel count. The saved pass carries on even if
+        the count has drifted since; the next pass is sized to the new count.
+        """
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls(count)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable sampler state {path}: {e}")
+            return cls(count)
+
+        return cls(
+            state["count"],
+            seed=state["seed"],
+            epoch=state["epoch"],
+            index=state["index"],
+            limit=count,
+            requeued=state.get("requeued"),
+        )
+
+    def save(self, path):
+        save_json(self.to_dict(), path)
+
+
+class AliasTable:
+    """Walker/Vose alias table: O(n) to build, O(1) per weighted draw."""
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = float(sum(weights))
+        if n == 0 or total <= 0:
+            raise ValueError("weights must contain a positive value")
+
+        scaled = [w * n / total for w in weights]
+        self.probability = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            low, high = small.pop(), large.pop()
+            self.probability[low] = scaled[low]
+            self.alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            (small if scaled[high] < 1.0 else large).append(high)
+        # Whatever is left is 1.0 up to rounding error.
+
+    def draw(self, rng=random):
+        column = rng.randrange(len(self.probability))
+        if rng.random() < self.probability[column]:
+            return column
+        return self.alias[column]
+
+
+class CoverageModel:
+    """Per-block attempt/success counts learned from past runs.
+
+    A success is an attempt that produced a before/after pair; a failure is one
+    the parcel's own data ruled out (no imagery, no pair). Transient failures
+    shouldn't be recorded. The counts drive CoverageSampler and give the
+    attempts-per-success metric.
+    """
+
+    def __init__(self, count, block_size=COVERAGE_BLOCK_SIZE, attempts=None, successes=None):
+        self.count = count
+        self.block_size = block_size
+        blocks = -(-count // block_size)
+        self.attempts = list(attempts) if attempts else [0] * blocks
+        self.successes = list(successes) if successes else [0] * blocks
+
+    @property
+    def blocks(self):
+        return len(self.attempts)
+
+    def block_of(self, offset):
+        return offset // self.block_size
+
+    def block_range(self, block):
+        start = block * self.block_size
+        return start, min(start + self.block_size, self.count)
+
+    def record(self, offset, success):
+        if offset is None:
+            return
+        block = self.block_of(offset)
+        self.attempts[block] += 1
+        if success:
+            self.successes[block] += 1
+
+    def success_rate(self, block):
+        """Posterior mean success rate for a block."""
+        return (self.successes[block] + PRIOR_SUCCESSES) / (
+            self.attempts[block] + PRIOR_ATTEMPTS
+        )
+
+    def observed_attempts_per_success(self):
+        """Recorded attempts per success over all runs, or None before the first."""
+        successes = sum(self.successes)
+        return sum(self.attempts) / successes if successes else None
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "block_size": self.block_size,
+            "attempts": self.attempts,
+            "successes": self.successes,
+        }
+
+    @classmethod
+    def load(cls, path, count):
+        """Load saved counts, starting fresh if missing or unreadable.
+
+        A changed parcel count only shifts offsets slightly, so the saved
+        blocks are kept and the list is grown or trimmed to fit.
+        """
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls(count)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable coverage model {path}: {e}")
+            return cls(count)
+
+        if state.get("block_size") != COVERAGE_BLOCK_SIZE:
+            logger.info("Coverage block size changed; starting a new coverage model")
+            return cls(count)
+
+        model = cls(count)
+        kept = min(model.blocks, len(state["attempts"]))
+        model.attempts[:kept] = state["attempts"][:kept]
+        model.successes[:kept] = state["successes"][:kept]
+        return model
+
+    def save(self, path):
+        save_json(self.to_dict(), path)
+
+
+class CoverageSampler:
+    """Draw offsets weighted by each block's learned chance of a post.
+
+    A block is picked from an alias table over (size x max(success rate,
+    floor)) and an offset uniformly within it. Sampling is with replacement;
+    a run redraws parcels the ledger already lists without spending an
+    attempt on them (see everylot.MAX_LEDGER_REDRAWS).
+    """
+
+    def __init__(self, model, floor=COVERAGE_FLOOR, rng=None):
+        self.model = model
+        self.floor = floor
+        self.rng = rng or random.Random()
+        self.last_offset = None
+        self._table = None
+
+    def weights(self):
+        weights = []
+        for block in range(self.model.blocks):
+            start, end = self.model.block_range(block)
+            weights.append((end - start) * max(self.model.success_rate(block), self.floor))
+        return weights
+
+    def expected_attempts_per_success(self):
+        """Attempts per success the current weights should need, per the model."""
+        weights = self.weights()
+        success = sum(
+            w * self.model.success_rate(block) for block, w in enumerate(weights)
+        ) / sum(weights)
+        return 1 / success
+
+    def next_offset(self):
+        # Rebuild the table once per run (the weights only move by a few
+        # attempts within a run, which doesn't warrant an O(n) rebuild each).
+        if self._table is None:
+            self._table = AliasTable(self.weights())
+        block = self._table.draw(self.rng)
+        start, end = self.model.block_range(block)
+        self.last_offset = self.rng.randrange(start, end)
+        return self.last_offset
+
+
+class SamplerExhausted(Exception):
+    """Raised by FixedSampler when it has no offsets left to draw."""
+
+
+class FixedSampler:
+    """Draw a given list of offsets in order, such as the ones a recorded run
+    drew (see manifest.py), so a replay tries the same parcels.
+
+    Drawing past the end raises SamplerExhausted and sets exhausted: a replay
+    that wants more offsets than the recorded run drew has diverged from it.
+    """
+
+    def __init__(self, offsets):
+        self.offsets = list(offsets)
+        self.index = 0
+        self.last_offset = None
+        self.exhausted = False
+
+    def next_offset(self):
+        if self.index >= len(self.offsets):
+            self.exhausted = True
+            raise SamplerExhausted(f"Only {len(self.offsets)} offsets to replay; the replay drew more")
+        self.last_offset = self.offsets[self.index]
+        self.index += 1
+        return self.last_offset
@@ -3,10 +3,16 @@ import asyncio
 import logging
 import os
 
-from playwright.async_api import async_playwright
+import metrics
 
 logger = logging.getLogger("everylot.screenshot")
 
+# What a screenshot looks like besides the image and center: the page size,
+# the viewer's zoom and the viewer itself. screenshot_cache.py keys on these.
+VIEWPORT = {"width": 700, "height": 700}
+ZOOM = 0.7
+MAPILLARY_JS_VERSION = "4.1.2"
+
 
 async def _shoot(page, image_key, center_x, center_y, output_path):
     """Render one Mapillary image in the given page and screenshot it."""
@@ -39,14 +45,18 @@ async def capture_screenshots(shots):
     Args:
         shots: iterable of (image_key, center_x, center_y, output_path) tuples.
     """
+    from playwright.async_api import async_playwright
+
     async with async_playwright() as p:
         # One browser launch covers every shot, instead of one per image.
-        browser = await p.chromium.launch(headless=True)
+        with metrics.timer("browser_launch"):
+            browser = await p.chromium.launch(headless=True)
         try:
             for image_key, center_x, center_y, output_path in shots:
-                page = await browser.new_page(viewport={"width": 700, "height": 700})
+                page = await browser.new_page(viewport=VIEWPORT)
                 try:
-                    await _shoot(page, image_key, center_x, center_y, output_path)
+                    with metrics.timer("screenshot_render"):
+                        await _shoot(page, image_key, center_x, center_y, output_path)
                 finally:
                     await page.close()
         finally:
@@ -73,8 +83,8 @@ def create_mapillary_html(image_key="1012138957500240", center_x=0.5, center_y=0
         <title>Mapillary Viewer</title>
         <meta charset="utf-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <script src="https://unpkg.com/mapillary-js@4.1.2/dist/mapillary.js"></script>
-        <link rel="stylesheet" href="https://unpkg.com/mapillary-js@4.1.2/dist/mapillary.css">
+        <script src="https://unpkg.com/mapillary-js@{MAPILLARY_JS_VERSION}/dist/mapillary.js"></script>
+        <link rel="stylesheet" href="https://unpkg.com/mapillary-js@{MAPILLARY_JS_VERSION}/dist/mapillary.css">
         <style>
             body {{
                 margin: 0;
@@ -115,7 +125,7 @@ def create_mapillary_html(image_key="1012138957500240", center_x=0.5, center_y=0
                 mly.setCenter([{center_x}, {center_y}]);
 
                 // Set the zoom level (0 is fully zoomed out)
-                mly.setZoom(0.7);
+                mly.setZoom({ZOOM});
 
                 // Signal to Playwright that the image loaded and the view was
                 // positioned, so it can wait for this instead of a fixed sleep.
@@ -0,0 +1,133 @@
+"""On-disk cache of rendered screenshots.
+
+A screenshot depends only on the image, the viewer center, and what it's
+rendered with: the viewport, the zoom and the renderer (the viewer version
+for screenshot.py, or panorama.RENDERER for the browser-free backend). So
+each one is stored under a hash of those, and cached() wraps a capture
+function (see everylot.build_post) to copy cached shots into place and pass
+only the rest on. When every shot is cached, the browser isn't
+launched at all.
+
+The cache is bounded by total size, evicting the least recently used files
+first (a hit counts as a use).
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import metrics
+
+logger = logging.getLogger("everylot.screenshot_cache")
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+
+def shot_key(image_key, center_x, center_y, renderer=None):
+    """The cache key for a shot of image_key centered on (center_x, center_y),
+    rendered by renderer (the browser viewer by default)."""
+    import screenshot
+
+    # Rounded so float noise in the aiming math doesn't defeat the cache; far
+    # finer than a pixel at the viewport size.
+    identity = [
+        str(image_key),
+        round(float(center_x), 6),
+        round(float(center_y), 6),
+        screenshot.VIEWPORT,
+        screenshot.ZOOM,
+        renderer or screenshot.MAPILLARY_JS_VERSION,
+    ]
+    encoded = json.dumps(identity, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ScreenshotCache:
+    """A directory of cached screenshots, named by shot_key."""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def fetch(self, key, output_path):
+        """Copy the cached shot for key to output_path; returns whether there
+        was one."""
+        path = self.path(key)
+        try:
+            shutil.copyfile(path, output_path)
+        except FileNotFoundError:
+            return False
+        # Mark it recently used for eviction.
+        os.utime(path)
+        return True
+
+    def store(self, key, source_path):
+        """Cache the shot at source_path under key, then evict down to
+        max_bytes."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """(mtime, size, path) of every cached shot, least recently used first."""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """Delete least recently used shots until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def cached(capture, cache, renderer=None):
+    """Wrap the capture coroutine function capture (same signature as
+    screenshot.capture_screenshots) to go through cache; renderer is as for
+    shot_key."""
+
+    async def capture_cached(shots):
+        misses = []
+        for shot in shots:
+            image_key, center_x, center_y, output_path = shot
+            if cache.fetch(shot_key(image_key, center_x, center_y, renderer), output_path):
+                metrics.count("screenshot_cache_hits")
+                logger.info(f"Screenshot of {image_key} served from cache")
+            else:
+                metrics.count("screenshot_cache_misses")
+                misses.append(shot)
+        if not misses:
+            return
+        try:
+            await capture(misses)
+        finally:
+            # Keep whatever rendered, even if a later shot failed.
+            for image_key, center_x, center_y, output_path in misses:
+                if os.path.exists(output_path):
+                    cache.store(shot_key(image_key, center_x, center_y, renderer), output_path)
+
+    return capture_cached
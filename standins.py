@@ -0,0 +1,614 @@
+"""Local stand-ins for every service a run talks to.
+
+SyntheticCity generates a small, deterministic city: parcels laid out along
+streets, with buildings, street centerlines, a geocoder index, and Mapillary
+panorama sequences from several years on some of the streets. StandInTransport
+answers the ArcGIS query/geocode and Mapillary Graph API requests from it
+(including the panorama thumbnails panorama.py downloads, as synthetic
+equirectangular images), and AtprotoStandIn is a local PDS that accepts the bot's posts. Together with
+placeholder_capture (instead of the headless browser), offline() runs the whole
+attempt loop with no network, optionally with the latency of the real
+services injected.
+"""
+import asyncio
+import base64
+import contextlib
+import datetime
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import everylot
+import transport
+
+# Seconds of simulated latency per request, by service. "capture" is per
+# screenshot, "bluesky" per atproto call, "thumbnails" per panorama download.
+LATENCY_PROFILES = {
+    "instant": {},
+    "lan": {
+        "parcels": 0.002, "geocoder": 0.002, "buildings": 0.002, "centerlines": 0.002,
+        "mapillary": 0.004, "thumbnails": 0.01, "capture": 0.01, "bluesky": 0.002,
+    },
+    "typical": {
+        "parcels": 0.12, "geocoder": 0.2, "buildings": 0.1, "centerlines": 0.1,
+        "mapillary": 0.35, "thumbnails": 0.5, "capture": 4.0, "bluesky": 0.3,
+    },
+}
+
+# Layout of the synthetic city (degrees). Parcels sit in rows on the north
+# side of east-west streets spaced STREET_SPACING apart.
+ORIGIN = (-83.10, 42.36)
+PARCELS_PER_STREET = 20
+PARCEL_WIDTH = 0.0002
+STREET_SPACING = 0.001
+IMAGE_SPACING = 0.0001
+STREET_NAMES = ["Stand-in St", "Example Ave", "Fixture Blvd", "Replay Rd", "Offline Ct"]
+CAPTURE_YEARS = [2009, 2013, 2016, 2019, 2022, 2024]
+
+MAX_RECORD_COUNT = 2000
+MAPILLARY_IMAGES_URL = everylot.MAPILLARY_IMAGES_URL
+# Where the stand-in's thumb_2048_url links point, and the size of the
+# synthetic panoramas served there (2:1, as equirectangular images are).
+THUMBNAIL_URL = "https://thumbnails.standin.invalid/pano"
+THUMBNAIL_SIZE = (256, 128)
+
+
+def _rectangle(x0, y0, x1, y1):
+    # Clockwise, like Esri outer rings.
+    return {
+        "type": "Polygon",
+        "coordinates": [[[x0, y0], [x0, y1], [x1, y1], [x1, y0], [x0, y0]]],
+    }
+
+
+def _epoch_ms(year, month, day):
+    moment = datetime.datetime(year, month, day, 15, tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def _bbox(geometry):
+    """(min_x, min_y, max_x, max_y) of a GeoJSON geometry."""
+    def points(coordinates):
+        if isinstance(coordinates[0], (int, float)):
+            yield coordinates
+        else:
+            for part in coordinates:
+                yield from points(part)
+
+    xs, ys = zip(*points(geometry["coordinates"]))
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _bbox_intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class Layer:
+    """An in-memory FeatureServer layer answering the query subset we use."""
+
+    def __init__(self, features, object_id_field="OBJECTID"):
+        self.object_id_field = object_id_field
+        self.features = sorted(features, key=lambda f: f["properties"][object_id_field])
+
+    def info(self):
+        return {
+            "objectIdField": self.object_id_field,
+            "maxRecordCount": MAX_RECORD_COUNT,
+            "supportedQueryFormats": "JSON, geoJSON",
+        }
+
+    def _matches(self, properties, where):
+        for clause in re.split(r"\s+AND\s+", where.strip()):
+            clause = clause.strip().strip("()").strip()
+            if clause in ("1=1", ""):
+                continue
+            match = re.fullmatch(r"(\w+)\s*(>=|<=|=|<|>)\s*(-?[\d.]+)", clause)
+            if not match:
+                raise ValueError(f"unsupported where clause {clause!r}")
+            field, op, value = match.groups()
+            actual = properties.get(field)
+            if actual is None:
+                return False
+            value = float(value)
+            if not {
+                "=": actual == value, ">=": actual >= value, "<=": actual <= value,
+                "<": actual < value, ">": actual > value,
+            }[op]:
+                return False
+        return True
+
+    def query(self, params):
+        where = params.get("where", "1=1")
+        try:
+            selected = [f for f in self.features if self._matches(f["properties"], where)]
+        except ValueError as e:
+            return {"error": {"code": 400, "message": str(e)}}
+        if params.get("objectIds"):
+            wanted = {int(i) for i in params["objectIds"].split(",")}
+            selected = [f for f in selected if f["properties"][self.object_id_field] in wanted]
+        if params.get("geometry"):
+            if params.get("geometryType") != "esriGeometryEnvelope":
+                return {"error": {"code": 400, "message": "only envelope filters are supported"}}
+            envelope = [float(v) for v in params["geometry"].split(",")]
+            selected = [f for f in selected if _bbox_intersects(_bbox(f["geometry"]), envelope)]
+
+        if params.get("returnCountOnly") == "true":
+            return {"count": len(selected)}
+        ids = [f["properties"][self.object_id_field] for f in selected]
+        if params.get("returnIdsOnly") == "true":
+            return {"objectIdFieldName": self.object_id_field, "objectIds": ids}
+        if params.get("outStatistics"):
+            attributes = {}
+            for statistic in json.loads(params["outStatistics"]):
+                values = [f["properties"][statistic["onStatisticField"]] for f in selected]
+                pick = {"min": min, "max": max}[statistic["statisticType"]]
+                attributes[statistic["outStatisticFieldName"]] = pick(values) if values else None
+            return {"features": [{"attributes": attributes}]}
+
+        offset = int(params.get("resultOffset", 0))
+        limit = min(int(params.get("resultRecordCount", MAX_RECORD_COUNT)), MAX_RECORD_COUNT)
+        page = selected[offset:offset + limit]
+        out_fields = params.get("outFields", "*")
+        features = []
+        for feature in page:
+            properties = feature["properties"]
+            if out_fields != "*":
+                keep = set(out_fields.split(",")) | {self.object_id_field}
+                properties = {k: v for k, v in properties.items() if k in keep}
+            geometry = feature["geometry"] if params.get("returnGeometry") != "false" else None
+            if params.get("f") == "json":
+                features.append(_esri_feature(feature, properties, geometry, params))
+                continue
+            features.append({
+                "type": "Feature",
+                "id": feature["properties"][self.object_id_field],
+                "geometry": geometry,
+                "properties": properties,
+            })
+        if params.get("f") == "json":
+            result = {"objectIdFieldName": self.object_id_field, "features": features}
+        else:
+            result = {"type": "FeatureCollection", "features": features}
+        if offset + limit < len(selected):
+            result["exceededTransferLimit"] = True
+        return result
+
+
+def _esri_feature(feature, properties, geometry, params):
+    """A feature in Esri JSON (f=json): attributes, the geometry as rings,
+    paths or x/y, and the centroid of a polygon if returnCentroid is set."""
+    result = {"attributes": properties}
+    if geometry is not None:
+        kind, coordinates = geometry["type"], geometry["coordinates"]
+        if kind == "Point":
+            result["geometry"] = {"x": coordinates[0], "y": coordinates[1]}
+        elif kind in ("LineString", "MultiLineString"):
+            result["geometry"] = {"paths": [coordinates] if kind == "LineString" else coordinates}
+        else:
+            polygons = [coordinates] if kind == "Polygon" else coordinates
+            result["geometry"] = {"rings": [ring for rings in polygons for ring in rings]}
+    if params.get("returnCentroid") == "true" and feature["geometry"]["type"].endswith("Polygon"):
+        from shapely.geometry import shape
+
+        centroid = shape(feature["geometry"]).centroid
+        result["centroid"] = {"x": centroid.x, "y": centroid.y}
+    return result
+
+
+class SyntheticCity:
+    """A deterministic stand-in for Detroit's parcels, BaseUnits and imagery.
+
+    coverage is the share of streets with any panorama sequences; those get one
+    to five sequences from different years, so some streets can produce a
+    before/after pair and some can't, as in the real city.
+    """
+
+    def __init__(self, seed=0, parcels=200, coverage=0.5):
+        rng = random.Random(seed)
+        lon0, lat0 = ORIGIN
+        parcel_features = []
+        building_features = []
+        centerline_features = []
+        self.geocoder = {}
+        self.images = []
+
+        streets = -(-parcels // PARCELS_PER_STREET)
+        for street in range(streets):
+            street_y = lat0 + street * STREET_SPACING
+            street_id = 1000 + street
+            street_name = STREET_NAMES[street % len(STREET_NAMES)]
+            half = PARCELS_PER_STREET // 2 * PARCEL_WIDTH
+            for segment, (x0, x1) in enumerate([(lon0, lon0 + half), (lon0 + half, lon0 + 2 * half)]):
+                centerline_features.append({
+                    "type": "Feature",
+                    "properties": {
+                        "OBJECTID": street_id * 10 + segment,
+                        "street_id": street_id,
+                        "full_street_name": street_name,
+                    },
+                    "geometry": {"type": "LineString", "coordinates": [[x0, street_y], [x1, street_y]]},
+                })
+
+            if rng.random() < coverage:
+                years = rng.sample(CAPTURE_YEARS, rng.choice([1, 2, 3, 4, 4, 5]))
+                for year in years:
+                    self._add_sequence(rng, street, street_y, year)
+
+        for index in range(parcels):
+            street, column = divmod(index, PARCELS_PER_STREET)
+            street_y = lat0 + street * STREET_SPACING
+            x0 = lon0 + column * PARCEL_WIDTH
+            x1 = x0 + PARCEL_WIDTH
+            object_id = index + 1
+            # Street names repeat every len(STREET_NAMES) streets; the hundreds
+            # block keeps each address unique.
+            block = 100 * (1 + street // len(STREET_NAMES))
+            address = f"{block + 2 * column} {STREET_NAMES[street % len(STREET_NAMES)]}"
+            if index % 17 == 16:
+                address = ""
+            building_id = 50000 + index if index % 11 != 10 else None
+
+            parcel_features.append({
+                "type": "Feature",
+                "properties": {
+                    "ObjectId": object_id,
+                    "address": address,
+                    "parcel_id": f"{22000000 + index:08d}.",
+                    "year_built": rng.choice([1915, 1922, 1925, 1948, 0, None]),
+                    "zoning_district": rng.choice(["R1", "R2", "B4", "M3"]),
+                    "tax_status": rng.choice(["TAXABLE", "CITY LAND BANK"]),
+                },
+                "geometry": _rectangle(x0, street_y + 0.00006, x1, street_y + 0.0004),
+            })
+            if building_id is not None:
+                building_features.append({
+                    "type": "Feature",
+                    "properties": {"OBJECTID": index + 1, "building_id": building_id},
+                    "geometry": _rectangle(
+                        x0 + 0.00004, street_y + 0.0001, x1 - 0.00004, street_y + 0.00022
+                    ),
+                })
+            if address:
+                self.geocoder[address] = {
+                    "address": address,
+                    "score": 95 if index % 13 != 12 else 70,
+                    "location": {"x": (x0 + x1) / 2, "y": street_y + 0.00016},
+                    "attributes": {"street_id": 1000 + street, "building_id": building_id},
+                }
+
+        self.parcels = Layer(parcel_features, "ObjectId")
+        self.buildings = Layer(building_features)
+        self.centerlines = Layer(centerline_features)
+        self.images.sort(key=lambda image: image["id"])
+        self.images_by_id = {image["id"]: image for image in self.images}
+
+    def _add_sequence(self, rng, street, street_y, year):
+        lon0, _ = ORIGIN
+        sequence = f"seq-{street}-{year}"
+        heading = rng.choice([90.0, 270.0])
+        captured_at = _epoch_ms(year, rng.randint(4, 9), rng.randint(1, 28))
+        steps = int(PARCELS_PER_STREET * PARCEL_WIDTH / IMAGE_SPACING) + 1
+        for step in range(steps):
+            x = lon0 + step * IMAGE_SPACING
+            y = street_y + rng.uniform(-0.00001, 0.00001)
+            point = {"type": "Point", "coordinates": [x, y]}
+            self.images.append({
+                "id": str(10 ** 15 + street * 10 ** 6 + year * 100 + step),
+                "captured_at": captured_at + step * 1000,
+                "computed_geometry": point,
+                "geometry": {"type": "Point", "coordinates": [x + 0.000003, y]},
+                "computed_compass_angle": heading,
+                "computed_rotation": [0.0, 0.0, 0.0],
+                "sequence": sequence,
+                "is_pano": True,
+            })
+
+    def images_in_bbox(self, bbox):
+        min_x, min_y, max_x, max_y = bbox
+        selected = []
+        for image in self.images:
+            x, y = image["computed_geometry"]["coordinates"]
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                selected.append(image)
+        return selected
+
+
+def service_of(url):
+    """Name of the service a URL belongs to (the keys of LATENCY_PROFILES)."""
+    path = urlsplit(url).path
+    if url.startswith(everylot.GEOCODER_URL):
+        return "geocoder"
+    if "graph.mapillary.com" in url:
+        return "mapillary"
+    if url.startswith(THUMBNAIL_URL):
+        return "thumbnails"
+    if "/BaseUnitFeatures/FeatureServer/1" in path:
+        return "centerlines"
+    if "/BaseUnitFeatures/FeatureServer/2" in path:
+        return "buildings"
+    if "/parcel_file_current/" in path:
+        return "parcels"
+    return "other"
+
+
+class StandInTransport:
+    """A transport (see transport.py) answering requests from a SyntheticCity.
+
+    Each request sleeps for its service's latency in the given profile first.
+    Unknown URLs get a 404 response.
+    """
+
+    def __init__(self, city, latency=None):
+        self.city = city
+        self.latency = latency or {}
+        self.layers = {
+            "parcels": city.parcels,
+            "buildings": city.buildings,
+            "centerlines": city.centerlines,
+        }
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        scheme, netloc, path, query, _ = urlsplit(url)
+        params = {**dict(parse_qsl(query)), **{k: str(v) for k, v in (params or {}).items()}}
+        service = service_of(url)
+        time.sleep(self.latency.get(service, 0))
+
+        if service == "geocoder":
+            candidate = self.city.geocoder.get(params.get("SingleLine", ""))
+            return transport.json_response(url, {"candidates": [candidate] if candidate else []})
+        if service == "mapillary":
+            if path.rstrip("/") != "/images":
+                return self._mapillary_image(url, path.strip("/"), params)
+            return transport.json_response(url, self._mapillary(url, params))
+        if service == "thumbnails":
+            width, height = THUMBNAIL_SIZE
+            return transport.make_response(
+                url, 200, panorama_png(width, height), {"Content-Type": "image/png"}
+            )
+        if service in self.layers:
+            layer = self.layers[service]
+            if not path.endswith("/query"):
+                return transport.json_response(url, layer.info())
+            if params.get("f") not in ("json", "geojson"):
+                return transport.json_response(
+                    url, {"error": {"code": 400, "message": "Invalid format"}}, status_code=400
+                )
+            return transport.json_response(url, layer.query(params))
+        return transport.json_response(url, {"error": "not found"}, status_code=404)
+
+    def _mapillary_image(self, url, image_id, params):
+        """A Graph API image entity: its requested fields, with thumbnail links."""
+        if not params.get("access_token"):
+            return transport.json_response(
+                url, {"error": {"message": "An access token is required"}}, status_code=401
+            )
+        image = self.city.images_by_id.get(image_id)
+        if image is None:
+            return transport.json_response(
+                url, {"error": {"message": f"Unknown image {image_id}"}}, status_code=404
+            )
+        image = {**image, "thumb_2048_url": f"{THUMBNAIL_URL}/{image_id}.png"}
+        fields = params.get("fields", "id").split(",")
+        return transport.json_response(url, {k: image[k] for k in fields if k in image} | {"id": image_id})
+
+    def _mapillary(self, url, params):
+        if not params.get("access_token"):
+            return {"error": {"message": "An access token is required"}}
+        bbox = [float(v) for v in params["bbox"].split(",")]
+        images = self.city.images_in_bbox(bbox)
+        if params.get("after"):
+            images = [image for image in images if image["id"] > params["after"]]
+
+        limit = int(params.get("limit", 2000))
+        page = images[:limit]
+        fields = params.get("fields", "id").split(",")
+        data = [{k: image[k] for k in fields if k in image} | {"id": image["id"]} for image in page]
+
+        result = {"data": data}
+        if len(images) > limit:
+            after = page[-1]["id"]
+            next_params = {**params, "after": after}
+            result["paging"] = {
+                "cursors": {"after": after},
+                "next": f"{MAPILLARY_IMAGES_URL}?{urlencode(next_params)}",
+            }
+        return result
+
+
+def _png(width, height, rows, color_type):
+    """An 8-bit PNG from rows (each row's bytes, unfiltered)."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"".join(b"\x00" + row for row in rows)))
+        + chunk(b"IEND", b"")
+    )
+
+
+def placeholder_png(width=8, height=8, shade=128):
+    """A tiny solid-gray PNG, standing in for a rendered screenshot."""
+    return _png(width, height, [bytes([shade]) * width] * height, 0)
+
+
+def panorama_pixels(width, height):
+    """The synthetic equirectangular panorama (an RGB bytes row per pixel row):
+    red ramps with longitude and green with latitude, so a view cut out of it
+    shows where it was aimed."""
+    rows = []
+    for y in range(height):
+        green = 255 * y // max(height - 1, 1)
+        rows.append(b"".join(bytes([255 * x // max(width - 1, 1), green, 128]) for x in range(width)))
+    return rows
+
+
+def panorama_png(width=256, height=128):
+    """A synthetic equirectangular panorama PNG, standing in for a thumbnail."""
+    return _png(width, height, panorama_pixels(width, height), 2)
+
+
+def placeholder_capture(latency=None):
+    """A capture function (see everylot.build_post) that writes placeholder
+    PNGs after the profile's per-shot capture latency, with no browser."""
+    delay = (latency or {}).get("capture", 0)
+
+    async def capture(shots):
+        for image_key, center_x, center_y, output_path in shots:
+            await asyncio.sleep(delay)
+            with open(output_path, "wb") as f:
+                f.write(placeholder_png())
+
+    return capture
+
+
+def _jwt(did, lifetime=7200):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    now = int(time.time())
+    payload = {"scope": "com.atproto.access", "sub": did, "iat": now, "exp": now + lifetime}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(payload)}.c3RhbmQtaW4"
+
+
+class AtprotoStandIn:
+    """A local PDS accepting the calls bluesky.post_to_bluesky makes.
+
+    Posts land in self.posts (the records, in order) and uploads in
+    self.blobs (their sizes). Use as a context manager; base_url is what
+    BLUESKY_BASE_URL should be set to.
+    """
+
+    DID = "did:plc:standin"
+    BLOB_CID = "bafkreihdwdcefgh4dqkjv67uzcmw7ojee6xedzdetojuzjevtenxquvyku"
+    RECORD_CID = "bafyreie5737gdxlw5i64vzichcalba3z2v5n6icifvx5xytvske7mr3hpm"
+
+    def __init__(self, latency=None):
+        self.delay = (latency or {}).get("bluesky", 0)
+        self.posts = []
+        self.blobs = []
+        self.requests = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _respond(self, method, path, body, headers):
+        self.requests += 1
+        time.sleep(self.delay)
+        nsid = path.rsplit("/", 1)[-1]
+        if nsid == "com.atproto.server.createSession":
+            identifier = json.loads(body)["identifier"]
+            return {
+                "accessJwt": _jwt(self.DID),
+                "refreshJwt": _jwt(self.DID, lifetime=86400),
+                "handle": identifier,
+                "did": self.DID,
+            }
+        if nsid == "app.bsky.actor.getProfile":
+            return {"did": self.DID, "handle": "standin.test"}
+        if nsid == "com.atproto.repo.uploadBlob":
+            self.blobs.append(len(body))
+            return {"blob": {
+                "$type": "blob",
+                "ref": {"$link": self.BLOB_CID},
+                "mimeType": headers.get("Content-Type") or "image/png",
+                "size": len(body),
+            }}
+        if nsid == "com.atproto.repo.createRecord":
+            record = json.loads(body)["record"]
+            self.posts.append(record)
+            return {"uri": f"at://{self.DID}/app.bsky.feed.post/{len(self.posts)}", "cid": self.RECORD_CID}
+        return None
+
+    def __enter__(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                result = standin._respond(method, urlsplit(self.path).path, body, self.headers)
+                payload = json.dumps(result or {"error": "MethodNotImplemented"}).encode()
+                self.send_response(200 if result is not None else 501)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@contextlib.contextmanager
+def _environ(values):
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+class OfflineRun:
+    """What offline() yields: the city, the PDS stand-in and a capture function."""
+
+    def __init__(self, city, atproto, capture, transport):
+        self.city = city
+        self.atproto = atproto
+        self.capture = capture
+        self.transport = transport
+
+
+@contextlib.contextmanager
+def offline(seed=0, parcels=200, coverage=0.5, profile="instant"):
+    """Run everylot entirely against local stand-ins inside this block.
+
+    Installs a StandInTransport, starts an AtprotoStandIn with BLUESKY_* and
+    MAPILLARY_ACCESS_TOKEN pointed at stand-in values, and seeds the global
+    RNG so the run is repeatable. Pass the yielded .capture to everylot.run.
+    """
+    latency = LATENCY_PROFILES[profile]
+    city = SyntheticCity(seed, parcels, coverage)
+    stand_in = StandInTransport(city, latency)
+    random.seed(seed)
+    with AtprotoStandIn(latency) as atproto:
+        env = {
+            "BLUESKY_BASE_URL": atproto.base_url,
+            "BLUESKY_USERNAME": "standin.test",
+            "BLUESKY_PASSWORD": "standin",
+            "MAPILLARY_ACCESS_TOKEN": "standin-token",
+        }
+        with _environ(env), transport.using(stand_in):
+            yield OfflineRun(city, atproto, placeholder_capture(latency), stand_in)
@@ -0,0 +1,20 @@
+from arcgis import layer_url, object_id_windows, supports_pbf, window_where
+
+
+def test_layer_url_strips_query():
+    assert layer_url("https://x/FeatureServer/0/query") == "https://x/FeatureServer/0"
+
+
+def test_object_id_windows_cover_range():
+    assert object_id_windows(1, 10, 4) == [(1, 5), (5, 9), (9, 11)]
+
+
+def test_window_where_keeps_filter():
+    assert window_where("1=1", "ObjectId", (5, 9)) == (
+        "(1=1) AND ObjectId >= 5 AND ObjectId < 9"
+    )
+
+
+def test_supports_pbf_reads_format_list():
+    assert supports_pbf({"supportedQueryFormats": "JSON, geoJSON, PBF"})
+    assert not supports_pbf({"supportedQueryFormats": "JSON, geoJSON"})
@@ -1,3 +1,6 @@
+import pytest
+
+import bluesky
 from bluesky import parse_urls, parse_facets
 
 
@@ -22,3 +25,12 @@ def test_parse_facets_builds_link_facet():
     assert facet["features"][0]["$type"] == "app.bsky.richtext.facet#link"
     assert facet["features"][0]["uri"] == "https://example.com/path"
     assert facet["index"]["byteStart"] < facet["index"]["byteEnd"]
+
+
+def test_too_many_images_are_rejected_before_logging_in(monkeypatch):
+    def no_client(*args, **kwargs):
+        raise AssertionError("logged in")
+
+    monkeypatch.setattr(bluesky, "Client", no_client)
+    with pytest.raises(ValueError):
+        bluesky.post_to_bluesky("user", "password", "text", image_paths=["a.png"] * (bluesky.MAX_IMAGES + 1))
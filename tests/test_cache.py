@@ -0,0 +1,116 @@
+import asyncio
+import os
+import subprocess
+import sys
+from collections import Counter
+
+import everylot
+import transport
+from cache import CachingTransport, SharedCache, cache_key
+from standins import offline, service_of
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CountingTransport:
+    """Counts the requests that reach the transport behind it, by service."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.requests = Counter()
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        self.requests[service_of(url)] += 1
+        return self.inner.get(url, params=params, timeout=timeout, **kwargs)
+
+
+def test_repeated_lookups_are_served_from_the_cache(tmp_path):
+    shared = SharedCache(str(tmp_path / "cache.sqlite"))
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        upstream = CountingTransport(env.transport)
+        with transport.using(CachingTransport(upstream, shared)):
+            parcel = everylot.get_parcel(20)
+            first = everylot.select_pair(parcel)
+            before = upstream.requests.copy()
+            second = asyncio.run(everylot.select_pair_async(parcel))
+
+    assert second == first
+    assert before["geocoder"] and before["mapillary"]
+    # The second pass made no requests at all.
+    assert upstream.requests == before
+    assert set(shared.stats()) <= {"geocoder", "buildings", "centerlines", "mapillary"}
+
+
+def test_errors_are_not_cached(tmp_path):
+    shared = SharedCache(str(tmp_path / "cache.sqlite"))
+
+    class Failing:
+        def get(self, url, params=None, timeout=30, **kwargs):
+            return transport.json_response(url, {"error": {"code": 500, "message": "down"}})
+
+    with transport.using(CachingTransport(Failing(), shared)):
+        assert everylot.geocode_parcel("1 Main St") is None
+
+    assert shared.stats() == {}
+
+
+def test_expired_entries_are_refetched(tmp_path):
+    shared = SharedCache(str(tmp_path / "cache.sqlite"), ttls={"geocoder": -1})
+    shared.store("key", "geocoder", 200, {}, b"{}")
+    assert shared.fetch("key", "geocoder") is None
+    assert shared.evict() == 1
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    shared = SharedCache(str(tmp_path / "cache.sqlite"), max_bytes=250, touch_after=0)
+    shared.store("old", "mapillary", 200, {}, b"x" * 100)
+    shared.store("used", "mapillary", 200, {}, b"x" * 100)
+    assert shared.fetch("old", "mapillary") is not None
+    shared.store("new", "mapillary", 200, {}, b"x" * 100)
+    shared.evict()
+
+    assert shared.fetch("used", "mapillary") is None
+    assert shared.fetch("old", "mapillary") is not None
+    assert shared.fetch("new", "mapillary") is not None
+
+
+def test_recent_hits_are_read_only(tmp_path):
+    shared = SharedCache(str(tmp_path / "cache.sqlite"))
+    shared.store("key", "mapillary", 200, {}, b"{}")
+    connection = shared.connection()
+    writes = connection.total_changes
+    for _ in range(3):
+        assert shared.fetch("key", "mapillary") is not None
+    assert connection.total_changes == writes
+
+
+def test_stored_pages_hold_no_access_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(everylot, "MAPILLARY_PAGE_SIZE", 5)
+    shared = SharedCache(str(tmp_path / "cache.sqlite"))
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        lon, lat = env.city.images[0]["computed_geometry"]["coordinates"]
+        upstream = CountingTransport(env.transport)
+        with transport.using(CachingTransport(upstream, shared)):
+            first = everylot.get_mapillary_images(lon, lat, max_results=20)
+            pages = upstream.requests["mapillary"]
+            # The cached pages' links have lost the token, yet they're followed
+            # all the same.
+            second = everylot.get_mapillary_images(lon, lat, max_results=20)
+
+    assert pages > 1 and upstream.requests["mapillary"] == pages
+    assert second == first
+    bodies = shared.connection().execute("SELECT body FROM responses").fetchall()
+    assert not any(b"access_token" in body for body, in bodies)
+
+
+def test_processes_share_one_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = cache_key(everylot.GEOCODER_URL, {"SingleLine": "1 Main St"})
+    script = (
+        "from cache import SharedCache; "
+        f"SharedCache({path!r}).store({key!r}, 'geocoder', 200, {{}}, b'{{\"candidates\": []}}')"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+
+    status, headers, body = SharedCache(path).fetch(key, "geocoder")
+    assert (status, body) == (200, b'{"candidates": []}')
@@ -1,7 +1,25 @@
 import pytest
+import requests
 from shapely.geometry import Point
 
-from everylot import parcel_attr, image_coordinates, get_closest_images
+import transport
+from everylot import (
+    MAPILLARY_ANCHOR_MARGIN,
+    MAPILLARY_PROBE_FIELDS,
+    MAPILLARY_SEARCH_RADII,
+    SERIES_MIN_GAP_MS,
+    SkipParcel,
+    PAIR_MIN_GAP_MS,
+    UnusableParcel,
+    era_series,
+    get_closest_images,
+    get_mapillary_images,
+    has_possible_pair,
+    image_coordinates,
+    parcel_attr,
+    probe_mapillary,
+    search_mapillary_images,
+)
 
 
 def test_parcel_attr_returns_present_value():
@@ -55,3 +73,140 @@ def test_get_closest_images_keeps_closest_per_sequence():
     assert sequences["s1"]["distance"] == pytest.approx(1)
     assert sequences["s2"]["distance"] == pytest.approx(2)
     assert closest == pytest.approx(1)
+
+
+def test_skip_parcel_category_defaults_to_other():
+    assert SkipParcel("nope").category == "other"
+    e = UnusableParcel("no Mapillary images near parcel", "no_imagery")
+    assert isinstance(e, SkipParcel)
+    assert e.category == "no_imagery"
+    assert str(e) == "no Mapillary images near parcel"
+
+
+class FakeMapillary:
+    """Answers image searches from respond(url, params), recording requests."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        self.requests.append((url, params))
+        return transport.json_response(url, self.respond(url, params))
+
+
+def test_get_mapillary_images_follows_paging_cursor(monkeypatch):
+    monkeypatch.setenv("MAPILLARY_ACCESS_TOKEN", "token")
+    next_url = "https://graph.mapillary.com/images?after=2&access_token=token"
+
+    def respond(url, params):
+        if "after=" in url:
+            return {"data": [{"id": "3", "sequence": "b"}]}
+        return {"data": [{"id": "1", "sequence": "a"}, {"id": "2", "sequence": "a"}],
+                "paging": {"next": next_url}}
+
+    fake = FakeMapillary(respond)
+    with transport.using(fake):
+        images = get_mapillary_images(-83.0, 42.3)
+
+    assert [i["id"] for i in images] == ["1", "2", "3"]
+    assert len(fake.requests) == 2
+    assert "computed_rotation" not in fake.requests[0][1]["fields"]
+    # The token is passed on its own, not taken from the (maybe cached) link.
+    assert fake.requests[1] == ("https://graph.mapillary.com/images?after=2", {"access_token": "token"})
+
+
+def test_failed_mapillary_page_is_an_error_not_a_smaller_box(monkeypatch):
+    monkeypatch.setenv("MAPILLARY_ACCESS_TOKEN", "token")
+    next_url = "https://graph.mapillary.com/images?after=1&access_token=token"
+
+    class Failing(FakeMapillary):
+        def get(self, url, params=None, timeout=30, **kwargs):
+            if "after=" in url:
+                return transport.json_response(url, {"error": {"message": "down"}}, status_code=500)
+            return super().get(url, params, timeout, **kwargs)
+
+    fake = Failing(lambda url, params: {"data": [{"id": "1", "sequence": "a"}],
+                                        "paging": {"next": next_url}})
+    with transport.using(fake), pytest.raises(requests.exceptions.HTTPError):
+        get_mapillary_images(-83.0, 42.3)
+
+
+def test_search_widens_box_until_enough_sequences(monkeypatch):
+    monkeypatch.setenv("MAPILLARY_ACCESS_TOKEN", "token")
+
+    def respond(url, params):
+        min_x, _, max_x, _ = (float(v) for v in params["bbox"].split(","))
+        # One sequence in the tightest box, three once it's widened.
+        sequences = 1 if max_x - min_x < 2 * MAPILLARY_SEARCH_RADII[1] else 3
+        return {"data": [{"id": str(n), "sequence": str(n), "captured_at": n * PAIR_MIN_GAP_MS}
+                         for n in range(sequences)]}
+
+    fake = FakeMapillary(respond)
+    with transport.using(fake):
+        images = search_mapillary_images(-83.0, 42.3)
+
+    assert len({i["sequence"] for i in images}) == 3
+    assert len(fake.requests) == 2
+
+
+def test_search_widens_box_past_sequences_too_close_in_time(monkeypatch):
+    monkeypatch.setenv("MAPILLARY_ACCESS_TOKEN", "token")
+
+    def respond(url, params):
+        min_x, _, max_x, _ = (float(v) for v in params["bbox"].split(","))
+        # Three recent sequences right by the parcel, an older one farther out.
+        data = [{"id": f"r{n}", "sequence": f"r{n}", "captured_at": PAIR_MIN_GAP_MS + n} for n in range(3)]
+        if max_x - min_x >= 2 * MAPILLARY_SEARCH_RADII[1]:
+            data.append({"id": "o0", "sequence": "o0", "captured_at": 0})
+        return {"data": data}
+
+    fake = FakeMapillary(respond)
+    with transport.using(fake):
+        images = search_mapillary_images(-83.0, 42.3)
+
+    assert "o0" in {i["id"] for i in images}
+    assert len(fake.requests) == 2
+
+
+def test_has_possible_pair_needs_two_sequences_far_enough_apart():
+    old = {"sequence": "a", "captured_at": 0}
+    same_sequence_later = {"sequence": "a", "captured_at": PAIR_MIN_GAP_MS}
+    other_sequence_later = {"sequence": "b", "captured_at": PAIR_MIN_GAP_MS}
+    other_sequence_soon = {"sequence": "b", "captured_at": PAIR_MIN_GAP_MS - 1}
+
+    assert has_possible_pair([old, other_sequence_later])
+    assert not has_possible_pair([old, same_sequence_later])
+    assert not has_possible_pair([old, other_sequence_soon])
+    assert not has_possible_pair([])
+
+
+def test_probe_box_covers_the_search_boxes_around_the_anchor(monkeypatch):
+    monkeypatch.setenv("MAPILLARY_ACCESS_TOKEN", "token")
+    fake = FakeMapillary(lambda url, params: {"data": [
+        {"id": "1", "sequence": "a", "captured_at": 0},
+        {"id": "2", "sequence": "a", "captured_at": PAIR_MIN_GAP_MS},
+    ]})
+    with transport.using(fake), pytest.raises(UnusableParcel) as skipped:
+        probe_mapillary(Point(-83.0, 42.3))
+
+    assert skipped.value.category == "no_pair"
+    (_, params), = fake.requests
+    assert params["fields"] == MAPILLARY_PROBE_FIELDS
+    min_x, _, max_x, _ = (float(v) for v in params["bbox"].split(","))
+    assert max_x - min_x == pytest.approx(2 * (MAPILLARY_SEARCH_RADII[-1] + MAPILLARY_ANCHOR_MARGIN))
+
+
+def test_era_series_adds_nearest_sequence_per_era_oldest_first():
+    year = SERIES_MIN_GAP_MS // 2
+    # Nearest first, as get_closest_images ranks them.
+    sequences = {
+        "after": {"captured_at": 12 * year},
+        "same-era-as-after": {"captured_at": 11 * year},
+        "middle": {"captured_at": 8 * year},
+        "before": {"captured_at": 4 * year},
+        "oldest": {"captured_at": 0},
+        "also-oldest": {"captured_at": year},
+    }
+    assert era_series(sequences, ("after", "before")) == ["oldest", "before", "middle", "after"]
+    assert era_series(sequences, ("after", "before"), size=3) == ["before", "middle", "after"]
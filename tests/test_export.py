@@ -0,0 +1,90 @@
+import csv
+import json
+
+import pytest
+
+import everylot
+import export
+import transport
+from export import Checkpoint, export as run_export, parcels_by_id, parcels_in_polygon
+from standins import offline
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_export_writes_a_row_per_parcel(tmp_path):
+    output = str(tmp_path / "pairs.csv")
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        statuses = run_export(parcels_by_id(range(1, 41)), output, workers=4, chunk_size=15)
+
+    rows = read_rows(output)
+    assert [int(row["object_id"]) for row in rows] == list(range(1, 41))
+    assert sum(statuses.values()) == 40
+    paired = [row for row in rows if row["status"] == "ok"]
+    assert paired, statuses
+    row = paired[0]
+    assert row["before_image_id"] and row["after_image_id"]
+    assert row["before_date"] < row["after_date"]
+    series = row["series_image_ids"].split()
+    assert row["before_image_id"] in series and row["after_image_id"] in series
+    assert env.atproto.posts == []
+
+
+def test_export_resumes_from_checkpoint(tmp_path):
+    output = str(tmp_path / "pairs.csv")
+    with offline(seed=1, parcels=200, coverage=0.5):
+        run_export(parcels_by_id(range(1, 21)), output, chunk_size=5)
+        statuses = run_export(parcels_by_id(range(1, 31)), output, chunk_size=5)
+
+    assert sum(statuses.values()) == 10
+    assert [int(row["object_id"]) for row in read_rows(output)] == list(range(1, 31))
+    assert Checkpoint.load(f"{output}.checkpoint.json").count == 30
+
+
+def test_parcels_are_retried_when_mapillary_fails(tmp_path):
+    output = str(tmp_path / "pairs.csv")
+
+    class MapillaryDown:
+        def __init__(self, inner):
+            self.inner = inner
+
+        def get(self, url, params=None, timeout=30, **kwargs):
+            if url.startswith(everylot.MAPILLARY_IMAGES_URL):
+                return transport.json_response(url, {"error": {"message": "down"}}, status_code=500)
+            return self.inner.get(url, params=params, timeout=timeout, **kwargs)
+
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        with transport.using(MapillaryDown(env.transport)):
+            statuses = run_export(parcels_by_id(range(1, 11)), output, chunk_size=5)
+
+    # Nothing written or checkpointed as no_imagery: a rerun tries them all again.
+    assert statuses == {"retry": 10}
+    assert Checkpoint.load(f"{output}.checkpoint.json").count == 0
+
+
+def test_polygon_source_keeps_parcels_whose_centroid_is_inside(tmp_path):
+    from shapely.geometry import box, shape
+
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        first_parcels = [env.city.parcels.features[i] for i in range(3)]
+        area = box(*shape(first_parcels[0]["geometry"]).bounds).union(
+            box(*shape(first_parcels[2]["geometry"]).bounds)
+        )
+        found = [f["properties"]["ObjectId"] for f in parcels_in_polygon(area)]
+
+    assert found == [1, 3]
+
+
+def test_corrupt_checkpoint_is_an_error(tmp_path):
+    path = tmp_path / "pairs.csv.checkpoint.json"
+    path.write_text(json.dumps({"version": 99}))
+    with pytest.raises(ValueError):
+        Checkpoint.load(str(path))
+
+
+def test_unknown_output_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        export.open_writer(str(tmp_path / "pairs.xlsx"))
@@ -0,0 +1,76 @@
+import time
+
+import numpy as np
+import pytest
+from shapely.geometry import Point, shape
+
+import geometry
+
+SQUARE_WITH_HOLE = {
+    "type": "Polygon",
+    "coordinates": [
+        [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]],
+        [[0, 0], [0, 2], [2, 2], [2, 0], [0, 0]],
+    ],
+}
+TWO_PARTS = {
+    "type": "MultiPolygon",
+    "coordinates": [
+        [[[10, 10], [12, 10], [12, 12], [10, 12], [10, 10]]],
+        [[[20, 20, 5], [21, 20, 5], [21, 21, 5], [20, 21, 5], [20, 20, 5]]],
+    ],
+}
+
+
+def test_centroids_match_shapely():
+    geometries = [SQUARE_WITH_HOLE, None, {"type": "Point", "coordinates": [1, 2]}, TWO_PARTS]
+    result = geometry.centroids(geometries)
+
+    assert result[1] is None and result[2] is None
+    for position in (0, 3):
+        expected = shape(geometries[position]).centroid
+        assert result[position] == pytest.approx([expected.x, expected.y])
+
+
+def test_with_centroids_fills_in_batches_across_processes(monkeypatch):
+    monkeypatch.setattr(geometry, "POOL_CHUNK_SIZE", 3)
+    features = [
+        {"geometry": {"type": "Polygon", "coordinates": [[[n, 0], [n + 2, 0], [n + 2, 2], [n, 2], [n, 0]]]}}
+        for n in range(10)
+    ]
+    features.append({"geometry": None})
+    features.append({"geometry": None, "centroid": [5, 5]})
+
+    result = list(geometry.with_centroids(features, processes=2))
+
+    assert [f.get("centroid") for f in result[:10]] == [[n + 1, 1] for n in range(10)]
+    assert "centroid" not in result[10]
+    assert result[11]["centroid"] == [5, 5]
+
+
+def test_with_centroids_yields_each_chunk_once_computed(monkeypatch):
+    monkeypatch.setattr(geometry, "POOL_CHUNK_SIZE", 3)
+    read = []
+
+    def slow_source():
+        for n in range(12):
+            if n == 3:
+                # Plenty of time for the pool to finish the first chunk.
+                time.sleep(1)
+            read.append(n)
+            yield {"geometry": {"type": "Polygon", "coordinates": [[[n, 0], [n + 2, 0], [n + 2, 2], [n, 2], [n, 0]]]}}
+
+    result = geometry.with_centroids(slow_source(), processes=2)
+    first = next(result)
+
+    assert first["centroid"] == [1, 1]
+    # Out before the second chunk was read in full, let alone computed.
+    assert len(read) < 6
+    assert len([first, *result]) == 12
+
+
+def test_point_distances_match_shapely():
+    coordinates = [[1, 1], [-2, 0.5], [3, -4]]
+    distances = geometry.point_distances((0.5, 0), coordinates)
+    expected = [Point(0.5, 0).distance(Point(c)) for c in coordinates]
+    assert np.allclose(distances, expected)
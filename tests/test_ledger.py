@@ -0,0 +1,44 @@
+from ledger import Ledger, pair_key
+
+
+def test_new_ledger_skips_nothing():
+    ledger = Ledger()
+    assert not ledger.should_skip(0)
+    assert not ledger.should_skip(380000)
+
+
+def test_marked_parcels_are_skipped():
+    ledger = Ledger()
+    ledger.mark_posted(12)
+    ledger.mark_unusable(380000)
+    assert ledger.is_posted(12) and not ledger.is_unusable(12)
+    assert ledger.should_skip(380000)
+    assert not ledger.should_skip(13)
+
+
+def test_pair_key_ignores_order():
+    assert pair_key("111", "222") == pair_key("222", "111")
+    assert pair_key("111", "222") != pair_key("111", "333")
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "state" / "ledger.json"
+    ledger = Ledger()
+    ledger.mark_posted(5)
+    ledger.mark_unusable(70000)
+    ledger.add_pair("111", "222")
+    ledger.save(str(path))
+
+    loaded = Ledger.load(str(path))
+    assert loaded.is_posted(5)
+    assert loaded.is_unusable(70000)
+    assert loaded.has_pair("222", "111")
+    assert not loaded.should_skip(6)
+
+
+def test_load_missing_or_corrupt_starts_empty(tmp_path):
+    assert Ledger.load(str(tmp_path / "missing.json")).pairs == set()
+
+    corrupt = tmp_path / "ledger.json"
+    corrupt.write_text("{not json")
+    assert not Ledger.load(str(corrupt)).should_skip(1)
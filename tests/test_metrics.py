@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from metrics import Metrics
+
+
+def test_timer_accumulates_count_seconds_and_errors():
+    m = Metrics()
+    with m.timer("geocode"):
+        pass
+    with pytest.raises(ValueError):
+        with m.timer("geocode"):
+            raise ValueError("boom")
+
+    stage = m.summary()["stages"]["geocode"]
+    assert stage["count"] == 2
+    assert stage["errors"] == 1
+    assert stage["max_seconds"] >= stage["mean_seconds"] >= 0
+
+
+def test_counters_and_skips_are_tallied():
+    m = Metrics()
+    m.count("http_requests")
+    m.count("http_requests", 2)
+    m.skip("no_imagery")
+    m.skip("no_imagery")
+    m.skip("no_pair")
+
+    summary = m.summary()
+    assert summary["counters"] == {"http_requests": 3}
+    assert summary["skips"] == {"no_imagery": 2, "no_pair": 1}
+
+
+def test_write_summary_includes_extra_keys(tmp_path):
+    m = Metrics()
+    m.count("attempts")
+    path = tmp_path / "run_summary.json"
+    m.write_summary(str(path), outcome={"posted": True})
+
+    written = json.loads(path.read_text())
+    assert written["outcome"] == {"posted": True}
+    assert written["counters"] == {"attempts": 1}
+
+
+def test_reset_clears_everything():
+    m = Metrics()
+    m.count("attempts")
+    m.add_timing("mapillary", 0.5)
+    m.reset()
+    assert m.summary()["stages"] == {} and m.summary()["counters"] == {}
@@ -0,0 +1,117 @@
+import mirror
+from mirror import ParcelMirror, attributes_hash, edit_date_where
+
+
+def _feature(object_id, address, edited_at=0):
+    return {
+        "type": "Feature",
+        "properties": {"ObjectId": object_id, "address": address, "EditDate": edited_at},
+        "geometry": {"type": "Point", "coordinates": [object_id, 0]},
+    }
+
+
+def test_attributes_hash_ignores_listed_fields():
+    a = {"address": "1 Main", "EditDate": 1}
+    b = {"address": "1 Main", "EditDate": 2}
+    assert attributes_hash(a, ignore=("EditDate",)) == attributes_hash(b, ignore=("EditDate",))
+    assert attributes_hash(a) != attributes_hash(b)
+
+
+def test_edit_date_where_formats_utc_timestamp():
+    assert edit_date_where("EditDate", 1700000000000) == (
+        "EditDate >= TIMESTAMP '2023-11-14 22:13:20'"
+    )
+
+
+def test_upsert_replaces_and_feature_at_follows_object_id_order(tmp_path):
+    store = ParcelMirror(str(tmp_path / "parcels.sqlite"))
+    store.upsert([_feature(3, "3 Main"), _feature(1, "1 Main")], "ObjectId")
+    store.upsert([_feature(3, "3 Oak")], "ObjectId")
+
+    assert store.count() == 2
+    assert store.feature_at(0)["properties"]["address"] == "1 Main"
+    assert store.feature_at(1)["properties"]["address"] == "3 Oak"
+    assert store.get(2) is None
+    assert store.delete_missing([3]) == 1
+    assert store.object_ids() == {3}
+
+
+def test_incremental_sync_fetches_only_edited_features(tmp_path, monkeypatch):
+    layer = {1: _feature(1, "1 Main", 100), 2: _feature(2, "2 Main", 100)}
+    requested = []
+
+    def fake_ids(url, where="1=1"):
+        if where == "1=1":
+            return sorted(layer)
+        return sorted(i for i, f in layer.items() if f["properties"]["EditDate"] >= 200)
+
+    def fake_by_id(url, object_ids, **kwargs):
+        requested.append(sorted(object_ids))
+        return [layer[i] for i in object_ids]
+
+    monkeypatch.setattr(mirror, "get_layer_info", lambda url: {
+        "objectIdField": "ObjectId", "editFieldsInfo": {"editDateField": "EditDate"},
+    })
+    monkeypatch.setattr(mirror, "get_object_ids", fake_ids)
+    monkeypatch.setattr(mirror, "iter_features", lambda url, **kwargs: list(layer.values()))
+    monkeypatch.setattr(mirror, "iter_features_by_id", fake_by_id)
+
+    store = ParcelMirror(str(tmp_path / "parcels.sqlite"))
+    assert store.sync("url")["mode"] == "full"
+
+    # One edit and one delete upstream.
+    layer[2] = _feature(2, "2 Oak", 200000)
+    del layer[1]
+    summary = store.sync("url")
+
+    assert summary == {"mode": "edit-date", "upserted": 1, "deleted": 1, "total": 1}
+    assert requested == [[2]]
+    assert store.get(2)["properties"]["address"] == "2 Oak"
+    assert store.get_state("edit_watermark") == 200000
+
+
+def _polygon_feature(object_id):
+    ring = [[object_id, 0], [object_id + 2, 0], [object_id + 2, 2], [object_id, 2], [object_id, 0]]
+    return {
+        "type": "Feature",
+        "properties": {"ObjectId": object_id, "address": f"{object_id} Main"},
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+    }
+
+
+def test_upsert_stores_centroids_for_compact_reads(tmp_path):
+    store = ParcelMirror(str(tmp_path / "parcels.sqlite"))
+    store.upsert([_polygon_feature(1), _feature(2, "2 Main")], "ObjectId")
+
+    full, point = store.features()
+    assert full["centroid"] == [2.0, 1.0]
+    assert full["geometry"]["type"] == "Polygon"
+    # Points have no polygon centroid, so the compact read keeps their geometry.
+    compact, point = store.features(geometry=False)
+    assert compact["centroid"] == [2.0, 1.0]
+    assert compact["geometry"] is None
+    assert "centroid" not in point and point["geometry"] is not None
+
+
+def test_older_mirror_is_migrated_and_backfilled(tmp_path):
+    import json
+    import sqlite3
+
+    path = str(tmp_path / "parcels.sqlite")
+    old = sqlite3.connect(path)
+    old.execute(
+        "CREATE TABLE parcels (object_id INTEGER PRIMARY KEY, properties TEXT NOT NULL, "
+        "geometry TEXT, edited_at INTEGER, hash TEXT NOT NULL)"
+    )
+    feature = _polygon_feature(1)
+    old.execute(
+        "INSERT INTO parcels VALUES (1, ?, ?, NULL, 'x')",
+        (json.dumps(feature["properties"]), json.dumps(feature["geometry"])),
+    )
+    old.commit()
+    old.close()
+
+    store = ParcelMirror(path)
+    assert "centroid" not in store.get(1)
+    assert store.backfill_centroids() == 1
+    assert store.get(1, geometry=False) == {**feature, "geometry": None, "centroid": [2.0, 1.0]}
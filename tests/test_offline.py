@@ -0,0 +1,373 @@
+import glob
+import json
+
+import pytest
+from shapely.geometry import shape
+
+import everylot
+import transport
+import metrics
+from benchmark import compare_stage_orders, run_benchmark
+from manifest import RunManifest, responses_path
+from standins import offline
+from transport import RecordingTransport, ReplayTransport
+
+
+def test_run_posts_before_after_pair_offline(tmp_path):
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        result = everylot.run(state_path=str(tmp_path), capture=env.capture)
+
+    assert result["posted"]
+    post, reply = env.atproto.posts
+    assert "Image dates:" in post["text"]
+    assert len(post["embed"]["images"]) == 2
+    assert reply["reply"]["parent"]["uri"].startswith("at://")
+    assert (tmp_path / "ledger.json").exists()
+
+
+def test_offline_runs_are_deterministic(tmp_path):
+    results = []
+    for name in ("a", "b"):
+        with offline(seed=3, parcels=200, coverage=0.5) as env:
+            results.append(everylot.run(state_path=str(tmp_path / name), capture=env.capture))
+    assert results[0] == results[1]
+
+
+def test_recorded_run_replays_without_stand_in(tmp_path):
+    recording = str(tmp_path / "recording.json")
+    with offline(seed=2, parcels=200, coverage=0.5) as env:
+        with RecordingTransport(env.transport, recording) as recorder, transport.using(recorder):
+            recorded = everylot.run(state_path=str(tmp_path / "live"), capture=env.capture)
+
+    with offline(seed=2, parcels=200, coverage=0.5) as env:
+        replay = ReplayTransport(recording)
+        with transport.using(replay):
+            replayed = everylot.run(state_path=str(tmp_path / "replay"), capture=env.capture)
+
+    assert replayed == recorded
+    assert replay.misses == []
+
+
+class MapillaryDown:
+    """Fails every Mapillary search; other requests reach the transport behind it."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        if url.startswith(everylot.MAPILLARY_IMAGES_URL):
+            return transport.json_response(url, {"error": {"message": "down"}}, status_code=500)
+        return self.inner.get(url, params=params, timeout=timeout, **kwargs)
+
+
+def test_mapillary_outage_doesnt_mark_parcels_unusable(tmp_path):
+    run_manifest = RunManifest()
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        with transport.using(MapillaryDown(env.transport)):
+            result = everylot.run(state_path=str(tmp_path), capture=env.capture, manifest=run_manifest)
+
+    assert not result["posted"]
+    assert {c["outcome"] for c in run_manifest.candidates} == {"network"}
+    ledger = everylot.Ledger.load(str(tmp_path / everylot.LEDGER_FILE))
+    assert not any(ledger.should_skip(c["object_id"]) for c in run_manifest.candidates)
+
+
+def test_benchmark_reports_requests_per_post():
+    report = run_benchmark(runs=2, seed=1, parcels=200, coverage=0.5, profile="instant")
+    assert report["posts"] >= 1
+    assert report["requests_per_post"] > 0
+    assert report["stages"]["parcel_fetch"]["count"] == report["candidates"]
+    assert report["candidates"] >= report["attempts"]
+
+
+def test_probe_first_skips_lookups_without_imagery(tmp_path, monkeypatch):
+    monkeypatch.setattr(everylot, "STAGE_ORDER", "probe-first")
+    metrics.reset()
+    with offline(seed=1, parcels=200, coverage=0.0) as env:
+        result = everylot.run(state_path=str(tmp_path), capture=env.capture)
+
+    stages = metrics.summary()["stages"]
+    assert not result["posted"]
+    assert stages["mapillary"]["count"] == result["attempts"]
+    assert "geocode" not in stages
+
+
+def test_probe_first_needs_fewer_requests_per_attempt():
+    reports = compare_stage_orders(runs=2, seed=1, parcels=200, coverage=0.5, profile="instant")
+    assert (
+        reports["probe-first"]["requests_per_attempt"]
+        < reports["anchor-first"]["requests_per_attempt"]
+    )
+
+
+def test_probe_passes_every_parcel_the_anchor_search_pairs(monkeypatch):
+    # On this city the frontage anchors of offsets 120-139 sit ~25m from their
+    # centroids, beyond a probe box only as wide as the widest search box.
+    monkeypatch.setattr(everylot, "STAGE_ORDER", "anchor-first")
+    with offline(seed=0, parcels=400, coverage=0.5):
+        for offset in range(115, 145):
+            parcel = everylot.get_parcel(offset)
+            if isinstance(_selection_or_skip(everylot.select_pair, parcel), dict):
+                _, _, centroid = everylot._parcel_basics(parcel)
+                everylot.probe_mapillary(centroid)
+
+
+def _selection_or_skip(select, parcel):
+    try:
+        return select(parcel)
+    except everylot.SkipParcel as e:
+        return e.category
+
+
+def test_async_selection_matches_sync():
+    import asyncio
+
+    with offline(seed=1, parcels=60, coverage=0.5) as env:
+        parcels = env.city.parcels.features
+        synced = [_selection_or_skip(everylot.select_pair, p) for p in parcels]
+
+        async def select_all():
+            results = []
+            for parcel in parcels:
+                try:
+                    results.append(await everylot.select_pair_async(parcel))
+                except everylot.SkipParcel as e:
+                    results.append(e.category)
+            return results
+
+        awaited = asyncio.run(select_all())
+
+    assert awaited == synced
+    assert any(isinstance(result, dict) for result in synced)
+
+
+def test_candidates_are_prepared_while_a_capture_is_in_flight(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(everylot, "PREFETCH_CANDIDATES", 2)
+    metrics.reset()
+    fetched = []
+
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+
+        async def flaky_capture(shots):
+            fetched.append(metrics.summary()["stages"]["parcel_fetch"]["count"])
+            if len(fetched) == 1:
+                await asyncio.sleep(0.2)
+                fetched.append(metrics.summary()["stages"]["parcel_fetch"]["count"])
+                raise RuntimeError("browser crashed")
+            await env.capture(shots)
+
+        result = everylot.run(state_path=str(tmp_path), capture=flaky_capture)
+
+    assert result["posted"]
+    # The first capture failed, but the next candidates were fetched while it ran.
+    assert fetched[1] > fetched[0]
+    assert metrics.summary()["skips"]["screenshot_failed"] == 1
+
+
+def test_missing_pair_screenshot_leaves_no_series_images_behind(tmp_path):
+    import asyncio
+
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        selection = everylot.select_pair(everylot.get_parcel(24))
+        before = selection["before"]["image_id"]
+
+        async def capture_all_but_before(shots):
+            await env.capture([shot for shot in shots if shot[0] != before])
+
+        with pytest.raises(everylot.SkipParcel):
+            asyncio.run(everylot.build_post(selection, capture_all_but_before, layout="carousel"))
+
+    assert len(selection["series"]) > 2
+    assert not glob.glob(f"{everylot.PROJECT_PATH}/{selection['object_id']}_*.png")
+
+
+def test_leftover_candidates_finish_after_the_post(tmp_path, monkeypatch):
+    import asyncio
+
+    import bluesky
+
+    monkeypatch.setattr(everylot, "PREFETCH_CANDIDATES", 2)
+    events = []
+    prepare, post = everylot.prepare_candidate, bluesky.post_to_bluesky
+
+    async def slow_prepare(draw, *args, **kwargs):
+        offsets = []
+
+        def recorded_draw():
+            offset, record = draw()
+            offsets.append(offset)
+            return offset, record
+
+        try:
+            return await prepare(recorded_draw, *args, **kwargs)
+        finally:
+            await asyncio.sleep(0.2)
+            events.extend(offsets)
+
+    def recorded_post(*args, **kwargs):
+        events.append("post")
+        return post(*args, **kwargs)
+
+    monkeypatch.setattr(everylot, "prepare_candidate", slow_prepare)
+    monkeypatch.setattr(bluesky, "post_to_bluesky", recorded_post)
+    run_manifest = RunManifest()
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        result = everylot.run(state_path=str(tmp_path), capture=env.capture, manifest=run_manifest)
+
+    assert result["posted"]
+    outcomes = [c["outcome"] for c in run_manifest.candidates]
+    leftovers = [c["offset"] for c in run_manifest.candidates[outcomes.index("selected") + 1:]]
+    assert leftovers
+    # Posted without waiting for the candidates prepared ahead.
+    assert events.index("post") < min(events.index(offset) for offset in leftovers)
+    # The viable ones go back to the sampler, to be drawn first next run.
+    unused = [c["offset"] for c in run_manifest.candidates if c["outcome"] == "unused"]
+    with open(tmp_path / everylot.SAMPLER_FILE) as f:
+        assert json.load(f)["requeued"] == unused
+
+
+def test_parcels_in_the_ledger_are_redrawn_without_using_an_attempt(tmp_path, monkeypatch):
+    from ledger import Ledger
+    from sampling import FixedSampler
+
+    monkeypatch.setattr(everylot, "PREFETCH_CANDIDATES", 0)
+    metrics.reset()
+    run_manifest = RunManifest()
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        ledger = Ledger()
+        passed_over = [env.city.parcels.features[i]["properties"]["ObjectId"] for i in (3, 5, 7)]
+        for object_id in passed_over:
+            ledger.mark_unusable(object_id)
+        ledger.save(str(tmp_path / everylot.LEDGER_FILE))
+        result = everylot.run(
+            state_path=str(tmp_path), capture=env.capture, manifest=run_manifest,
+            sampler=FixedSampler([3, 5, 7, 24]), post=False,
+        )
+
+    assert result["attempts"] == 1
+    assert result["object_id"] is not None
+    assert [(c["offset"], c["outcome"]) for c in run_manifest.candidates] == [
+        (3, "in_ledger"), (5, "in_ledger"), (7, "in_ledger"), (24, "selected"),
+    ]
+    assert [c["object_id"] for c in run_manifest.candidates[:3]] == passed_over
+    assert metrics.summary()["counters"]["ledger_redraws"] == 3
+    assert "in_ledger" not in metrics.summary()["skips"]
+
+
+def test_parcel_fetch_asks_for_post_fields_and_a_centroid():
+    with offline(seed=1, parcels=50, coverage=0.5) as env:
+        parcel = everylot.get_parcel(3)
+        expected = env.city.parcels.features[3]
+
+    assert set(parcel["properties"]) <= set(everylot.PARCEL_FIELDS)
+    assert parcel["properties"]["ObjectId"] == expected["properties"]["ObjectId"]
+    assert parcel["geometry"] is None
+    centroid = shape(expected["geometry"]).centroid
+    assert parcel["centroid"] == pytest.approx([centroid.x, centroid.y])
+
+
+def test_parcel_fetch_falls_back_to_geometry_without_centroids():
+    class NoCentroids:
+        def __init__(self, inner):
+            self.inner = inner
+
+        def get(self, url, params=None, timeout=30, **kwargs):
+            if params.get("returnCentroid"):
+                return transport.json_response(url, {"error": {"code": 400, "message": "nope"}})
+            return self.inner.get(url, params=params, timeout=timeout, **kwargs)
+
+    with offline(seed=1, parcels=50, coverage=0.5) as env, transport.using(NoCentroids(env.transport)):
+        parcel = everylot.get_parcel(3)
+
+    assert parcel["geometry"]["type"] in ("Polygon", "MultiPolygon")
+    assert set(parcel["properties"]) <= set(everylot.PARCEL_FIELDS)
+
+
+def test_carousel_posts_the_era_series_in_one_post(tmp_path, monkeypatch):
+    monkeypatch.setattr(everylot, "POST_LAYOUT", "carousel")
+    metrics.reset()
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        result = everylot.run(state_path=str(tmp_path), capture=env.capture)
+
+    assert result["posted"]
+    post, reply = env.atproto.posts
+    assert 2 < len(post["embed"]["images"]) <= 4
+    assert "oldest first" in post["text"]
+    # The reply links just the pair, within Bluesky's limit, and the series
+    # takes no extra requests.
+    assert reply["text"].count("mapillary.com") == 2
+    assert len(reply["text"]) <= everylot.MAX_POST_TEXT
+    assert metrics.summary()["stages"]["screenshots"]["count"] == 1
+
+
+def test_follow_up_posts_the_rest_of_the_series_as_a_reply(tmp_path, monkeypatch):
+    monkeypatch.setattr(everylot, "POST_LAYOUT", "follow-up")
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        result = everylot.run(state_path=str(tmp_path), capture=env.capture)
+
+    assert result["posted"]
+    post, reply, follow_up = env.atproto.posts
+    assert len(post["embed"]["images"]) == 2
+    assert "on left" in post["text"]
+    assert 1 <= len(follow_up["embed"]["images"]) <= 2
+    assert reply["text"].count("mapillary.com") == 2
+    assert follow_up["reply"]["parent"]["uri"] == reply["reply"]["parent"]["uri"]
+    # Every screenshot is cleaned up, the follow-up's too.
+    assert not glob.glob(f"{everylot.PROJECT_PATH}/{result['object_id']}_*.png")
+
+
+def test_manifest_records_the_run_and_replays_it(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = RunManifest(settings=everylot.run_settings())
+    with offline(seed=4, parcels=200, coverage=0.5) as env:
+        with RecordingTransport(env.transport, responses_path(path)) as recorder, transport.using(recorder):
+            result = everylot.run(
+                state_path=str(tmp_path / "state"), capture=env.capture, seed=7, manifest=manifest
+            )
+        manifest.save(path, outcome=result, summary=metrics.summary())
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved["seed"] == 7
+    assert saved["outcome"] == result
+    selected = [c for c in saved["candidates"] if c["outcome"] == "selected"]
+    assert [c["object_id"] for c in selected] == [result["object_id"]]
+    assert len(selected[0]["images"]) >= 2
+    assert "parcel_fetch" in saved["summary"]["stages"]
+
+    with offline(seed=4, parcels=200, coverage=0.5) as env:
+        replayed = everylot.replay(path, capture=env.capture)
+        assert env.atproto.posts == []
+
+    assert replayed["matches"]
+    assert replayed["misses"] == 0
+    assert replayed["object_id"] == result["object_id"]
+    assert not replayed["posted"]
+
+
+def test_replay_that_draws_past_the_recording_ends_without_a_match(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = RunManifest(settings=everylot.run_settings())
+    with offline(seed=4, parcels=200, coverage=0.5) as env:
+        with RecordingTransport(env.transport, responses_path(path)) as recorder, transport.using(recorder):
+            everylot.run(state_path=str(tmp_path / "state"), capture=env.capture, manifest=manifest)
+        # As if the recorded run had stopped after its first candidate.
+        manifest.candidates = manifest.candidates[:1]
+        manifest.save(path)
+        replayed = everylot.replay(path, capture=env.capture)
+
+    assert not replayed["matches"]
+    assert not replayed["posted"]
+
+
+def test_seeded_coverage_sampling_is_repeatable(tmp_path, monkeypatch):
+    monkeypatch.setattr(everylot, "SAMPLER", "coverage")
+    offsets = []
+    for name in ("a", "b"):
+        manifest = RunManifest()
+        with offline(seed=5, parcels=200, coverage=0.5) as env:
+            everylot.run(state_path=str(tmp_path / name), capture=env.capture, seed=11, manifest=manifest)
+        offsets.append(manifest.offsets())
+    assert offsets[0] == offsets[1]
@@ -0,0 +1,84 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import everylot
+import panorama
+from screenshot_cache import shot_key
+from standins import THUMBNAIL_SIZE, offline, panorama_pixels
+
+
+def synthetic_pano():
+    width, height = THUMBNAIL_SIZE
+    rows = panorama_pixels(width, height)
+    return np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(height, width, 3)
+
+
+def test_field_of_view_narrows_with_zoom():
+    assert panorama.field_of_view(0) == pytest.approx(panorama.BASE_FOV)
+    assert panorama.field_of_view(1) < panorama.field_of_view(0.7) < panorama.BASE_FOV
+
+
+def test_view_is_centered_on_the_viewer_center():
+    for center_x, center_y in [(0.5, 0.5), (0.2, 0.4), (0.9, 0.6)]:
+        u, v = panorama.view_coordinates(center_x, center_y, 5, 5, 60)
+        assert u[2, 2] == pytest.approx(center_x)
+        assert v[2, 2] == pytest.approx(center_y)
+        # Right is further along the panorama, and up is toward the top.
+        assert (u[2, 3] - u[2, 2]) % 1 < 0.5
+        assert v[1, 2] < v[2, 2]
+
+
+def test_view_wraps_around_the_seam():
+    u, _ = panorama.view_coordinates(0.99, 0.5, 9, 9, 90)
+    assert 0.8 < u[4, 0] < 0.99
+    assert 0.01 < u[4, -1] < 0.2
+
+
+def test_rendered_view_samples_around_the_center():
+    pano = synthetic_pano()
+    view = panorama.render_view(pano, 0.25, 0.5, width=31, height=21)
+
+    assert view.shape == (21, 31, 3)
+    red, green = view[10, 15, :2]
+    assert red == pytest.approx(255 * 0.25, abs=3)
+    assert green == pytest.approx(255 * 0.5, abs=3)
+    # Red ramps left to right across the view, green top to bottom.
+    assert (np.diff(view[10, :, 0].astype(int)) >= 0).all()
+    assert (np.diff(view[:, 15, 1].astype(int)) >= 0).all()
+
+
+def test_fetch_downloads_the_thumbnail_from_the_graph_api():
+    with offline(seed=1, parcels=40, coverage=1.0) as env:
+        image_id = env.city.images[0]["id"]
+        content = asyncio.run(panorama.fetch_panorama(image_id))
+    assert content.startswith(b"\x89PNG")
+
+
+def test_a_failed_download_doesnt_lose_the_other_shots(tmp_path):
+    pytest.importorskip("PIL")
+    with offline(seed=1, parcels=40, coverage=1.0) as env:
+        image_id = env.city.images[0]["id"]
+        shots = [
+            ("missing", 0.5, 0.5, str(tmp_path / "missing.png")),
+            (image_id, 0.5, 0.5, str(tmp_path / "found.png")),
+        ]
+        asyncio.run(panorama.capture_panoramas(shots))
+
+    assert (tmp_path / "found.png").exists()
+    assert not (tmp_path / "missing.png").exists()
+
+
+def test_panorama_shots_are_cached_apart_from_browser_shots():
+    assert shot_key("a", 0.5, 0.5, panorama.RENDERER) != shot_key("a", 0.5, 0.5)
+
+
+def test_run_posts_with_panorama_backend_offline(tmp_path, monkeypatch):
+    pytest.importorskip("PIL")
+    monkeypatch.setattr(everylot, "CAPTURE_BACKEND", "panorama")
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        result = everylot.run(state_path=str(tmp_path))
+
+    assert result["posted"]
+    assert len(env.atproto.posts[0]["embed"]["images"]) == 2
@@ -0,0 +1,110 @@
+import struct
+
+import pytest
+
+from pbf import decode_feature_collection
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, payload):
+    """A length-delimited field."""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _varint_field(number, value):
+    return _varint(number << 3) + _varint(value)
+
+
+def _double_field(number, value):
+    return _varint(number << 3 | 1) + struct.pack("<d", value)
+
+
+def _geometry(lengths, deltas):
+    return _field(2, b"".join(_varint(n) for n in lengths)) + _field(
+        3, b"".join(_varint(_zigzag(d)) for d in deltas)
+    )
+
+
+def _collection(geometry_type, fields, features, transform):
+    # Like a proto3 encoder, leave geometryType out when it's 0 (point).
+    result = _varint_field(7, geometry_type) if geometry_type else b""
+    result += _field(12, transform)
+    result += b"".join(_field(13, _field(1, name.encode())) for name in fields)
+    result += b"".join(_field(15, feature) for feature in features)
+    return _field(2, _field(1, result))
+
+
+# Lower-left origin, 0.5 units per step, origin at (10, 20).
+TRANSFORM = (
+    _varint_field(1, 1)
+    + _field(2, _double_field(1, 0.5) + _double_field(2, 0.5))
+    + _field(3, _double_field(1, 10.0) + _double_field(2, 20.0))
+)
+
+
+def test_decodes_attributes_and_point_without_geometry_type():
+    feature = (
+        _field(1, _field(1, b"123 Main St"))
+        + _field(1, _varint_field(4, _zigzag(-7)))
+        + _field(2, _geometry([1], [2, 4]))
+    )
+    features, exceeded = decode_feature_collection(
+        _collection(0, ["address", "delta"], [feature], TRANSFORM)
+    )
+    assert not exceeded
+    assert features[0]["properties"] == {"address": "123 Main St", "delta": -7}
+    assert features[0]["geometry"] == {"type": "Point", "coordinates": [11.0, 22.0]}
+
+
+def test_decodes_delta_encoded_polygon_and_centroid():
+    # A clockwise square (outer ring) from (0,0) to (2,2) in quantized units.
+    ring = [0, 0, 0, 2, 2, 0, 0, -2, -2, 0]
+    feature = _field(2, _geometry([5], ring)) + _field(4, _geometry([1], [1, 1]))
+    features, _ = decode_feature_collection(_collection(3, [], [feature], TRANSFORM))
+
+    geometry = features[0]["geometry"]
+    assert geometry["type"] == "Polygon"
+    assert geometry["coordinates"][0] == [
+        [10.0, 20.0], [10.0, 21.0], [11.0, 21.0], [11.0, 20.0], [10.0, 20.0]
+    ]
+    assert features[0]["centroid"] == [10.5, 20.5]
+
+
+def test_upper_left_origin_flips_y():
+    transform = (
+        _varint_field(1, 0)
+        + _field(2, _double_field(1, 1.0) + _double_field(2, 1.0))
+        + _field(3, _double_field(1, 0.0) + _double_field(2, 100.0))
+    )
+    feature = _field(2, _geometry([1], [3, 4]))
+    features, _ = decode_feature_collection(_collection(0, [], [feature], transform))
+    assert features[0]["geometry"]["coordinates"] == [3.0, 96.0]
+
+
+def test_polyline_parts_become_multilinestring():
+    feature = _field(2, _geometry([2, 2], [0, 0, 2, 0, 0, 2, 2, 0]))
+    features, _ = decode_feature_collection(_collection(2, [], [feature], TRANSFORM))
+    assert features[0]["geometry"] == {
+        "type": "MultiLineString",
+        "coordinates": [[[10.0, 20.0], [11.0, 20.0]], [[11.0, 21.0], [12.0, 21.0]]],
+    }
+
+
+def test_json_error_body_is_rejected():
+    with pytest.raises(ValueError):
+        decode_feature_collection(b'{"error": {"code": 400}}')
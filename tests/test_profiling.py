@@ -0,0 +1,56 @@
+import os
+import pstats
+
+import pytest
+
+import everylot
+import profiling
+from standins import offline
+
+
+@pytest.fixture
+def profile_dir(tmp_path):
+    yield tmp_path
+    profiling.disable()
+
+
+def test_sections_are_no_ops_when_disabled(tmp_path):
+    with profiling.section("attempt-01"):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cprofile_section_writes_stats_and_text(profile_dir):
+    run_dir = profiling.enable(str(profile_dir), "cprofile")
+    with profiling.section("attempt-01"):
+        sum(range(1000))
+
+    stats = pstats.Stats(f"{run_dir}/attempt-01.prof")
+    assert stats.total_calls > 0
+    assert "cumulative" in open(f"{run_dir}/attempt-01.txt").read()
+
+
+def test_nested_sections_fold_into_the_outer_profile(profile_dir):
+    run_dir = profiling.enable(str(profile_dir), "cprofile")
+    with profiling.section("outer"):
+        with profiling.section("inner"):
+            pass
+    assert sorted(p.name for p in profile_dir.joinpath(run_dir).iterdir()) == [
+        "outer.prof",
+        "outer.txt",
+    ]
+
+
+def test_unknown_backend_is_rejected(profile_dir):
+    with pytest.raises(ValueError):
+        profiling.enable(str(profile_dir), "perf")
+
+
+def test_profiled_run_writes_one_profile_per_attempt(tmp_path, profile_dir):
+    run_dir = profiling.enable(str(profile_dir / "profiles"), "cprofile")
+    with offline(seed=1, parcels=200, coverage=0.5) as env:
+        result = everylot.run(state_path=str(tmp_path / "state"), capture=env.capture)
+
+    written = {p.rsplit(".", 1)[0] for p in os.listdir(run_dir)}
+    expected = {f"attempt-{n:02d}" for n in range(1, result["attempts"] + 1)} | {"post"}
+    assert written == expected
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+import requests
+
+import transport
+from everylot import get_mapillary_images
+from ratelimit import HostLimiter, RateLimitedTransport, Throttled, retry_after_seconds
+
+
+class ScriptedTransport:
+    """Answers each request with the next (status, headers) in script."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        status, headers = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        return transport.json_response(url, {"data": []}, status, headers)
+
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    assert retry_after_seconds("2") == 2.0
+    assert retry_after_seconds("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480) == 10.0
+    assert retry_after_seconds("soon") is None
+    assert retry_after_seconds(None) is None
+
+
+def test_token_bucket_spaces_requests_past_the_burst():
+    limiter = HostLimiter("x", rate=10.0, burst=2, max_concurrency=4)
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == 0
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.01)
+
+
+def test_concurrency_limit_halves_on_throttle_and_grows_back():
+    limiter = HostLimiter("x", rate=10.0, burst=2, max_concurrency=8, initial_concurrency=4)
+    assert limiter.record(transport.json_response("https://x", {}, 429))
+    assert limiter.stats()["concurrency_limit"] == 2
+    for _ in range(10):
+        assert not limiter.record(transport.json_response("https://x", {}))
+    assert limiter.stats()["concurrency_limit"] > 2
+
+
+def test_throttled_request_is_retried_after_retry_after():
+    inner = ScriptedTransport((429, {"Retry-After": "0"}), (200, {}))
+    limited = RateLimitedTransport(inner)
+
+    assert limited.get("https://graph.mapillary.com/images").status_code == 200
+    assert inner.calls == 2
+    stats = limited.stats()["graph.mapillary.com"]
+    assert stats["throttled"] == 1
+    assert stats["retries"] == 1
+
+
+def test_persistent_throttling_raises_throttled():
+    limited = RateLimitedTransport(ScriptedTransport((429, {"Retry-After": "0"})), max_retries=1)
+    with pytest.raises(Throttled) as raised:
+        limited.get("https://graph.mapillary.com/images")
+    assert isinstance(raised.value, requests.exceptions.RequestException)
+    assert raised.value.host == "graph.mapillary.com"
+
+
+def test_long_retry_after_is_not_waited_out():
+    limited = RateLimitedTransport(ScriptedTransport((429, {"Retry-After": "3600"}), (200, {})))
+    with pytest.raises(Throttled) as raised:
+        limited.get("https://graph.mapillary.com/images")
+    assert raised.value.retry_after == 3600.0
+
+
+def test_async_requests_share_the_limits():
+    inner = ScriptedTransport((503, {"Retry-After": "0"}), (200, {}))
+    limited = RateLimitedTransport(inner)
+
+    async def fetch_all():
+        return await asyncio.gather(*(limited.aget("https://x/q") for _ in range(6)))
+
+    responses = asyncio.run(fetch_all())
+    assert [r.status_code for r in responses] == [200] * 6
+    assert limited.stats()["x"]["in_flight"] == 0
+
+
+def test_throttled_mapillary_search_is_not_an_empty_result(monkeypatch):
+    monkeypatch.setenv("MAPILLARY_ACCESS_TOKEN", "token")
+    limited = RateLimitedTransport(ScriptedTransport((429, {})), max_retries=0)
+    with transport.using(limited), pytest.raises(Throttled):
+        get_mapillary_images(-83.0, 42.3)
@@ -0,0 +1,119 @@
+import random
+
+import pytest
+
+from sampling import AliasTable, CoverageModel, CoverageSampler, PermutationSampler
+
+
+def test_permutation_visits_every_offset_once():
+    sampler = PermutationSampler(1000, seed=7)
+    offsets = [sampler.next_offset() for _ in range(1000)]
+    assert sorted(offsets) == list(range(1000))
+
+
+def test_permutation_handles_tiny_counts():
+    sampler = PermutationSampler(1, seed=3)
+    assert [sampler.next_offset() for _ in range(3)] == [0, 0, 0]
+
+
+def test_same_seed_gives_same_order():
+    a = PermutationSampler(500, seed=42)
+    b = PermutationSampler(500, seed=42)
+    assert [a.next_offset() for _ in range(50)] == [b.next_offset() for _ in range(50)]
+
+
+def test_next_pass_is_reshuffled():
+    sampler = PermutationSampler(200, seed=1)
+    first = [sampler.next_offset() for _ in range(200)]
+    second = [sampler.next_offset() for _ in range(200)]
+    assert sorted(second) == list(range(200))
+    assert second != first
+    assert sampler.epoch == 1
+
+
+def test_save_and_load_resumes_walk(tmp_path):
+    path = str(tmp_path / "sampler.json")
+    sampler = PermutationSampler(300, seed=9)
+    seen = [sampler.next_offset() for _ in range(120)]
+    sampler.save(path)
+
+    resumed = PermutationSampler.load(path, 300)
+    seen += [resumed.next_offset() for _ in range(180)]
+    assert sorted(seen) == list(range(300))
+
+
+def test_requeued_offsets_are_drawn_again_first(tmp_path):
+    path = str(tmp_path / "sampler.json")
+    sampler = PermutationSampler(300, seed=9)
+    drawn = [sampler.next_offset() for _ in range(3)]
+    sampler.requeue(drawn[1])
+    sampler.save(path)
+
+    resumed = PermutationSampler.load(path, 300)
+    assert resumed.next_offset() == drawn[1]
+    seen = drawn + [resumed.next_offset() for _ in range(297)]
+    assert sorted(seen) == list(range(300))
+
+
+def test_load_with_changed_count_keeps_walking(tmp_path):
+    path = str(tmp_path / "sampler.json")
+    sampler = PermutationSampler(300, seed=9)
+    seen = [sampler.next_offset() for _ in range(100)]
+    sampler.save(path)
+
+    # A few parcels disappeared: the pass carries on, skipping offsets that
+    # are now out of range, and the next pass is sized to the new count.
+    resumed = PermutationSampler.load(path, 290)
+    while resumed.epoch == 0:
+        seen.append(resumed.next_offset())
+    next_pass = [seen.pop()]
+
+    assert len(set(seen)) == len(seen)
+    assert set(range(290)) <= set(seen)
+
+    next_pass += [resumed.next_offset() for _ in range(289)]
+    assert sorted(next_pass) == list(range(290))
+
+
+def test_alias_table_matches_weights():
+    table = AliasTable([1, 0, 3])
+    rng = random.Random(0)
+    draws = [table.draw(rng) for _ in range(20000)]
+    assert draws.count(1) == 0
+    assert draws.count(2) / len(draws) == pytest.approx(0.75, abs=0.02)
+
+
+def test_coverage_model_learns_block_success_rates():
+    model = CoverageModel(1024, block_size=512)
+    for _ in range(20):
+        model.record(10, success=True)
+        model.record(600, success=False)
+    assert model.success_rate(0) > model.success_rate(1)
+    assert model.observed_attempts_per_success() == pytest.approx(2.0)
+
+
+def test_coverage_sampler_favors_productive_blocks_with_floor():
+    model = CoverageModel(1024, block_size=512)
+    for _ in range(200):
+        model.record(10, success=True)
+        model.record(600, success=False)
+
+    sampler = CoverageSampler(model, floor=0.05, rng=random.Random(1))
+    offsets = [sampler.next_offset() for _ in range(5000)]
+    in_second_block = sum(1 for offset in offsets if offset >= 512)
+    assert all(0 <= offset < 1024 for offset in offsets)
+    assert 0 < in_second_block < len(offsets) * 0.2
+    assert sampler.last_offset == offsets[-1]
+    assert sampler.expected_attempts_per_success() < 1 / model.success_rate(1)
+
+
+def test_coverage_model_survives_count_change(tmp_path):
+    path = str(tmp_path / "coverage.json")
+    model = CoverageModel(1024)
+    model.record(5, success=True)
+    model.save(path)
+
+    resumed = CoverageModel.load(path, 1100)
+    assert resumed.count == 1100
+    assert resumed.successes[0] == 1
+    assert resumed.blocks == 3
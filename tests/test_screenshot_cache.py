@@ -0,0 +1,72 @@
+import asyncio
+import os
+import time
+
+from screenshot_cache import ScreenshotCache, cached, shot_key
+
+
+class CountingCapture:
+    def __init__(self):
+        self.rendered = []
+
+    async def __call__(self, shots):
+        for image_key, center_x, center_y, output_path in shots:
+            self.rendered.append(image_key)
+            with open(output_path, "wb") as f:
+                f.write(f"{image_key}@{center_x},{center_y}".encode())
+
+
+def test_cached_shots_skip_the_capture(tmp_path):
+    capture = CountingCapture()
+    cache = ScreenshotCache(str(tmp_path / "cache"))
+    shots = [("a", 0.5, 0.5, str(tmp_path / "a.png")), ("b", 0.25, 0.5, str(tmp_path / "b.png"))]
+
+    asyncio.run(cached(capture, cache)(shots))
+    for _, _, _, path in shots:
+        os.remove(path)
+    asyncio.run(cached(capture, cache)(shots))
+
+    assert capture.rendered == ["a", "b"]
+    assert open(tmp_path / "b.png", "rb").read() == b"b@0.25,0.5"
+
+
+def test_key_depends_on_center_but_not_float_noise():
+    assert shot_key("a", 0.5, 0.5) == shot_key("a", 0.5 + 1e-12, 0.5)
+    assert shot_key("a", 0.5, 0.5) != shot_key("a", 0.51, 0.5)
+    assert shot_key("a", 0.5, 0.5) != shot_key("b", 0.5, 0.5)
+
+
+def test_failed_capture_keeps_the_shots_that_rendered(tmp_path):
+    async def first_only(shots):
+        with open(shots[0][3], "wb") as f:
+            f.write(b"png")
+        raise TimeoutError
+
+    cache = ScreenshotCache(str(tmp_path / "cache"))
+    shots = [("a", 0.5, 0.5, str(tmp_path / "a.png")), ("b", 0.5, 0.5, str(tmp_path / "b.png"))]
+    try:
+        asyncio.run(cached(first_only, cache)(shots))
+    except TimeoutError:
+        pass
+
+    assert os.path.exists(cache.path(shot_key("a", 0.5, 0.5)))
+    assert not os.path.exists(cache.path(shot_key("b", 0.5, 0.5)))
+
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = ScreenshotCache(str(tmp_path / "cache"), max_bytes=250)
+    source = tmp_path / "shot.png"
+    source.write_bytes(b"x" * 100)
+
+    cache.store("old", str(source))
+    cache.store("used", str(source))
+    past = time.time() - 60
+    os.utime(cache.path("old"), (past, past))
+    os.utime(cache.path("used"), (past - 1, past - 1))
+    # A hit makes "used" the most recent, so "old" goes first.
+    assert cache.fetch("used", str(tmp_path / "out.png"))
+    cache.store("new", str(source))
+
+    assert not os.path.exists(cache.path("old"))
+    assert os.path.exists(cache.path("used"))
+    assert os.path.exists(cache.path("new"))
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmark import HEAVY_MODULES, measure_startup
+
+PROJECT_PATH = Path(__file__).parent.parent
+
+
+def loaded_after(statement):
+    script = f"import sys\n{statement}\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        check=True,
+        cwd=PROJECT_PATH,
+        text=True,
+    ).stdout
+    return output.split()
+
+
+def test_importing_everylot_skips_heavy_dependencies():
+    assert loaded_after("import everylot") == []
+
+
+def test_state_and_sampling_need_no_heavy_dependencies(tmp_path):
+    statement = (
+        "import everylot\n"
+        f"ledger, coverage, sampler = everylot.load_state({str(tmp_path)!r}, 1000)\n"
+        "sampler.next_offset()\n"
+        f"everylot.save_state({str(tmp_path)!r}, ledger, coverage, sampler)"
+    )
+    assert loaded_after(statement) == []
+
+
+def test_measure_startup_reports_timings():
+    report = measure_startup(repeats=1)
+    assert report["median_seconds"] > 0
+    assert report["heavy_modules_loaded"] == []
@@ -0,0 +1,114 @@
+import base64
+import json
+
+import pytest
+import requests
+
+import transport
+from transport import RecordingTransport, ReplayTransport, json_response, request_key
+
+
+class EchoTransport:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        self.calls += 1
+        return json_response(url, {"call": self.calls, "params": params})
+
+
+def test_request_key_sorts_params_and_drops_secrets():
+    a = request_key("https://x/images", {"limit": 5, "access_token": "secret", "bbox": "1,2,3,4"})
+    b = request_key("https://x/images?bbox=1%2C2%2C3%2C4&access_token=other", {"limit": "5"})
+    assert a == b
+    assert "secret" not in a
+
+
+def test_record_then_replay_serves_responses_in_order(tmp_path):
+    path = str(tmp_path / "recording.json")
+    with RecordingTransport(EchoTransport(), path) as recorder:
+        recorder.get("https://x/q", {"a": 1})
+        recorder.get("https://x/q", {"a": 1})
+
+    replay = ReplayTransport(path)
+    assert replay.get("https://x/q", {"a": 1}).json()["call"] == 1
+    assert replay.get("https://x/q", {"a": 1}).json()["call"] == 2
+    # Once the recorded responses run out, the last one repeats.
+    assert replay.get("https://x/q", {"a": 1}).json()["call"] == 2
+
+
+def test_recorded_paging_links_drop_the_token_and_still_replay(tmp_path):
+    class Paged:
+        def get(self, url, params=None, timeout=30, **kwargs):
+            if "after=" in url:
+                return json_response(url, {"data": [2]})
+            return json_response(
+                url, {"data": [1], "paging": {"next": "https://x/images?access_token=MLY%7Csecret&bbox=1&after=1"}}
+            )
+
+    path = tmp_path / "recording.json"
+    with RecordingTransport(Paged(), str(path)) as recorder:
+        next_url = recorder.get("https://x/images", {"access_token": "MLY|secret", "bbox": "1"}).json()["paging"]["next"]
+        recorder.get(next_url)
+
+    replay = ReplayTransport(str(path))
+    next_url = replay.get("https://x/images", {"bbox": "1"}).json()["paging"]["next"]
+    assert next_url == "https://x/images?bbox=1&after=1"
+    assert replay.get(next_url).json()["data"] == [2]
+    bodies = [base64.b64decode(e["body"]) for e in json.loads(path.read_text())["entries"]]
+    assert not any(b"secret" in body for body in bodies)
+
+
+def test_replay_miss_is_a_connection_error(tmp_path):
+    path = str(tmp_path / "recording.json")
+    RecordingTransport(EchoTransport(), path).save()
+    replay = ReplayTransport(path)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        replay.get("https://x/never", {})
+    assert replay.misses == ["https://x/never"]
+
+
+def test_using_restores_previous_transport():
+    previous = transport.current()
+    echo = EchoTransport()
+    with transport.using(echo):
+        assert transport.get("https://x/q").json()["call"] == 1
+    assert transport.current() is previous
+
+
+def test_aget_runs_transports_without_one_in_a_thread():
+    import asyncio
+
+    echo = EchoTransport()
+    with transport.using(echo):
+        response = asyncio.run(transport.aget("https://x/q", {"a": 1}))
+    assert response.json() == {"call": 1, "params": {"a": 1}}
+
+
+def test_live_aget_returns_requests_responses_and_errors():
+    import asyncio
+
+    import httpx
+
+    def handler(request):
+        if request.url.path == "/down":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(503, json={"q": request.url.params["q"]})
+
+    async def fetch(live):
+        live.async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            response = await live.aget("https://x/up", {"q": "1"})
+            with pytest.raises(requests.exceptions.ConnectionError):
+                await live.aget("https://x/down")
+            return response
+        finally:
+            await live.aclose()
+
+    live = transport.LiveTransport()
+    response = asyncio.run(fetch(live))
+    assert isinstance(response, requests.Response)
+    assert response.json() == {"q": "1"}
+    with pytest.raises(requests.exceptions.HTTPError):
+        response.raise_for_status()
+    assert live.async_client is None
@@ -0,0 +1,271 @@
+"""The HTTP transport behind every ArcGIS and Mapillary request.
+
+Everything goes through transport.get, so a run can be pointed at something
+other than the live services: a recording of a live run (RecordingTransport
+writes one, ReplayTransport plays it back) or the local stand-ins in
+standins.py. The live transport reuses one pooled session for the whole run.
+
+transport.aget is the same for code running on an event loop (the posting run,
+see everylot.run). The live transport answers it from one shared
+httpx.AsyncClient; any other transport without an aget of its own has its get
+run in a worker thread, so recordings, replays and stand-ins work unchanged.
+Either way the caller gets a requests.Response and requests' exceptions.
+
+The live transport is installed behind ratelimit.RateLimitedTransport, which
+paces requests per host and raises ratelimit.Throttled when a service keeps
+rate limiting them.
+"""
+import base64
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import metrics
+import ratelimit
+
+logger = logging.getLogger("everylot.transport")
+
+# Query parameters that must never be written to a recording (and are ignored
+# when matching one, so a replay doesn't need the original secrets).
+REDACTED_PARAMS = {"access_token", "token"}
+
+# A REDACTED_PARAMS query parameter inside a response body, such as the token
+# in a Mapillary paging.next link, with the "&" after it if there is one.
+_REDACTED_IN_BODY = re.compile(
+    rb"([?&])(?:" + b"|".join(re.escape(p.encode()) for p in sorted(REDACTED_PARAMS)) + rb")=[^&\"'\s\\]*(&?)"
+)
+
+# Response headers worth keeping in a recording.
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+
+
+def request_key(url, params=None):
+    """Normalized "url?sorted-params" identifying a request, minus secrets.
+
+    Params may be passed separately or already in the URL (as in Mapillary's
+    paging links); both forms give the same key.
+    """
+    scheme, netloc, path, query, _ = urlsplit(url)
+    items = parse_qsl(query, keep_blank_values=True)
+    items += [(str(k), str(v)) for k, v in (params or {}).items()]
+    items = sorted((k, v) for k, v in items if k not in REDACTED_PARAMS)
+    return urlunsplit((scheme, netloc, path, urlencode(items), ""))
+
+
+def redact_url(url):
+    """url without any REDACTED_PARAMS in its query."""
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    items = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k not in REDACTED_PARAMS]
+    return urlunsplit((scheme, netloc, path, urlencode(items), fragment))
+
+
+def redact_body(content):
+    """content with the REDACTED_PARAMS stripped from any URL inside it, so a
+    response can be stored without the secrets its links carry."""
+    return _REDACTED_IN_BODY.sub(lambda m: m.group(1) if m.group(2) else b"", content)
+
+
+def make_response(url, status_code=200, content=b"", headers=None):
+    """Build a requests.Response, so stand-in and replayed responses behave
+    exactly like live ones (raise_for_status, json, content...)."""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = content
+    response.headers = CaseInsensitiveDict(headers or {})
+    response.url = url
+    response.encoding = "utf-8"
+    response.reason = "OK" if status_code < 400 else "Error"
+    return response
+
+
+def json_response(url, data, status_code=200, headers=None):
+    headers = {"Content-Type": "application/json", **(headers or {})}
+    return make_response(url, status_code, json.dumps(data).encode("utf-8"), headers)
+
+
+class LiveTransport:
+    """Real HTTP over a shared, connection-pooling requests session, and for
+    aget an httpx.AsyncClient, opened on first use and closed by aclose()."""
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.async_client = None
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        return self.session.get(url, params=params, timeout=timeout, **kwargs)
+
+    async def aget(self, url, params=None, timeout=30, **kwargs):
+        import httpx
+
+        # The client belongs to the loop it was opened on, so one is opened per
+        # run (event loop) and closed with it.
+        if self.async_client is None:
+            self.async_client = httpx.AsyncClient(follow_redirects=True)
+        try:
+            response = await self.async_client.get(url, params=params, timeout=timeout, **kwargs)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(f"{url}: {e!r}")
+        except httpx.RequestError as e:
+            raise requests.exceptions.ConnectionError(f"{url}: {e!r}")
+        return make_response(
+            str(response.url), response.status_code, response.content, response.headers
+        )
+
+    async def aclose(self):
+        if self.async_client is not None:
+            client, self.async_client = self.async_client, None
+            await client.aclose()
+
+
+class RecordingTransport:
+    """Pass requests through to another transport and record every response.
+
+    Call save() (or use as a context manager) to write the recording.
+    """
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        return self._record(url, params, self.inner.get(url, params=params, timeout=timeout, **kwargs))
+
+    async def aget(self, url, params=None, timeout=30, **kwargs):
+        if hasattr(self.inner, "aget"):
+            response = await self.inner.aget(url, params=params, timeout=timeout, **kwargs)
+        else:
+            import asyncio
+
+            response = await asyncio.to_thread(
+                self.inner.get, url, params=params, timeout=timeout, **kwargs
+            )
+        return self._record(url, params, response)
+
+    async def aclose(self):
+        if hasattr(self.inner, "aclose"):
+            await self.inner.aclose()
+
+    def _record(self, url, params, response):
+        entry = {
+            "key": request_key(url, params),
+            "status": response.status_code,
+            "headers": {h: response.headers[h] for h in RECORDED_HEADERS if h in response.headers},
+            "body": base64.b64encode(redact_body(response.content)).decode("ascii"),
+        }
+        with self._lock:
+            self.entries.append(entry)
+        return response
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"entries": self.entries}, f)
+        logger.info(f"Recorded {len(self.entries)} responses to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
+
+
+class ReplayTransport:
+    """Serve responses from a recording instead of the network.
+
+    Repeated requests get their recorded responses in order (the last one
+    repeats once they run out). A request that was never recorded raises
+    ConnectionError, which callers already treat as a network failure.
+    """
+
+    def __init__(self, path):
+        with open(path) as f:
+            entries = json.load(f)["entries"]
+        self.responses = {}
+        for entry in entries:
+            self.responses.setdefault(entry["key"], []).append(entry)
+        self.served = {}
+        self.misses = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=30, **kwargs):
+        key = request_key(url, params)
+        with self._lock:
+            recorded = self.responses.get(key)
+            if not recorded:
+                self.misses.append(key)
+                raise requests.exceptions.ConnectionError(f"No recorded response for {key}")
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+        entry = recorded[min(index, len(recorded) - 1)]
+        return make_response(
+            url, entry["status"], base64.b64decode(entry["body"]), entry["headers"]
+        )
+
+
+_transport = ratelimit.RateLimitedTransport(LiveTransport())
+
+
+def current():
+    return _transport
+
+
+def set_transport(transport):
+    """Install transport for all subsequent requests; returns the previous one."""
+    global _transport
+    previous, _transport = _transport, transport
+    return previous
+
+
+@contextlib.contextmanager
+def using(transport):
+    """Route requests through transport for the duration of the block."""
+    previous = set_transport(transport)
+    try:
+        yield transport
+    finally:
+        set_transport(previous)
+
+
+def get(url, params=None, timeout=30, **kwargs):
+    """GET through the installed transport (see module docstring)."""
+    metrics.count("http_requests")
+    return _transport.get(url, params=params, timeout=timeout, **kwargs)
+
+
+async def aget(url, params=None, timeout=30, **kwargs):
+    """transport.get for coroutines (see module docstring)."""
+    metrics.count("http_requests")
+    if hasattr(_transport, "aget"):
+        return await _transport.aget(url, params=params, timeout=timeout, **kwargs)
+
+    import asyncio
+
+    return await asyncio.to_thread(_transport.get, url, params=params, timeout=timeout, **kwargs)
+
+
+def rate_limit_stats():
+    """The installed transport's per-host rate limiter counters (see
+    ratelimit.py), or {} if it isn't rate limited."""
+    wrapped = _transport
+    # Look through wrappers (e.g. cache.CachingTransport) for the limiter.
+    while wrapped is not None:
+        if isinstance(wrapped, ratelimit.RateLimitedTransport):
+            return wrapped.stats()
+        wrapped = getattr(wrapped, "inner", None)
+    return {}
+
+
+async def aclose():
+    """Close the installed transport's async resources, if it has any. Call at
+    the end of each event loop that used aget."""
+    if hasattr(_transport, "aclose"):
+        await _transport.aclose()